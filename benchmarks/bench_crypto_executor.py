@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""Voucher throughput and latency of the lakers crypto executor.
+
+Runs decode_voucher_request + prepare_voucher for a batch of concurrent
+voucher requests, like a join storm would, and reports the throughput, the
+p50/p99 latency of each voucher and the worst event loop stall observed while
+the vouchers were being processed.
+
+    python benchmarks/bench_crypto_executor.py --requests 2000 --workers 1 --workers 4
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import click
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dotbot_authority")
+)
+
+from crypto_executor import CryptoExecutor, EXECUTOR_KINDS  # noqa: E402
+from devices import SimulatedDevice  # noqa: E402
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def _loop_lag(stop, interval=0.001):
+    """Measures how late the event loop wakes up while the vouchers run."""
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def _run(executor, voucher_requests, concurrency):
+    latencies = []
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def handle(voucher_request):
+        async with in_flight:
+            start = time.perf_counter()
+            await executor.decode_voucher_request(voucher_request)
+            await executor.prepare_voucher(voucher_request)
+            latencies.append(time.perf_counter() - start)
+
+    # warm up the workers (process pools spawn lazily)
+    await asyncio.gather(*[handle(vr) for vr in voucher_requests[: executor.workers]])
+    latencies.clear()
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(_loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[handle(vr) for vr in voucher_requests])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    return elapsed, latencies, await lag
+
+
+@click.command()
+@click.option("--requests", "count", type=int, default=1000, help="Number of vouchers")
+@click.option(
+    "--concurrency", type=int, default=64, help="Vouchers in flight at the same time"
+)
+@click.option(
+    "--kind",
+    "kinds",
+    type=click.Choice(EXECUTOR_KINDS),
+    multiple=True,
+    default=["inline", "thread", "process"],
+    help="Executor kinds to benchmark",
+)
+@click.option(
+    "--workers",
+    "workers_list",
+    type=int,
+    multiple=True,
+    default=[1, 4, os.cpu_count() or 1],
+    help="Worker counts to benchmark",
+)
+def main(count, concurrency, kinds, workers_list):
+    """Benchmarks the lakers crypto executor."""
+    voucher_request = SimulatedDevice(42).voucher_request()
+    voucher_requests = [voucher_request] * count
+    print(
+        f"{count} voucher requests, {concurrency} in flight, {os.cpu_count()} CPUs"
+    )
+    print(
+        f"{'executor':<10}{'workers':>8}{'vouchers/s':>12}"
+        f"{'p50 (ms)':>10}{'p99 (ms)':>10}{'max loop stall (ms)':>21}"
+    )
+    for kind in kinds:
+        for workers in sorted(set([1] if kind == "inline" else workers_list)):
+            executor = CryptoExecutor(kind, workers)
+            try:
+                elapsed, latencies, lag = asyncio.run(
+                    _run(executor, voucher_requests, concurrency)
+                )
+            finally:
+                executor.shutdown()
+            print(
+                f"{kind:<10}{workers:>8}{count / elapsed:>12.0f}"
+                f"{statistics.median(latencies) * 1e3:>10.2f}"
+                f"{percentile(latencies, 99) * 1e3:>10.2f}{lag * 1e3:>21.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""Evidence signature throughput of the evidence verifier.
+
+Checks the signatures of a burst of attestation tokens, like a swarm
+re-attesting after a firmware rollout, and reports the throughput, the p50/p99
+latency of each check, the mean batch size and the worst event loop stall
+observed while the signatures were being checked.
+
+    python benchmarks/bench_evidence.py --tokens 5000 --workers 1 --workers 4 --batch-size 1 --batch-size 64
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+import cbor2
+import click
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dotbot_authority")
+)
+
+from attestation_decoder import split_cose_sign1  # noqa: E402
+from crypto_executor import EXECUTOR_KINDS  # noqa: E402
+from evidence_verifier import EvidenceVerifier  # noqa: E402
+from bench_crypto_executor import _loop_lag, percentile  # noqa: E402
+from devices import SimulatedDevice  # noqa: E402
+
+
+def signed_tokens(count, devices=100):
+    """Returns (public key, signature, Sig_structure) of count tokens."""
+    fleet = [SimulatedDevice(index) for index in range(min(count, devices))]
+    items = []
+    for index in range(count):
+        device = fleet[index % len(fleet)]
+        _, token = cbor2.loads(device.evidence(os.urandom(8)))
+        message = split_cose_sign1(token)
+        items.append((device.public_key_bytes, message.signature, message.sig_structure()))
+    return items
+
+
+async def _run(verifier, items):
+    latencies = []
+
+    async def check(item):
+        start = time.perf_counter()
+        assert await verifier.verify(*item)
+        latencies.append(time.perf_counter() - start)
+
+    # warm up the workers (process pools spawn lazily)
+    await asyncio.gather(*[check(item) for item in items[: verifier.workers * 4]])
+    latencies.clear()
+    batches, verified = verifier.batches, verifier.verified
+
+    stop = asyncio.Event()
+    lag = asyncio.create_task(_loop_lag(stop))
+    start = time.perf_counter()
+    await asyncio.gather(*[check(item) for item in items])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    batches = verifier.batches - batches
+    mean_batch = (verifier.verified - verified) / batches if batches else 1.0
+    return elapsed, latencies, mean_batch, await lag
+
+
+@click.command()
+@click.option("--tokens", "count", type=int, default=2000, help="Number of tokens in the burst")
+@click.option(
+    "--kind",
+    "kinds",
+    type=click.Choice(EXECUTOR_KINDS),
+    multiple=True,
+    default=["inline", "thread", "process"],
+    help="Executor kinds to benchmark",
+)
+@click.option(
+    "--workers",
+    "workers_list",
+    type=int,
+    multiple=True,
+    default=[1, os.cpu_count() or 1],
+    help="Worker counts to benchmark",
+)
+@click.option(
+    "--batch-size",
+    "batch_sizes",
+    type=int,
+    multiple=True,
+    default=[1, 64],
+    help="Batch sizes to benchmark",
+)
+def main(count, kinds, workers_list, batch_sizes):
+    """Benchmarks the evidence verifier."""
+    items = signed_tokens(count)
+    print(f"{count} tokens, {os.cpu_count()} CPUs")
+    print(
+        f"{'executor':<10}{'workers':>8}{'batch':>7}{'tokens/s':>10}"
+        f"{'p50 (ms)':>10}{'p99 (ms)':>10}{'mean batch':>12}{'max loop stall (ms)':>21}"
+    )
+    for kind in kinds:
+        for workers in sorted(set([1] if kind == "inline" else workers_list)):
+            for batch_size in sorted(set([1] if kind == "inline" else batch_sizes)):
+                verifier = EvidenceVerifier(kind, workers, batch_size=batch_size)
+                try:
+                    elapsed, latencies, mean_batch, lag = asyncio.run(
+                        _run(verifier, items)
+                    )
+                finally:
+                    verifier.shutdown()
+                print(
+                    f"{kind:<10}{workers:>8}{batch_size:>7}{count / elapsed:>10.0f}"
+                    f"{percentile(latencies, 50) * 1e3:>10.2f}"
+                    f"{percentile(latencies, 99) * 1e3:>10.2f}"
+                    f"{mean_batch:>12.1f}{lag * 1e3:>21.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+"""Load test of the enrollment and attestation flows.
+
+A fleet of simulated DotBots goes through the voucher request, the
+attestation proposal and the evidence submission, against the FastAPI app
+either in-process through an ASGI transport, or over localhost HTTP or CoAP
+with the authority running in its own process. The throughput of onboarded devices,
+the p50/p99 latency of each endpoint and client stage, and the mean duration
+of each server stage (read from /metrics) are reported.
+
+Thresholds make the benchmark usable in CI, the exit code is 1 when they are
+not met:
+
+    python benchmarks/bench_flows.py --devices 500 --transport asgi \\
+        --max-p99 50 --min-throughput 100 --json results.json
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cbor2
+import click
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AUTHORITY_DIR = os.path.join(BENCH_DIR, "..", "dotbot_authority")
+sys.path.insert(0, AUTHORITY_DIR)
+
+from devices import SimulatedDevice, provision  # noqa: E402
+
+VOUCHER_REQUEST_PATH = "/.well-known/lake-authz/voucher-request"
+ATTESTATION_PROPOSAL_PATH = "/.well-known/lake-ra/attestation-proposal"
+EVIDENCE_PATH = "/.well-known/lake-ra/evidence"
+VOUCHER_REQUEST_BATCH_PATH = "/.well-known/lake-authz/voucher-request-batch"
+EVIDENCE_BATCH_PATH = "/.well-known/lake-ra/evidence-batch"
+HTTP_BASE_URL = "http://localhost:18000"
+COAP_PORT = 15683
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class Timings:
+    """Latencies of the endpoints and the client stages, in seconds."""
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, name, duration):
+        self.samples.setdefault(name, []).append(duration)
+
+    def error(self, name):
+        self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self):
+        return {
+            name: {
+                "count": len(values),
+                "errors": self.errors.get(name, 0),
+                "p50_ms": statistics.median(values) * 1e3,
+                "p99_ms": percentile(values, 99) * 1e3,
+                "mean_ms": statistics.mean(values) * 1e3,
+            }
+            for name, values in self.samples.items()
+        }
+
+
+async def _post(client, timings, path, content):
+    start = time.perf_counter()
+    response = await client.post(path, content=content)
+    timings.add(path, time.perf_counter() - start)
+    if response.status_code != 200:
+        timings.error(path)
+    return response
+
+
+class CoapResponse:
+    """Response of CoapClient, shaped like the one of httpx."""
+
+    def __init__(self, message):
+        code = message.code
+        self.status_code = 200 if code.is_successful() else code.class_ * 100 + code.detail
+        self.content = message.payload
+
+
+class CoapClient:
+    """Posts to the CoAP resources of the authority, and gets over HTTP."""
+
+    def __init__(self, context, http_client, host="127.0.0.1", port=COAP_PORT):
+        self.context = context
+        self.http_client = http_client
+        self.base_uri = f"coap://{host}:{port}"
+
+    async def post(self, path, content):
+        import aiocoap
+
+        request = aiocoap.Message(code=aiocoap.POST, uri=f"{self.base_uri}{path}", payload=content)
+        return CoapResponse(await self.context.request(request).response)
+
+    async def get(self, path):
+        return await self.http_client.get(path)
+
+
+async def onboard(client, timings, device, voucher_request):
+    """Runs the enrollment and attestation of one device, returns True on success."""
+    response = await _post(client, timings, VOUCHER_REQUEST_PATH, voucher_request)
+    if response.status_code != 200:
+        return False
+    response = await _post(
+        client, timings, ATTESTATION_PROPOSAL_PATH, device.attestation_proposal()
+    )
+    if response.status_code != 200:
+        return False
+    _, nonce = cbor2.loads(response.content)
+    start = time.perf_counter()
+    evidence = device.evidence(nonce)
+    timings.add("client: sign evidence", time.perf_counter() - start)
+    response = await _post(client, timings, EVIDENCE_PATH, evidence)
+    return response.status_code == 200 and cbor2.loads(response.content) == 0
+
+
+async def onboard_batch(client, timings, devices, voucher_requests):
+    """Runs the enrollment and attestation of devices through a gateway.
+
+    The voucher requests and the evidence go through the batch endpoints,
+    the attestation proposals are sent one by one.
+    """
+    response = await _post(
+        client, timings, VOUCHER_REQUEST_BATCH_PATH, cbor2.dumps(voucher_requests)
+    )
+    if response.status_code != 200:
+        return [False] * len(devices)
+    vouchers = cbor2.loads(response.content)
+    responses = await asyncio.gather(
+        *[
+            _post(client, timings, ATTESTATION_PROPOSAL_PATH, device.attestation_proposal())
+            for device in devices
+        ]
+    )
+    evidence = []
+    start = time.perf_counter()
+    for device, response in zip(devices, responses):
+        nonce = cbor2.loads(response.content)[1] if response.status_code == 200 else b""
+        evidence.append(cbor2.loads(device.evidence(nonce)))
+    timings.add("client: sign evidence", (time.perf_counter() - start) / len(devices))
+    response = await _post(client, timings, EVIDENCE_BATCH_PATH, cbor2.dumps(evidence))
+    if response.status_code != 200:
+        return [False] * len(devices)
+    return [
+        isinstance(voucher, bytes) and result == 0
+        for voucher, result in zip(vouchers, cbor2.loads(response.content))
+    ]
+
+
+async def run_fleet(client, devices, voucher_requests, concurrency, batch_size=0):
+    timings = Timings()
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def one(device, voucher_request):
+        async with in_flight:
+            start = time.perf_counter()
+            ok = await onboard(client, timings, device, voucher_request)
+            timings.add("flow: onboard device", time.perf_counter() - start)
+            if not ok:
+                timings.error("flow: onboard device")
+
+    async def batch(devices, voucher_requests):
+        async with in_flight:
+            start = time.perf_counter()
+            results = await onboard_batch(client, timings, devices, voucher_requests)
+            timings.add("flow: onboard batch", time.perf_counter() - start)
+            for ok in results:
+                if not ok:
+                    timings.error("flow: onboard batch")
+
+    start = time.perf_counter()
+    if batch_size:
+        await asyncio.gather(
+            *[
+                batch(devices[i : i + batch_size], voucher_requests[i : i + batch_size])
+                for i in range(0, len(devices), batch_size)
+            ]
+        )
+    else:
+        await asyncio.gather(*[one(d, vr) for d, vr in zip(devices, voucher_requests)])
+    elapsed = time.perf_counter() - start
+    response = await client.get("/metrics")
+    return elapsed, timings, parse_stage_metrics(response.text)
+
+
+def parse_stage_metrics(text):
+    """Returns the mean duration of each server stage from the /metrics text."""
+    totals = {}
+    for line in text.splitlines():
+        for suffix in ("_sum", "_count"):
+            prefix = f"dotbot_authority_stage_duration_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix) :].split('"} ')
+                totals.setdefault(stage, {})[suffix] = float(value)
+    return {
+        stage: {"count": int(values["_count"]), "mean_ms": values["_sum"] / values["_count"] * 1e3}
+        for stage, values in totals.items()
+        if values.get("_count")
+    }
+
+
+async def _run_asgi(devices, voucher_requests, concurrency, batch_size, authority_kwargs):
+    from authority import Authority
+    from logger import setup_logging
+
+    setup_logging(None, "warning", ["console"])
+    authority = Authority(**authority_kwargs)
+    try:
+        transport = httpx.ASGITransport(app=authority.api)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            return await run_fleet(
+                client, devices, voucher_requests, concurrency, batch_size
+            )
+    finally:
+        authority.stop([])
+
+
+async def _wait_ready(client, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await client.get("/api/v1/id")
+            return
+        except httpx.TransportError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def _run_http(
+    devices,
+    voucher_requests,
+    concurrency,
+    batch_size,
+    authority_kwargs,
+    tmpdir,
+    workers,
+    coap=False,
+):
+    command = [
+        sys.executable,
+        os.path.join(AUTHORITY_DIR, "main.py"),
+        "--log-level",
+        "warning",
+        "--log-output",
+        os.path.join(tmpdir, "authority.log"),
+    ]
+    for name, value in authority_kwargs.items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    if workers > 1:
+        command += ["--workers", str(workers), "--state", os.path.join(tmpdir, "state.db")]
+    if coap:
+        command += ["--coap-port", str(COAP_PORT)]
+    process = subprocess.Popen(command, cwd=AUTHORITY_DIR, stdout=subprocess.DEVNULL)
+    limits = httpx.Limits(max_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=HTTP_BASE_URL, limits=limits) as client:
+            await _wait_ready(client)
+            if coap:
+                import aiocoap
+
+                context = await aiocoap.Context.create_client_context()
+                try:
+                    return await run_fleet(
+                        CoapClient(context, client),
+                        devices,
+                        voucher_requests,
+                        concurrency,
+                        batch_size,
+                    )
+                finally:
+                    await context.shutdown()
+            return await run_fleet(
+                client, devices, voucher_requests, concurrency, batch_size
+            )
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def check_thresholds(results, max_p99, min_throughput):
+    """Returns the list of threshold violations."""
+    failures = []
+    if min_throughput is not None and results["devices_per_s"] < min_throughput:
+        failures.append(
+            f"throughput {results['devices_per_s']:.1f} devices/s < {min_throughput}"
+        )
+    for name, stats in results["stages"].items():
+        if stats["errors"]:
+            failures.append(f"{name}: {stats['errors']} errors")
+        if max_p99 is not None and name.startswith("/") and stats["p99_ms"] > max_p99:
+            failures.append(f"{name}: p99 {stats['p99_ms']:.2f} ms > {max_p99} ms")
+    return failures
+
+
+@click.command()
+@click.option("--devices", "count", type=int, default=200, help="Number of simulated DotBots")
+@click.option("--concurrency", type=int, default=32, help="Devices onboarding at the same time")
+@click.option(
+    "--transport",
+    type=click.Choice(["asgi", "http", "coap"]),
+    default="asgi",
+    help="In-process ASGI transport, localhost HTTP or localhost CoAP (needs aiocoap)",
+)
+@click.option("--workers", type=int, default=1, help="Authority worker processes (http only)")
+@click.option(
+    "--batch-size",
+    type=int,
+    default=0,
+    help="Devices per gateway batch, 0 to onboard each device on its own",
+)
+@click.option("--max-p99", type=float, default=None, help="Max p99 per endpoint, in ms")
+@click.option("--min-throughput", type=float, default=None, help="Min onboarded devices/s")
+@click.option("--json", "json_output", type=click.Path(), default=None, help="Write the results as JSON")
+def main(count, concurrency, transport, workers, batch_size, max_p99, min_throughput, json_output):
+    """Benchmarks the onboarding of a fleet of DotBots."""
+    devices = [SimulatedDevice(index) for index in range(count)]
+    start = time.perf_counter()
+    voucher_requests = [device.voucher_request() for device in devices]
+    generate = (time.perf_counter() - start) / count
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        authority_kwargs = provision(devices, tmpdir)
+        if transport == "asgi":
+            run = _run_asgi(
+                devices, voucher_requests, concurrency, batch_size, authority_kwargs
+            )
+        else:
+            run = _run_http(
+                devices,
+                voucher_requests,
+                concurrency,
+                batch_size,
+                authority_kwargs,
+                tmpdir,
+                workers,
+                coap=transport == "coap",
+            )
+        elapsed, timings, server_stages = asyncio.run(run)
+
+    results = {
+        "transport": transport,
+        "devices": count,
+        "concurrency": concurrency,
+        "workers": workers,
+        "batch_size": batch_size,
+        "devices_per_s": count / elapsed,
+        "client_voucher_generation_ms": generate * 1e3,
+        "stages": timings.summary(),
+        "server_stages": server_stages,
+    }
+    print(
+        f"{count} devices over {transport}, {concurrency} in flight: "
+        f"{results['devices_per_s']:.1f} devices/s"
+    )
+    print(f"{'endpoint / stage':<45}{'count':>7}{'errors':>7}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for name, stats in results["stages"].items():
+        print(
+            f"{name:<45}{stats['count']:>7}{stats['errors']:>7}"
+            f"{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}"
+        )
+    print(f"{'server stage':<45}{'count':>7}{'mean (ms)':>24}")
+    for stage, stats in server_stages.items():
+        print(f"{stage:<45}{stats['count']:>7}{stats['mean_ms']:>24.3f}")
+    if json_output is not None:
+        with open(json_output, "w") as f:
+            json.dump(results, f, indent=2)
+    failures = check_thresholds(results, max_p99, min_throughput)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
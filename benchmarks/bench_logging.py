@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+"""Logging cost per voucher request.
+
+Emits the log events of one voucher request (the debug events of the
+handler plus the authorization result) with eagerly or lazily formatted
+payload fields, with the file handler writing on the calling thread or
+through the queue listener thread. Each configuration runs in its own
+process because the logging setup is global.
+
+    python benchmarks/bench_logging.py --requests 20000
+"""
+
+import binascii
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dotbot_authority")
+)
+
+from logger import LOGGER, Lazy, lazy_hex, setup_logging  # noqa: E402
+
+VOUCHER_REQUEST = os.urandom(89)
+VOUCHER_RESPONSE = os.urandom(91)
+ID_U = bytes.fromhex("a104412b")
+
+CONFIGURATIONS = [
+    # (label, lazy fields, queue handler)
+    ("eager fields, sync file", False, False),
+    ("lazy fields, sync file", True, False),
+    ("lazy fields, queue thread", True, True),
+]
+
+
+def _request_eager():
+    LOGGER.debug(
+        "Handling voucher request",
+        voucher_request=binascii.hexlify(VOUCHER_REQUEST).decode(),
+    )
+    LOGGER.debug("Learned dotbot's identity", id_u=ID_U[-1], id_u_hex=hex(ID_U[-1]))
+    LOGGER.info("Authorization result", id_u=ID_U[-1], authorized=True)
+    LOGGER.debug(
+        "Dotbot authorized, prepared voucher response",
+        voucher_response=binascii.hexlify(VOUCHER_RESPONSE).decode(),
+    )
+
+
+def _request_lazy():
+    LOGGER.debug("Handling voucher request", voucher_request=lazy_hex(VOUCHER_REQUEST))
+    LOGGER.debug(
+        "Learned dotbot's identity", id_u=ID_U[-1], id_u_hex=Lazy(hex, ID_U[-1])
+    )
+    LOGGER.info("Authorization result", id_u=ID_U[-1], authorized=True)
+    LOGGER.debug(
+        "Dotbot authorized, prepared voucher response",
+        voucher_response=lazy_hex(VOUCHER_RESPONSE),
+    )
+
+
+def _measure(count, level, lazy, use_queue):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        setup_logging(
+            os.path.join(tmpdir, "bench.log"), level, ["file"], use_queue=use_queue
+        )
+        request = _request_lazy if lazy else _request_eager
+        request()
+        start = time.perf_counter()
+        for _ in range(count):
+            request()
+        return (time.perf_counter() - start) / count
+
+
+@click.command()
+@click.option("--requests", "count", type=int, default=20000, help="Requests per run")
+@click.option("--run", type=(str, int), default=None, hidden=True)
+def main(count, run):
+    """Benchmarks the logging cost of a voucher request."""
+    if run is not None:
+        level, index = run
+        _, lazy, use_queue = CONFIGURATIONS[index]
+        print(_measure(count, level, lazy, use_queue))
+        return
+    print(f"{'configuration':<28}{'level':>8}{'us/request':>12}")
+    for level in ("info", "debug"):
+        for index, (label, _, _) in enumerate(CONFIGURATIONS):
+            output = subprocess.run(
+                [sys.executable, __file__, "--requests", str(count), "--run", level, str(index)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            print(f"{label:<28}{level:>8}{float(output) * 1e6:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
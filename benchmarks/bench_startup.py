@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+"""Startup time of the authority and of the CLI.
+
+Each run uses a fresh interpreter, and reports:
+- the time spent importing the application, with the slowest modules, and
+  creating the Authority, measured with import_profile;
+- the time until a started authority answers HTTP requests;
+- the time of dotbot-authority-cli list on an empty deployment.
+
+Thresholds make the benchmark usable in CI, the exit code is 1 when they are
+not met:
+
+    python benchmarks/bench_startup.py --runs 5 --max-import-ms 800 --max-ready-ms 2000
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+AUTHORITY_DIR = os.path.join(ROOT_DIR, "dotbot_authority")
+HTTP_BASE_URL = "http://localhost:18000"
+
+PROFILE_SCRIPT = """
+import json, time
+from import_profile import ImportProfiler
+profiler = ImportProfiler().install()
+from logger import setup_logging
+from authority import Authority
+profiler.uninstall()
+setup_logging(None, "warning", ["console"])
+start = time.perf_counter()
+authority = Authority()
+created = time.perf_counter() - start
+authority.stop([])
+print(json.dumps({
+    "import_ms": profiler.total * 1e3,
+    "create_ms": created * 1e3,
+    "modules": len(profiler.timings),
+    "top": [[name, cumulative * 1e3] for name, _, cumulative in profiler.top(10)],
+}))
+"""
+
+
+def profile_imports():
+    output = subprocess.run(
+        [sys.executable, "-c", PROFILE_SCRIPT],
+        cwd=AUTHORITY_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def time_to_ready(tmpdir, timeout=30):
+    """Returns the seconds until a new authority process answers requests."""
+    command = [
+        sys.executable,
+        os.path.join(AUTHORITY_DIR, "main.py"),
+        "--log-level",
+        "warning",
+        "--log-output",
+        os.path.join(tmpdir, "authority.log"),
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command, cwd=AUTHORITY_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while True:
+            try:
+                httpx.get(f"{HTTP_BASE_URL}/api/v1/id", timeout=1)
+                return time.perf_counter() - start
+            except httpx.TransportError:
+                if time.perf_counter() - start > timeout:
+                    raise
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def time_cli_list(tmpdir):
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "dotbot_authority.cli", "list", "--basedir", tmpdir, "--json"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        check=True,
+    )
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option("--runs", type=int, default=5, help="Fresh interpreters per measurement")
+@click.option("--max-import-ms", type=float, default=None, help="Max median import time")
+@click.option("--max-ready-ms", type=float, default=None, help="Max median time to ready")
+@click.option("--json", "json_output", type=click.Path(), default=None, help="Write the results as JSON")
+def main(runs, max_import_ms, max_ready_ms, json_output):
+    """Benchmarks the startup of the authority and of the CLI."""
+    profiles = [profile_imports() for _ in range(runs)]
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ready = [time_to_ready(tmpdir) * 1e3 for _ in range(runs)]
+        cli = [time_cli_list(tmpdir) * 1e3 for _ in range(runs)]
+    results = {
+        "runs": runs,
+        "import_ms": statistics.median(p["import_ms"] for p in profiles),
+        "create_ms": statistics.median(p["create_ms"] for p in profiles),
+        "modules": profiles[-1]["modules"],
+        "ready_ms": statistics.median(ready),
+        "cli_list_ms": statistics.median(cli),
+        "slowest_imports": profiles[-1]["top"],
+    }
+    print(f"{'import application':<30}{results['import_ms']:>10.1f} ms ({results['modules']} modules)")
+    print(f"{'create Authority':<30}{results['create_ms']:>10.1f} ms")
+    print(f"{'time to ready (HTTP)':<30}{results['ready_ms']:>10.1f} ms")
+    print(f"{'cli list':<30}{results['cli_list_ms']:>10.1f} ms")
+    print("slowest imports (cumulative):")
+    for name, cumulative in results["slowest_imports"]:
+        print(f"  {name:<40}{cumulative:>10.1f} ms")
+    if json_output is not None:
+        with open(json_output, "w") as f:
+            json.dump(results, f, indent=2)
+    failures = []
+    if max_import_ms is not None and results["import_ms"] > max_import_ms:
+        failures.append(f"import {results['import_ms']:.1f} ms > {max_import_ms} ms")
+    if max_ready_ms is not None and results["ready_ms"] > max_ready_ms:
+        failures.append(f"time to ready {results['ready_ms']:.1f} ms > {max_ready_ms} ms")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""Simulated DotBots for the benchmarks.
+
+Each device has an id_u to be authorized by the ACL, an Ed25519 attestation
+key with its CCS credential, and produces voucher requests, attestation
+proposals and signed COSE_Sign1 evidence like the firmware does.
+"""
+
+import json
+import os
+import uuid
+
+import cbor2
+import lakers
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+G_W = bytes.fromhex("FFA4F102134029B3B156890B88C9D9619501196574174DCB68A07DB0588E4D41")
+LOC_W = "http://localhost:18000"
+
+SOFTWARE_NAME = "DotBot"
+FIRMWARE_NAME = "03app_dotbot.bin"
+FIRMWARE_DIGEST = bytes.fromhex(
+    "5e0b9ca06bd0fe8af89142525d50d6b197393d3102d7a4b08c52e8f786fc67e4"
+)
+HASH_ALG_SHA256 = 1
+EVIDENCE_TYPE_SWID = 258
+COSE_ALG_EDDSA = -8
+
+
+class SimulatedDevice:
+    """A DotBot going through enrollment and remote attestation."""
+
+    def __init__(self, index):
+        self.index = index
+        # the authority identifies the device by the kid of its ID_U
+        self.kid = index + 1
+        self.kid_bytes = self.kid.to_bytes((self.kid.bit_length() + 7) // 8, "big")
+        self.id_u = cbor2.dumps({4: self.kid_bytes})
+        self.c_r = index
+        self.subject = uuid.UUID(int=index + 1).bytes
+        self.ueid = b"\x01" + self.subject
+        self._key = Ed25519PrivateKey.generate()
+
+    @property
+    def public_key_bytes(self):
+        return self._key.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+
+    def credential(self):
+        """Returns the CCS credential of the attestation key."""
+        return cbor2.dumps(
+            {
+                2: self.subject,
+                8: {1: {1: 1, 2: self.kid_bytes, -1: 6, -2: self.public_key_bytes}},
+            }
+        )
+
+    def voucher_request(self):
+        """Returns the voucher request the authenticator sends for this device."""
+        device = lakers.AuthzDevice(self.id_u, G_W, LOC_W)
+        initiator = lakers.EdhocInitiator()
+        ead_1 = device.prepare_ead_1(
+            initiator.compute_ephemeral_secret(device.get_g_w()),
+            initiator.selected_cipher_suite(),
+        )
+        message_1 = initiator.prepare_message_1(c_i=None, ead_1=[ead_1])
+        _, voucher_request = lakers.AuthzAutenticator().process_ead_1(ead_1, message_1)
+        return bytes(voucher_request)
+
+    def attestation_proposal(self):
+        return cbor2.dumps([self.c_r, cbor2.dumps([EVIDENCE_TYPE_SWID])])
+
+    def evidence(self, nonce, digest=FIRMWARE_DIGEST):
+        """Returns the [c_r, COSE_Sign1 token] evidence message for nonce."""
+        claims = {
+            10: nonce,
+            256: self.ueid,
+            273: [
+                [
+                    EVIDENCE_TYPE_SWID,
+                    {
+                        0: f"dotbot-{self.index}",
+                        12: 1,
+                        1: SOFTWARE_NAME,
+                        2: {31: "Inria", 33: 1},
+                        3: {17: [{24: FIRMWARE_NAME, 20: 262144, 7: [HASH_ALG_SHA256, digest]}]},
+                    },
+                ]
+            ],
+        }
+        protected = cbor2.dumps({1: COSE_ALG_EDDSA})
+        payload = cbor2.dumps(claims)
+        signature = self._key.sign(cbor2.dumps(["Signature1", protected, b"", payload]))
+        token = cbor2.dumps(cbor2.CBORTag(18, [protected, {}, payload, signature]))
+        return cbor2.dumps([self.c_r, token])
+
+
+def provision(devices, basedir):
+    """Writes the ACL, credentials and reference values of a fleet in basedir.
+
+    Returns the keyword arguments to give to Authority.
+    """
+    cred_dir = os.path.join(basedir, "credentials")
+    os.makedirs(cred_dir, exist_ok=True)
+    for device in devices:
+        with open(os.path.join(cred_dir, f"dotbot{device.index}-cred-rpk.cbor"), "wb") as f:
+            f.write(device.credential())
+    acl = os.path.join(basedir, "acl.json")
+    with open(acl, "w") as f:
+        json.dump(sorted(set(device.kid for device in devices)), f)
+    reference_values = os.path.join(basedir, "reference-values.json")
+    with open(reference_values, "w") as f:
+        json.dump(
+            {
+                "version": 1,
+                "reference_values": [
+                    {
+                        "software_name": SOFTWARE_NAME,
+                        "hash_alg": HASH_ALG_SHA256,
+                        "digest": FIRMWARE_DIGEST.hex(),
+                    }
+                ],
+            },
+            f,
+        )
+    return {"acl": acl, "cred_dir": cred_dir, "reference_values": reference_values}
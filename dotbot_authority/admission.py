@@ -0,0 +1,206 @@
+"""Admission control: per-key rate limits and a global concurrency cap."""
+
+import collections
+import contextlib
+import contextvars
+import math
+import time
+
+from starlette.responses import PlainTextResponse
+
+from logger import LOGGER
+import metrics
+
+
+# the admission slot held by the request being handled, shared by the items
+# of a batch, which run in copies of its context
+_slot = contextvars.ContextVar("admission_slot", default=None)
+
+
+class _Slot:
+    __slots__ = ("waiting",)
+
+    def __init__(self):
+        self.waiting = 0
+
+
+class RateLimiter:
+    """Token buckets indexed by key, refilled at rate tokens per second.
+
+    Only the most recently used buckets are kept, a bucket dropped for lack
+    of room comes back full, which is what an idle key would have anyway.
+    """
+
+    def __init__(self, rate, burst, capacity=65536, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.capacity = capacity
+        self._clock = clock
+        self._buckets = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, key):
+        """Takes a token for key, returns 0 or the seconds until one is available."""
+        now = self._clock()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+            if len(self._buckets) >= self.capacity:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / self.rate
+        self._buckets[key] = (tokens - 1, now)
+        return 0
+
+
+class AdmissionController:
+    """Decides which requests of the crypto endpoints are handled.
+
+    Each DotBot (id_u, c_r) and each peer address gets a token bucket, a
+    rate of 0 disables the limit. The number of crypto requests handled at
+    the same time is capped, the others are rejected at once instead of
+    queueing behind them, so the latency of admitted requests stays bounded.
+    A request waiting for something else than the CPU, such as an operator
+    decision, gives its slot back while it waits. The limits are those of
+    the current process.
+    """
+
+    def __init__(
+        self,
+        device_rate=5.0,
+        device_burst=10,
+        peer_rate=0.0,
+        peer_burst=100,
+        max_concurrency=256,
+        retry_after=1,
+    ):
+        self.logger = LOGGER.bind(context=__name__)
+        self.devices = RateLimiter(device_rate, device_burst) if device_rate > 0 else None
+        self.peers = RateLimiter(peer_rate, peer_burst) if peer_rate > 0 else None
+        self.max_concurrency = max_concurrency
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.shed = collections.Counter()
+
+    def admit_device(self, kind, key):
+        """Returns 0 if a request of the DotBot is allowed, else the seconds to wait."""
+        if self.devices is None:
+            return 0
+        wait = self.devices.acquire((kind, key))
+        if wait:
+            self._shed(f"rate_{kind}", key=key)
+        return wait
+
+    def admit_peer(self, peer):
+        """Returns 0 if a request of the peer is allowed, else the seconds to wait."""
+        if self.peers is None or peer is None:
+            return 0
+        wait = self.peers.acquire(peer)
+        if wait:
+            self._shed("rate_peer", key=peer)
+        return wait
+
+    def enter(self):
+        """Counts a crypto request in, returns False if the cap is reached."""
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            self._shed("overload")
+            return False
+        self.in_flight += 1
+        _slot.set(_Slot())
+        return True
+
+    def leave(self):
+        _slot.set(None)
+        self.in_flight -= 1
+
+    @contextlib.contextmanager
+    def released(self):
+        """Gives back the slot of the current request for the duration of the block.
+
+        The slot is taken again at the end of the block even if the cap is
+        reached, the request was already admitted. The items of a batch
+        waiting at the same time give back the slot of the batch once.
+        """
+        slot = _slot.get()
+        if slot is None:
+            yield
+            return
+        if not slot.waiting:
+            self.in_flight -= 1
+        slot.waiting += 1
+        try:
+            yield
+        finally:
+            slot.waiting -= 1
+            if not slot.waiting:
+                self.in_flight += 1
+
+    def _shed(self, reason, **fields):
+        self.shed[reason] += 1
+        metrics.SHED.labels(reason).inc()
+        self.logger.debug("Request shed", reason=reason, **fields)
+
+    @property
+    def metrics(self):
+        """Returns the limits and the shed counters."""
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "device_rate": self.devices.rate if self.devices else 0,
+            "peer_rate": self.peers.rate if self.peers else 0,
+            "shed": dict(self.shed),
+        }
+
+
+def retry_after_header(seconds):
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the peer limits and the concurrency cap.
+
+    It runs before the request body is read, so shedding costs almost
+    nothing. The controller is the admission attribute of the authority of
+    the application.
+    """
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        authority = getattr(scope.get("app"), "authority", None)
+        if (
+            scope["type"] != "http"
+            or scope.get("path") not in self.paths
+            or authority is None
+        ):
+            await self.app(scope, receive, send)
+            return
+        admission = authority.admission
+        client = scope.get("client")
+        wait = admission.admit_peer(client[0] if client else None)
+        if wait:
+            response = PlainTextResponse(
+                "Too Many Requests", status_code=429, headers=retry_after_header(wait)
+            )
+            await response(scope, receive, send)
+            return
+        if not admission.enter():
+            response = PlainTextResponse(
+                "Service Unavailable",
+                status_code=503,
+                headers=retry_after_header(admission.retry_after),
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.leave()
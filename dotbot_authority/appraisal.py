@@ -0,0 +1,156 @@
+"""Appraisal of the measured claims of the evidence."""
+
+import collections
+import hashlib
+import hmac
+
+import cbor2
+
+from logger import LOGGER, lazy_hex
+from reference_values import HASH_ALG_SHA256
+
+
+class Verdict:
+    """Outcome of the appraisal of a set of measured claims."""
+
+    __slots__ = ("approved", "software_name", "fs_name", "tag_version")
+
+    def __init__(self, approved, software_name, fs_name, tag_version):
+        self.approved = approved
+        self.software_name = software_name
+        self.fs_name = fs_name
+        self.tag_version = tag_version
+
+
+def claims_digest(evidence):
+    """Returns a digest of the measured claims a verdict depends on.
+
+    Per device claims (nonce, UEID, tag id) are left out, so devices running
+    the same firmware share the digest.
+    """
+    claims = [
+        [
+            measurement.software_name,
+            measurement.tag_version,
+            [
+                [file.fs_name, file.size, file.hash_alg, bytes(file.digest)]
+                for file in measurement.files
+            ],
+        ]
+        for measurement in evidence.measurements
+    ]
+    return hashlib.sha256(cbor2.dumps(claims)).digest()
+
+
+class Appraiser:
+    """Compares measured files with the reference values and firmware images.
+
+    Most of a fleet reports the same measurements, so the verdict of each set
+    of measured claims is kept in a bounded LRU indexed by claims_digest.
+    The verdicts are dropped whenever the reference values are reloaded or
+    the firmware images change. A capacity of 0 disables the cache.
+    """
+
+    def __init__(self, reference_values, firmware=None, capacity=1024):
+        self.reference_values = reference_values
+        self.firmware = firmware
+        self.capacity = capacity
+        self.logger = LOGGER.bind(context=__name__)
+        self._verdicts = collections.OrderedDict()
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._verdicts)
+
+    def _source_generation(self):
+        firmware = self.firmware.generation if self.firmware is not None else 0
+        return (self.reference_values.generation, firmware)
+
+    async def appraise(self, evidence):
+        """Returns the Verdict of the measurements of an Evidence."""
+        generation = self._source_generation()
+        if generation != self._generation:
+            if self._verdicts:
+                self.invalidations += 1
+                self._verdicts.clear()
+            self._generation = generation
+        key = claims_digest(evidence)
+        verdict = self._verdicts.get(key)
+        if verdict is not None:
+            self._verdicts.move_to_end(key)
+            self.hits += 1
+            self.logger.debug("Appraisal verdict cached", approved=verdict.approved)
+            return verdict
+        self.misses += 1
+        verdict = await self._appraise(evidence)
+        # not cached if the sources changed while the firmware was hashed
+        if self.capacity and self._source_generation() == generation:
+            self._verdicts[key] = verdict
+            if len(self._verdicts) > self.capacity:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+    async def _appraise(self, evidence):
+        # every measured file must be an approved one
+        approved = any(measurement.files for measurement in evidence.measurements)
+        for measurement in evidence.measurements:
+            for file in measurement.files:
+                if self.reference_values.match(
+                    file.digest, measurement.software_name, file.hash_alg
+                ) or await self.match_firmware(file):
+                    self.logger.debug(
+                        "Hash value check: SUCCESS",
+                        fs_name=file.fs_name,
+                        hash_value=lazy_hex(file.digest),
+                    )
+                else:
+                    approved = False
+                    self.logger.info(
+                        "Hash value check: FAIL",
+                        software_name=measurement.software_name,
+                        fs_name=file.fs_name,
+                        hash_value=lazy_hex(file.digest),
+                    )
+        first = evidence.measurements[0] if evidence.measurements else None
+        return Verdict(
+            approved,
+            software_name=(first and first.software_name) or "",
+            fs_name=", ".join(
+                str(file.fs_name)
+                for measurement in evidence.measurements
+                for file in measurement.files
+            ),
+            tag_version=(first and first.tag_version) or 0,
+        )
+
+    async def match_firmware(self, file):
+        """Compares a measured file with the local image of the same name.
+
+        The DotBot hashes its image padded with 0xFF up to the file size it
+        reports, the local image is hashed the same way.
+        """
+        if self.firmware is None or file.hash_alg != HASH_ALG_SHA256:
+            return False
+        digest = await self.firmware.digest(file.fs_name, file.size)
+        return digest is not None and hmac.compare_digest(digest, bytes(file.digest))
+
+    @property
+    def hit_rate(self):
+        """Share of the appraisals answered from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def metrics(self):
+        """Returns the counters of the verdict cache."""
+        return {
+            "verdicts": len(self._verdicts),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hit_rate,
+        }
@@ -0,0 +1,151 @@
+"""Operator decisions on the DotBots missing from the ACL."""
+
+import asyncio
+import time
+
+from logger import LOGGER
+
+
+class PendingDecision:
+    """Decision awaited by the requests of a DotBot missing from the ACL."""
+
+    __slots__ = ("id_u", "timestamp", "expires", "requests", "future", "timer")
+
+    def __init__(self, id_u, timestamp, expires, future, timer):
+        self.id_u = id_u
+        self.timestamp = timestamp
+        self.expires = expires
+        self.requests = 1
+        self.future = future
+        self.timer = timer
+
+    def to_dict(self):
+        return {
+            "id": self.id_u,
+            "timestamp": self.timestamp,
+            "expires": self.expires,
+            "requests": self.requests,
+        }
+
+
+class ApprovalQueue:
+    """DotBots waiting for the operator to approve or deny them on the UI.
+
+    The first request of an unknown DotBot creates a pending decision, the
+    concurrent and retransmitted requests of the same DotBot await the same
+    future. Each decision has a single timer, not one per waiter: when it
+    expires the decision is denied and dropped, so no waiter outlives it
+    however many requests joined it. The waiters are shielded, a request going
+    away does not cancel the decision for the others. At most capacity
+    decisions are pending, the other unknown DotBots are denied at once.
+    A timeout of 0 disables the queue.
+    """
+
+    def __init__(self, timeout=0.0, capacity=1024, clock=time.time):
+        self.timeout = timeout
+        self.capacity = capacity
+        self._clock = clock
+        self._pending = {}
+        self.logger = LOGGER.bind(context=__name__)
+        self.created = 0
+        self.coalesced = 0
+        self.approved = 0
+        self.denied = 0
+        self.expirations = 0
+        self.overflows = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, id_u):
+        return id_u in self._pending
+
+    @property
+    def enabled(self):
+        return self.timeout > 0
+
+    def request(self, id_u):
+        """Returns the pending decision of id_u and whether it was just created.
+
+        Returns (None, False) when the queue is full.
+        """
+        decision = self._pending.get(id_u)
+        if decision is not None:
+            decision.requests += 1
+            self.coalesced += 1
+            return decision, False
+        if len(self._pending) >= self.capacity:
+            self.overflows += 1
+            self.logger.debug("Approval queue full, DotBot denied", id_u=id_u)
+            return None, False
+        loop = asyncio.get_running_loop()
+        now = self._clock()
+        decision = self._pending[id_u] = PendingDecision(
+            id_u,
+            timestamp=int(round(now * 1000)),
+            expires=int(round((now + self.timeout) * 1000)),
+            future=loop.create_future(),
+            timer=loop.call_later(self.timeout, self._expire, id_u),
+        )
+        self.created += 1
+        self.logger.info("Waiting for the operator decision", id_u=id_u)
+        return decision, True
+
+    async def wait(self, decision):
+        """Returns True if the DotBot was approved before the timeout."""
+        return await asyncio.shield(decision.future)
+
+    def decide(self, ids, approved):
+        """Resolves the pending decisions of ids, or all of them if ids is None.
+
+        Returns the ids that were pending.
+        """
+        if ids is None:
+            ids = list(self._pending)
+        decided = []
+        for id_u in ids:
+            decision = self._pending.pop(id_u, None)
+            if decision is None:
+                continue
+            decision.timer.cancel()
+            decision.future.set_result(approved)
+            decided.append(id_u)
+        if approved:
+            self.approved += len(decided)
+        else:
+            self.denied += len(decided)
+        self.logger.info("Operator decision", approved=approved, count=len(decided))
+        return decided
+
+    def _expire(self, id_u):
+        decision = self._pending.pop(id_u)
+        decision.future.set_result(False)
+        self.expirations += 1
+        self.logger.info("No operator decision in time, DotBot denied", id_u=id_u)
+
+    def to_list(self):
+        """Returns the pending decisions, oldest first."""
+        return [decision.to_dict() for decision in self._pending.values()]
+
+    @property
+    def metrics(self):
+        """Returns the counters of the queue."""
+        return {
+            "pending": len(self._pending),
+            "capacity": self.capacity,
+            "timeout": self.timeout,
+            "created": self.created,
+            "coalesced": self.coalesced,
+            "approved": self.approved,
+            "denied": self.denied,
+            "expirations": self.expirations,
+            "overflows": self.overflows,
+        }
+
+    def shutdown(self):
+        """Denies the pending decisions, so that no request is left waiting."""
+        for decision in self._pending.values():
+            decision.timer.cancel()
+            if not decision.future.done() and not decision.future.get_loop().is_closed():
+                decision.future.set_result(False)
+        self._pending.clear()
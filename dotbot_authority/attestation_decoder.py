@@ -1,10 +1,8 @@
 import cbor2
-from pycose.messages.sign1message import Sign1Message
-from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
-from logger import LOGGER
+from errors import EvidenceFormatError
 
 IANA_CBOR_COSWID_FILE_FS_NAME_KEY = 24
-#IANA_CBOR_COSWID_FILE_SIZE_KEY = 20
+IANA_CBOR_COSWID_FILE_SIZE_KEY = 20
 IANA_CBOR_COSWID_FILE_HASH_IMAGE_KEY = 7
 IANA_CBOR_COSWID_FILE_KEY = 17
 
@@ -24,92 +22,205 @@ IANA_CBOR_EAT_MEASUREMENTS_KEY = 273
 IANA_COAP_CONTENT_FORMATS_SWID = 258
 
 IANA_COSE_HEADER_PARAMETERS_ALG = 1
+IANA_COSE_HEADER_PARAMETERS_KID = 4
+
+IANA_CBOR_TAG_COSE_SIGN1 = 18
+
+class FileMeasurement:
+    """Measurement of one file of a CoSWID evidence."""
+
+    __slots__ = ("fs_name", "size", "hash_alg", "digest")
+
+    def __init__(self, fs_name, size, hash_alg, digest):
+        self.fs_name = fs_name
+        self.size = size
+        self.hash_alg = hash_alg
+        self.digest = digest
+
+
+class Measurement:
+    """One measurement of the EAT measurements claim (a CoSWID tag)."""
+
+    __slots__ = (
+        "content_format_id",
+        "tag_id",
+        "tag_version",
+        "software_name",
+        "entity_name",
+        "entity_role",
+        "files",
+    )
+
+    def __init__(
+        self,
+        content_format_id,
+        tag_id,
+        tag_version,
+        software_name,
+        entity_name,
+        entity_role,
+        files,
+    ):
+        self.content_format_id = content_format_id
+        self.tag_id = tag_id
+        self.tag_version = tag_version
+        self.software_name = software_name
+        self.entity_name = entity_name
+        self.entity_role = entity_role
+        self.files = files
+
+
+class Evidence:
+    """Claims of an attestation token."""
+
+    __slots__ = ("nonce", "ueid", "measurements")
+
+    def __init__(self, nonce, ueid, measurements):
+        self.nonce = nonce
+        self.ueid = ueid
+        self.measurements = measurements
+
+
+def _expect(condition, message):
+    if not condition:
+        raise EvidenceFormatError(message)
+
+
+def _is_optional(value, kind):
+    # bool is an int, but never a valid claim value
+    return value is None or (isinstance(value, kind) and not isinstance(value, bool))
+
+
+def _parse_file(file_data):
+    _expect(isinstance(file_data, dict), "file entry is not a map")
+    hash_image = file_data.get(IANA_CBOR_COSWID_FILE_HASH_IMAGE_KEY)
+    _expect(hash_image is not None, "file entry has no hash image")
+    _expect(
+        isinstance(hash_image, list)
+        and len(hash_image) == 2
+        and isinstance(hash_image[0], int)
+        and isinstance(hash_image[1], bytes),
+        "hash image is not a [alg, digest] pair",
+    )
+    fs_name = file_data.get(IANA_CBOR_COSWID_FILE_FS_NAME_KEY)
+    _expect(_is_optional(fs_name, str), "file name is not a text string")
+    size = file_data.get(IANA_CBOR_COSWID_FILE_SIZE_KEY)
+    _expect(_is_optional(size, int), "file size is not an integer")
+    return FileMeasurement(fs_name, size, hash_image[0], hash_image[1])
+
+
+def _parse_measurement(measurement):
+    _expect(
+        isinstance(measurement, list)
+        and len(measurement) == 2
+        and isinstance(measurement[1], dict),
+        "measurement is not a [content format, CoSWID] pair",
+    )
+    coswid = measurement[1]
+    software_name = coswid.get(IANA_CBOR_COSWID_SOFTWARE_NAME_KEY)
+    _expect(_is_optional(software_name, str), "software name is not a text string")
+    tag_version = coswid.get(IANA_CBOR_COSWID_TAG_VERSION_KEY)
+    _expect(_is_optional(tag_version, int), "tag version is not an integer")
+    entity_name = entity_role = None
+    entity = coswid.get(IANA_CBOR_COSWID_ENTITY_KEY)
+    if entity is not None:
+        _expect(isinstance(entity, dict), "entity is not a map")
+        entity_name = entity.get(IANA_CBOR_COSWID_ENTITY_ENTITY_NAME_KEY)
+        entity_role = entity.get(IANA_CBOR_COSWID_ENTITY_ROLE)
+    files = []
+    evidence = coswid.get(IANA_CBOR_COSWID_EVIDENCE_KEY)
+    if evidence is not None:
+        _expect(isinstance(evidence, dict), "evidence is not a map")
+        file_entries = evidence.get(IANA_CBOR_COSWID_FILE_KEY) or []
+        # a single file may be encoded without the enclosing array
+        if isinstance(file_entries, dict):
+            file_entries = [file_entries]
+        _expect(isinstance(file_entries, list), "file entries are not an array")
+        files = [_parse_file(file_data) for file_data in file_entries]
+    return Measurement(
+        measurement[0],
+        coswid.get(IANA_CBOR_COSWID_TAG_ID_KEY),
+        tag_version,
+        software_name,
+        entity_name,
+        entity_role,
+        files,
+    )
+
+
+def parse_payload(claims):
+    """Validates the EAT claims and returns them as an Evidence."""
+    _expect(isinstance(claims, dict), "claims are not a map")
+    nonce = claims.get(IANA_CBOR_EAT_NONCE_KEY)
+    _expect(isinstance(nonce, bytes), "nonce is missing")
+    measurements = claims.get(IANA_CBOR_EAT_MEASUREMENTS_KEY) or []
+    _expect(isinstance(measurements, list), "measurements are not an array")
+    return Evidence(
+        nonce,
+        claims.get(IANA_CBOR_EAT_UEID_KEY),
+        [_parse_measurement(measurement) for measurement in measurements],
+    )
+
+
+class CoseSign1:
+    """Parts of a COSE_Sign1 message, with the protected header as received."""
+
+    __slots__ = ("protected", "kid", "payload", "signature")
+
+    def __init__(self, protected, kid, payload, signature):
+        self.protected = protected
+        self.kid = kid
+        self.payload = payload
+        self.signature = signature
+
+    def sig_structure(self, external_aad=b""):
+        """Returns the Sig_structure the signature is computed over.
+
+        The protected header bytes are used as received, never re-encoded.
+        """
+        return cbor2.dumps(["Signature1", self.protected, external_aad, self.payload])
+
+
+def split_cose_sign1(cose_sign1_bytes):
+    """Decodes a (tagged or untagged) COSE_Sign1 message into a CoseSign1."""
+    try:
+        message = cbor2.loads(cose_sign1_bytes)
+    except (ValueError, cbor2.CBORDecodeError) as exc:
+        raise EvidenceFormatError(f"invalid CBOR: {exc}")
+    if isinstance(message, cbor2.CBORTag):
+        _expect(message.tag == IANA_CBOR_TAG_COSE_SIGN1, "not a COSE_Sign1 message")
+        message = message.value
+    _expect(
+        isinstance(message, list)
+        and len(message) == 4
+        and isinstance(message[0], bytes)
+        and isinstance(message[1], dict)
+        and isinstance(message[2], bytes)
+        and isinstance(message[3], bytes),
+        "not a COSE_Sign1 message",
+    )
+    protected, unprotected, payload, signature = message
+    try:
+        protected_header = cbor2.loads(protected) if protected else {}
+    except (ValueError, cbor2.CBORDecodeError):
+        protected_header = None
+    _expect(isinstance(protected_header, dict), "protected header is not a map")
+    kid = protected_header.get(IANA_COSE_HEADER_PARAMETERS_KID)
+    if kid is None:
+        kid = unprotected.get(IANA_COSE_HEADER_PARAMETERS_KID)
+    _expect(_is_optional(kid, bytes), "kid is not a byte string")
+    return CoseSign1(protected, kid, payload, signature)
+
+
+def decode_claims(message):
+    """Returns the claims map of the payload of a CoseSign1."""
+    try:
+        claims = cbor2.loads(message.payload)
+    except (ValueError, cbor2.CBORDecodeError) as exc:
+        raise EvidenceFormatError(f"invalid claims: {exc}")
+    _expect(isinstance(claims, dict), "claims are not a map")
+    _expect(
+        _is_optional(claims.get(IANA_CBOR_EAT_UEID_KEY), bytes), "UEID is not a byte string"
+    )
+    return claims
 
-def parse_payload(payload_bytes):
-    nonce = payload_bytes.get(IANA_CBOR_EAT_NONCE_KEY).hex()
-    ueid = payload_bytes.get(IANA_CBOR_EAT_UEID_KEY)
-    measurements = payload_bytes.get(IANA_CBOR_EAT_MEASUREMENTS_KEY)
-
-    decoded_info = {
-        "nonce": nonce,
-        "ueid": ueid,
-        "measurements": [],
-    }
-
-    if measurements:
-        for measurement in measurements:
-
-            content_format_id = measurement[0]
-            coswid = measurement[1]
-            tag_id = coswid.get(IANA_CBOR_COSWID_TAG_ID_KEY)
-            tag_version = coswid.get(IANA_CBOR_COSWID_TAG_VERSION_KEY)
-            software_name = coswid.get(IANA_CBOR_COSWID_SOFTWARE_NAME_KEY)
-
-            entity = coswid.get(IANA_CBOR_COSWID_ENTITY_KEY)
-            if entity:
-                entity_name = entity.get(IANA_CBOR_COSWID_ENTITY_ENTITY_NAME_KEY)
-                entity_role = entity.get(IANA_CBOR_COSWID_ENTITY_ROLE)
-    
-            evidence = coswid.get(IANA_CBOR_COSWID_EVIDENCE_KEY)
-            files_info = []
-            if evidence:
-                files = evidence.get(IANA_CBOR_COSWID_FILE_KEY)
-                    
-                if files:
-                    for file_data in files:
-                        
-                        fs_name = file_data.get(IANA_CBOR_COSWID_FILE_FS_NAME_KEY)
-                        #size = file_data.get(IANA_CBOR_COSWID_FILE_SIZE_KEY)
-                        hash_image = file_data.get(IANA_CBOR_COSWID_FILE_HASH_IMAGE_KEY)
-
-                        if hash_image:
-                            hash_alg = hash_image[0]
-                            hash_value = hash_image[1].hex()
-                        file_info = {
-                            "fs_name": fs_name,
-                            #"size": size,
-                            "hash_alg": hash_alg,
-                            "hash_value": hash_value,
-                        }
-                        files_info.append(file_info)
-
-    decoded_info["measurements"].append({
-        "content_format_id": content_format_id,
-        "tag_id": tag_id,
-        "tag_version": tag_version,
-        "software_name": software_name,
-        "entity_name": entity_name,
-        "entity_role": entity_role,
-        "files_info": files_info,
-    })
-
-    return decoded_info  
-
-def decode_cose_sign1_message(cose_sign1_bytes, public_key_bytes):
-    LOGGER.debug(f"start to parse the cose_sign1 message")
-
-    # decode the COSE_Sign1 message
-    cose_msg = Sign1Message.decode(cose_sign1_bytes)
-    if not isinstance(cose_msg, Sign1Message):
-        print("The message is not a COSE_Sign1 message.")
-    
-    # signature check
-    public_key = Ed25519PublicKey.from_public_bytes(public_key_bytes)
-    protected_header = cose_msg.phdr_encoded
-    payload = cose_msg.payload
-    signature = cose_msg.signature
-    external_aad = b''
-    sig_structure = cbor2.dumps(["Signature1", protected_header, external_aad, payload])
-    #try:
-    public_key.verify(signature, sig_structure)
-    print("Signature check: SUCCES\n Signature is: ", signature.hex())
-    # except InvalidSignauture as e:
-    #     raise MyException ()    
-    if isinstance(payload, bytes):
-        payload = cbor2.loads(payload)
-
-    decode_info = parse_payload(payload)
-
-    return decode_info
-
-    
\ No newline at end of file
@@ -1,93 +1,418 @@
 import asyncio
 import cbor2.decoder
-import uvicorn
-import lakers
-import websockets
+import concurrent.futures
+import contextlib
 import json
+import uvicorn
 import time
-from fastapi import WebSocket
 import cbor2
-import secrets
+
+from cryptography.exceptions import InvalidSignature
 
 from server import api
-from logger import LOGGER
-from lake_authz import W, CRED_V
+from logger import LOGGER, lazy_hex, setup_logging
+from crypto_executor import CryptoExecutor
+from evidence_verifier import EvidenceVerifier
+from acl import AclStore
+from approvals import ApprovalQueue
+from nonce_store import HmacNonceIssuer, NonceStore, ReplayFilter, load_secret
+from reference_values import ReferenceValueStore
+from firmware import FirmwareDigestCache
+from appraisal import Appraiser
+from credentials import CredentialStore, KeyRegistry
+from broadcaster import Broadcaster
+from response_cache import ResponseCache
+from admission import AdmissionController
+from history import History
+from state import SqliteEventBus, SqliteNonceStore, SqliteReplayFilter
+import metrics
 from models import (
     DotBotNotificationModel,
     DotBotNotificationCommand,
     AuthorizationResult,
-    AttestationResult
+    AttestationResult,
+    ApprovalRequest,
+    BatchResult,
 )
 
-import hashlib
-from attestation_decoder import decode_cose_sign1_message
-from cryptography.exceptions import InvalidSignature
+from attestation_decoder import (
+    IANA_CBOR_EAT_UEID_KEY,
+    decode_claims,
+    parse_payload,
+    split_cose_sign1,
+)
 import os
 
-from attestation_provision import public_key_bytes, basedir, accepted_type_evidence, approved_hash_evidence
-from errors import NoMatchError
+from attestation_provision import public_key_bytes, accepted_type_evidence, approved_hash_evidence
+from errors import NoMatchError, UnknownKeyError
+from launcher import WORKER_CONFIG_ENV
+
+
+def ueid_to_str(ueid):
+    """Returns the UEID as displayed on the UI."""
+    if isinstance(ueid, bytes):
+        return ueid.hex()
+    return str(ueid)
+
 
 class Authority:
     """Main class of the DotBot Authority."""
 
-    def __init__(self):
+    def __init__(
+        self,
+        crypto_executor="thread",
+        crypto_workers=None,
+        evidence_executor="process",
+        evidence_workers=None,
+        evidence_batch_size=64,
+        evidence_batch_window=0.0,
+        acl=None,
+        approval_timeout=0.0,
+        max_pending_approvals=128,
+        nonce_capacity=4096,
+        nonce_ttl=30.0,
+        nonce_mode="store",
+        nonce_secret=None,
+        reference_values=None,
+        firmware_dir=None,
+        verdict_cache_size=1024,
+        cred_dir=None,
+        key_cache_size=1024,
+        ws_queue_size=256,
+        ws_batch_window=0.0,
+        voucher_cache_size=1024,
+        voucher_cache_ttl=10.0,
+        device_rate=5.0,
+        device_burst=10,
+        peer_rate=0.0,
+        peer_burst=100,
+        max_concurrency=256,
+        history_file=None,
+        history_size=10000,
+        history_replay=100,
+        state=None,
+        host="127.0.0.1",
+        port=18000,
+        coap_port=None,
+    ):
         self.api = api
         api.authority = self
-        self.enrollment_server = lakers.AuthzServerUserAcl(
-            W,
-            CRED_V,
+        self.host = host
+        self.port = port
+        self.coap_port = coap_port
+        self.crypto = CryptoExecutor(crypto_executor, crypto_workers)
+        self.verifier = EvidenceVerifier(
+            evidence_executor,
+            evidence_workers,
+            batch_size=evidence_batch_size,
+            batch_window=evidence_batch_window,
+            key_cache_size=key_cache_size,
+        )
+        # with a shared state database, the ACL is kept in it by default
+        self.acl = AclStore(acl or state, default=[1, 43])
+        # DotBots missing from the ACL, waiting for the operator, fewer than
+        # the requests handled at once so that the known DotBots still get in
+        if max_concurrency:
+            max_pending_approvals = min(max_pending_approvals, max_concurrency - 1)
+        self.approvals = ApprovalQueue(
+            timeout=approval_timeout, capacity=max_pending_approvals
+        )
+        # results of the authorizations and attestations, replayed to new clients
+        self.history = History(history_file, capacity=history_size)
+        self.history_replay = history_replay
+        self.admission = AdmissionController(
+            device_rate=device_rate,
+            device_burst=device_burst,
+            peer_rate=peer_rate,
+            peer_burst=peer_burst,
+            max_concurrency=max_concurrency,
+        )
+        self.voucher_cache = ResponseCache(
+            capacity=voucher_cache_size, ttl=voucher_cache_ttl
+        )
+        self.websockets = Broadcaster(
+            queue_size=ws_queue_size, batch_window=ws_batch_window
         )
-        self.acl = [1, 43]
-        self.authorization_log = []
-        self.websockets = []
         self.logger = LOGGER.bind(context=__name__)
-        self.logger.debug("Creating Authority instance")
-        self.file_directory = basedir
-        self.nonces = {}
-        #self.nonce = 'a29f62a4c6cdaae5'
-        self.public_key_bytes = public_key_bytes
+        self.logger.debug(
+            "Creating Authority instance",
+            crypto_executor=self.crypto.kind,
+            crypto_workers=self.crypto.workers,
+            evidence_executor=self.verifier.kind,
+            evidence_workers=self.verifier.workers,
+        )
+        if nonce_mode == "hmac":
+            if state is None:
+                replay_filter = ReplayFilter(capacity=nonce_capacity)
+            else:
+                replay_filter = SqliteReplayFilter(state, capacity=nonce_capacity)
+            self.nonces = HmacNonceIssuer(
+                load_secret(nonce_secret), ttl=nonce_ttl, replay_filter=replay_filter
+            )
+        elif state is None:
+            self.nonces = NonceStore(capacity=nonce_capacity, ttl=nonce_ttl)
+        else:
+            self.nonces = SqliteNonceStore(state, capacity=nonce_capacity, ttl=nonce_ttl)
+        self.events = SqliteEventBus(state) if state is not None else None
+        # the state database is written from a single thread, in order, so
+        # that a worker holding its lock never stalls the event loop
+        self.state_executor = (
+            concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix="state")
+            if state is not None
+            else None
+        )
+        self.reference_values = ReferenceValueStore(
+            reference_values, default=approved_hash_evidence
+        )
+        self.firmware = (
+            FirmwareDigestCache(firmware_dir) if firmware_dir is not None else None
+        )
+        self.appraiser = Appraiser(
+            self.reference_values, self.firmware, capacity=verdict_cache_size
+        )
+        self.credentials = CredentialStore(cred_dir)
+        self.keys = KeyRegistry(
+            self.credentials.values(),
+            default_key=public_key_bytes,
+        )
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Exports the state of the authority components as metrics."""
+        registry = metrics.REGISTRY
+        registry.callback(
+            "dotbot_authority_nonces",
+            "Pending attestation nonces.",
+            lambda: len(self.nonces),
+        )
+        registry.callback(
+            "dotbot_authority_nonce_expirations_total",
+            "Attestation nonces expired before being used.",
+            lambda: self.nonces.expirations,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_nonce_evictions_total",
+            "Attestation nonces evicted because the store was full.",
+            lambda: self.nonces.evictions,
+            kind="counter",
+        )
+        if isinstance(self.nonces, HmacNonceIssuer):
+            registry.callback(
+                "dotbot_authority_nonce_overflows_total",
+                "Evidence rejected because the replay filter was full.",
+                lambda: self.nonces.overflows,
+                kind="counter",
+            )
+        registry.callback(
+            "dotbot_authority_websocket_clients",
+            "Connected websocket clients.",
+            lambda: len(self.websockets),
+        )
+        registry.callback(
+            "dotbot_authority_websocket_frames_sent_total",
+            "Frames sent to the websocket clients.",
+            lambda: self.websockets.sent,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_websocket_clients_dropped_total",
+            "Websocket clients disconnected for being too slow.",
+            lambda: self.websockets.dropped_clients,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_acl_size",
+            "DotBots in the ACL.",
+            lambda: len(self.acl),
+        )
+        registry.callback(
+            "dotbot_authority_pending_approvals",
+            "DotBots waiting for the operator decision.",
+            lambda: len(self.approvals),
+        )
+        registry.callback(
+            "dotbot_authority_approval_expirations_total",
+            "DotBots denied because the operator did not decide in time.",
+            lambda: self.approvals.expirations,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_voucher_cache_hits_total",
+            "Voucher requests answered from the cache or a computation in progress.",
+            lambda: self.voucher_cache.hits + self.voucher_cache.coalesced,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_voucher_cache_misses_total",
+            "Voucher requests processed.",
+            lambda: self.voucher_cache.misses,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_voucher_cache_hit_ratio",
+            "Share of the voucher requests answered without being processed.",
+            lambda: self.voucher_cache.hit_rate,
+        )
+        registry.callback(
+            "dotbot_authority_evidence_signatures_total",
+            "Evidence signatures checked.",
+            lambda: self.verifier.verified,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_evidence_batches_total",
+            "Batches of evidence signatures sent to the verifier workers.",
+            lambda: self.verifier.batches,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_verdict_cache_hits_total",
+            "Evidence appraised from the verdict of the same measured claims.",
+            lambda: self.appraiser.hits,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_verdict_cache_misses_total",
+            "Evidence appraised against the reference values and firmware images.",
+            lambda: self.appraiser.misses,
+            kind="counter",
+        )
+        registry.callback(
+            "dotbot_authority_verdict_cache_hit_ratio",
+            "Share of the evidence appraised from a cached verdict.",
+            lambda: self.appraiser.hit_rate,
+        )
+        if self.firmware is not None:
+            registry.callback(
+                "dotbot_authority_firmware_digests_computed_total",
+                "Firmware image digests computed, the others were memoized.",
+                lambda: self.firmware.computations,
+                kind="counter",
+            )
 
-    async def authorize_dotbot(self, id_u):
+    async def authorize_dotbot(self, id_u, notifications=None):
         """
         Two options:
         - compare with a local acl, notify UI, and return the result
         - ask for the user to decide on the UI, and return the result
+
+        The user is asked when the DotBot is not in the acl and the approval
+        queue is enabled. The requests joining a decision already pending
+        return without notifying, the first one notifies the result.
+
+        With a notifications list, the result is appended to it instead of
+        being notified, to be sent with the other results of a batch.
         """
         self.logger.debug("Authorizing dotbot", id_u=id_u)
+        start = time.perf_counter()
         authorized = id_u in self.acl
+        metrics.ACL_LOOKUP.observe(time.perf_counter() - start)
+        if not authorized and self.approvals.enabled:
+            decision, created = self.approvals.request(id_u)
+            if created:
+                # sent at once, even in a batch waiting for the decision
+                await self.notify_clients(
+                    DotBotNotificationModel(
+                        cmd=DotBotNotificationCommand.APPROVAL_REQUEST,
+                        data=ApprovalRequest(
+                            timestamp=decision.timestamp,
+                            id=id_u,
+                            expires=decision.expires,
+                        ),
+                    )
+                )
+            if decision is not None:
+                # the operator may take long, other requests can use the slot
+                with self.admission.released():
+                    authorized = await self.approvals.wait(decision)
+                if not created:
+                    return authorized
+        result = AuthorizationResult(
+            timestamp=int(round(time.time() * 1000)), id=id_u, authorized=authorized
+        )
+        if notifications is not None:
+            notifications.append(result)
+            return authorized
         notif = DotBotNotificationModel(
-            cmd=DotBotNotificationCommand.AUTHORIZATION_RESULT,
-            data=AuthorizationResult(
-                timestamp=int(round(time.time() * 1000)), id=id_u, authorized=authorized
-            ),
+            cmd=DotBotNotificationCommand.AUTHORIZATION_RESULT, data=result
         )
         self.logger.debug("Notifying clients", authorized=authorized)
         await self.notify_clients(notif)
         return authorized
 
-    async def _ws_send_safe(self, websocket: WebSocket, msg: str):
-        """Safely send a message to a websocket client."""
-        try:
-            await websocket.send_text(msg)
-        except websockets.exceptions.ConnectionClosedError:
-            await asyncio.sleep(0.1)
+    async def decide(self, ids, authorized):
+        """Applies the operator decision on pending DotBots, all if ids is None.
+
+        The approved DotBots are added to the acl, off the event loop, before
+        their requests resume, so that their next requests do not wait again.
+        Returns the ids that were pending.
+        """
+        if ids is None:
+            ids = [decision["id"] for decision in self.approvals.to_list()]
+        else:
+            ids = [id_u for id_u in ids if id_u in self.approvals]
+        if authorized and ids:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self.acl.add, *ids)
+        return self.approvals.decide(ids, authorized)
+
+    async def notify_batch(self, results):
+        """Sends the authorization and attestation results of a batch at once."""
+        if not results:
+            return
+        notif = DotBotNotificationModel(
+            cmd=DotBotNotificationCommand.BATCH_RESULT,
+            data=BatchResult(
+                authorizations=[r for r in results if isinstance(r, AuthorizationResult)],
+                attestations=[r for r in results if isinstance(r, AttestationResult)],
+            ),
+        )
+        await self.notify_clients(notif)
 
     async def notify_clients(self, notification):
         """Send a message to all clients connected."""
         self.logger.debug("notify", cmd=notification.cmd.name)
-        await asyncio.gather(
-            *[
-                self._ws_send_safe(
-                    websocket, json.dumps(notification.dict(exclude_none=True))
-                )
-                for websocket in self.websockets
-            ]
-        )
+        start = time.perf_counter()
+        content = notification.dict(exclude_none=True)
+        message = json.dumps(content)
+        self.record_history(content, message)
+        self.websockets.publish_text(message)
+        if self.events is not None:
+            self.state_executor.submit(self.events.publish, message)
+        metrics.WS_NOTIFY.observe(time.perf_counter() - start)
+
+    def record_history(self, content, message, persist=True):
+        """Records the results of a notification, given decoded and encoded."""
+        data = content.get("data") or {}
+        kind = {
+            DotBotNotificationCommand.AUTHORIZATION_RESULT: "authorization",
+            DotBotNotificationCommand.ATTESTATION_RESULT: "attestation",
+        }.get(content["cmd"])
+        if kind is not None:
+            self.history.record(kind, data["timestamp"], data["id"], data, message, persist)
+        elif content["cmd"] == DotBotNotificationCommand.BATCH_RESULT:
+            # each result on its own, so that the replay does not repeat batches
+            for kind, key, cmd in (
+                ("authorization", "authorizations", DotBotNotificationCommand.AUTHORIZATION_RESULT),
+                ("attestation", "attestations", DotBotNotificationCommand.ATTESTATION_RESULT),
+            ):
+                for item in data.get(key, []):
+                    item_message = json.dumps({"cmd": cmd, "data": item})
+                    self.history.record(
+                        kind, item["timestamp"], item["id"], item, item_message, persist
+                    )
+
+    def deliver_event(self, message):
+        """Handles a notification relayed from another worker."""
+        # only the worker producing a result writes it to the history file
+        self.record_history(json.loads(message), message, persist=False)
+        self.websockets.publish_text(message)
 
     async def web(self):
         """Starts the web server application."""
         logger = LOGGER.bind(context=__name__)
-        config = uvicorn.Config(api, port=18000, log_level="info", reload=True)
+        config = uvicorn.Config(api, host=self.host, port=self.port, log_level="info")
         server = uvicorn.Server(config)
 
         try:
@@ -99,96 +424,148 @@ class Authority:
             logger.info("Stopping web server")
             raise SystemExit()
 
+    async def coap(self):
+        """Serves the lake-authz and lake-ra resources over CoAP."""
+        # imported here, aiocoap is only needed with a CoAP port
+        from coap import create_server
+
+        logger = LOGGER.bind(context=__name__)
+        context = await create_server(self.host, self.coap_port)
+        logger.info("Starting CoAP server", port=self.coap_port)
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            logger.info("Stopping CoAP server")
+            await context.shutdown()
+
+    def start_background_tasks(self):
+        """Starts the tasks watching the configuration and the shared state."""
+        coroutines = [
+            self.acl.watch(),
+            self.reference_values.watch(),
+            self.credentials.watch(
+                on_reload=lambda store: self.keys.load(store.values())
+            ),
+        ]
+        if self.events is not None:
+            coroutines.append(self.events.watch(self.deliver_event))
+        if self.firmware is not None:
+            coroutines.append(self.firmware.watch())
+        return [asyncio.create_task(coroutine) for coroutine in coroutines]
+
+    async def run_state(self, func, *args):
+        """Calls func, in the state thread when the state is in a database."""
+        if self.state_executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.state_executor, func, *args)
+
+    def stop(self, tasks):
+        """Cancels the tasks and releases the workers of the authority."""
+        for task in tasks:
+            task.cancel()
+        if self.state_executor is not None:
+            self.state_executor.shutdown(wait=False)
+        self.crypto.shutdown()
+        self.verifier.shutdown()
+        self.approvals.shutdown()
+        self.history.close()
+
     async def run(self):
         """Launch the authority."""
         tasks = []
         try:
-            tasks = [
-                asyncio.create_task(self.web()),
-            ]
+            tasks = [asyncio.create_task(self.web())]
+            if self.coap_port is not None:
+                tasks.append(asyncio.create_task(self.coap()))
+            tasks += self.start_background_tasks()
             await asyncio.gather(*tasks)
         except SystemExit:
             self.logger.info("Stopping authority")
         finally:
-            for task in tasks:
-                task.cancel()
+            self.stop(tasks)
 
     async def handle_attestation_proposal (self, cid, proposal_bytes):
         decoded_proposal = cbor2.loads(proposal_bytes)
-        print(decoded_proposal)
+        self.logger.debug("Attestation proposal", evidence_types=decoded_proposal)
         selected_type = next((num for num in decoded_proposal if num in accepted_type_evidence), None)
         if selected_type is not None:
-            self.nonces[cid] = secrets.token_bytes(8)
-            ead_2 = (selected_type, self.nonces[cid])
+            ead_2 = (selected_type, await self.run_state(self.nonces.issue, cid))
             return cbor2.dumps(ead_2)
         else:
             raise NoMatchError("No match found in the proposal evidence type list")
 
-    async def evaluate_evidence(self, cid, cbor_bytes, public_key_bytes):
-        attestation_result = False
+    async def evaluate_evidence(self, cid, cbor_bytes, notifications=None):
         LOGGER.debug(f"start to evaluate the evidence")
-        decoded_info = decode_cose_sign1_message(cbor_bytes, public_key_bytes)
-        attester_nonce = decoded_info["nonce"]
-        attester_ueid = decoded_info["ueid"]
-        attester_hash = decoded_info["measurements"][0]["files_info"][0]["hash_value"]
-        attester_software_name = decoded_info["measurements"][0]["software_name"]
-        #fs_size = decoded_info["measurements"][0]["files_info"][0]["size"]
-        file_name = decoded_info["measurements"][0]["files_info"][0]["fs_name"] 
-        #verifier_hash_file = os.path.join(self.file_directory, file_name)
+        message = split_cose_sign1(cbor_bytes)
+        claims = decode_claims(message)
+        # rejects a kid and a UEID of different devices
+        public_key = self.keys.get_bytes(
+            kid=message.kid, ueid=claims.get(IANA_CBOR_EAT_UEID_KEY)
+        )
+        if public_key is None:
+            raise UnknownKeyError("No attestation key registered for this device")
+        if not await self.verifier.verify(
+            public_key, message.signature, message.sig_structure()
+        ):
+            raise InvalidSignature()
+        self.logger.debug("Signature check: SUCCESS", signature=lazy_hex(message.signature))
+        evidence = parse_payload(claims)
+        # the device is the one of the UEID, bound to the key checked above
+        ueid = evidence.ueid if evidence.ueid is not None else self.keys.ueid(message.kid)
 
         LOGGER.debug(f"finished parsing evidence, start to compare")
 
-        try:
-            nonce = self.nonces[cid]
-        except: 
-            print("Nonce not found")
-        # check nonce
-        if nonce.hex() == attester_nonce:
-            attestation_result = True
-            print("Nonce check: SUCCESS\n Nonce is: ", nonce.hex())
+        start = time.perf_counter()
+        # check nonce, each nonce can only be used once
+        nonce_result = await self.run_state(self.nonces.verify, cid, evidence.nonce)
+        metrics.NONCE_CHECK.observe(time.perf_counter() - start)
+        if nonce_result:
+            self.logger.debug("Nonce check: SUCCESS", nonce=lazy_hex(evidence.nonce))
         else:
-            print("Nonce check: FAIL\n Nonce from the Attester is: \n", attester_nonce , "\n Nonce from the Verifier is: \n",  nonce.hex())
-
-        # check hash  
-        # with open(verifier_hash_file, 'r+b') as file:
-        #     data = file.read()
-        #     length = len(data)
-
-        #     if length < fs_size:
-        #         padding_size = fs_size - length
-        #         data += bytes([0xFF] * padding_size)
-
-        # sha256 = hashlib.sha256()
-        # sha256.update (data)
-        # verifier_hash = sha256.hexdigest()
-
-        # if (verifier_hash.lower() == attester_hash.lower() and attestation_result == True):
-        #     print(f"Hash value check: SUCCESS\n Hash value is: {verifier_hash}")
-        #     attestation_result = True
-        # else:
-        #     print(
-        #         "Hash value check: FAIL\n "
-        #         "Hash result from the Attester is: \n "
-        #         f"{attester_hash} \n "
-        #         "Hash result from the Verifier is: \n "
-        #         f"{verifier_hash}"
-        #     )
-
-        if (attester_hash.lower(), attester_software_name) in [(hash.lower(), software_name) for hash, software_name in approved_hash_evidence]:
-            attestation_result = True
-            print(f"Hash value check: SUCCESS\n Hash value is: {attester_hash}")
-        
+            self.logger.info(
+                "Nonce check: FAIL, unknown, expired or already used",
+                attester_nonce=lazy_hex(evidence.nonce),
+            )
 
+        # the verdict of the measured claims, shared by the devices reporting them
+        start = time.perf_counter()
+        verdict = await self.appraiser.appraise(evidence)
+        attestation_result = nonce_result and verdict.approved
+        metrics.APPRAISAL.observe(time.perf_counter() - start)
+
+        result = AttestationResult(
+            timestamp=int(round(time.time() * 1000)),
+            id=ueid_to_str(ueid),
+            attestation_result=attestation_result,
+            software_name=verdict.software_name,
+            fs_name=verdict.fs_name,
+            tag_version=verdict.tag_version,
+        )
+        if notifications is not None:
+            notifications.append(result)
+            return attestation_result
         notif = DotBotNotificationModel(
-            cmd=DotBotNotificationCommand.ATTESTATION_RESULT,
-            data=AttestationResult(
-                id= attester_ueid,
-                attestation_result= attestation_result,
-                software_name = decoded_info["measurements"][0]["software_name"],
-                fs_name = file_name,
-                tag_version = decoded_info["measurements"][0]["tag_version"],
-            ),
+            cmd=DotBotNotificationCommand.ATTESTATION_RESULT, data=result
         )
         self.logger.debug("notify client of attestation result", attestation_result = attestation_result)
         await self.notify_clients(notif)
-        return attestation_result
\ No newline at end of file
+        return attestation_result
+
+
+def create_worker_app():
+    """Returns the application of a worker process started by launcher.serve."""
+    config = json.loads(os.environ[WORKER_CONFIG_ENV])
+    setup_logging(*config["logging"])
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        authority = Authority(**config["authority"])
+        tasks = authority.start_background_tasks()
+        try:
+            yield
+        finally:
+            authority.stop(tasks)
+
+    api.router.lifespan_context = lifespan
+    return api
@@ -0,0 +1,81 @@
+"""Fan-out of the notifications to the websocket clients."""
+
+import asyncio
+
+from logger import LOGGER
+
+
+class Broadcaster:
+    """Sends notifications to websocket clients without blocking the caller.
+
+    Each notification is encoded once and pushed into a bounded queue per
+    client, drained by a dedicated sender task. A client whose queue is full
+    is too slow and gets disconnected. With a batch_window, the messages
+    queued during the window are sent as a single JSON array frame.
+    """
+
+    def __init__(self, queue_size=256, batch_window=0.0, max_batch=64):
+        self.queue_size = queue_size
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.logger = LOGGER.bind(context=__name__)
+        self._clients = {}
+        self.sent = 0
+        self.dropped_clients = 0
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __contains__(self, websocket):
+        return websocket in self._clients
+
+    def add(self, websocket, replay=()):
+        """Registers a connected websocket and starts its sender task.
+
+        The already encoded messages of replay are sent first, in one frame.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        if replay:
+            queue.put_nowait(f"[{','.join(replay)}]")
+        task = asyncio.create_task(self._sender(websocket, queue))
+        self._clients[websocket] = (queue, task)
+
+    def remove(self, websocket):
+        """Unregisters a websocket and stops its sender task."""
+        client = self._clients.pop(websocket, None)
+        if client is not None:
+            client[1].cancel()
+
+    def publish_text(self, message):
+        """Queues an already encoded message for every client."""
+        for websocket, (queue, _) in list(self._clients.items()):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.logger.warning("Websocket client too slow, disconnecting")
+                self.dropped_clients += 1
+                self.remove(websocket)
+                asyncio.create_task(self._close(websocket))
+
+    async def _sender(self, websocket, queue):
+        try:
+            while True:
+                message = await queue.get()
+                if self.batch_window > 0:
+                    await asyncio.sleep(self.batch_window)
+                    if not queue.empty():
+                        batch = [message]
+                        while not queue.empty() and len(batch) < self.max_batch:
+                            batch.append(queue.get_nowait())
+                        message = f"[{','.join(batch)}]"
+                await websocket.send_text(message)
+                self.sent += 1
+        except Exception as exc:
+            self.logger.debug("Websocket send failed", error=str(exc))
+            self._clients.pop(websocket, None)
+
+    async def _close(self, websocket):
+        try:
+            await websocket.close()
+        except Exception:
+            pass
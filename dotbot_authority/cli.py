@@ -7,18 +7,195 @@ dotbot-authority-cli new --basedir ~/.dotbots-deployment1 --label dotbot3
 dotbot-authority-cli new --basedir ~/.dotbots-deployment1 --label dotbot4
 dotbot-authority-cli new --basedir ~/.dotbots-deployment1 --label gateway6
 dotbot-authority-cli new --basedir ~/.dotbots-deployment1 --label server9
+dotbot-authority-cli new-batch --basedir ~/.dotbots-deployment1 --count 50000
+dotbot-authority-cli list --basedir ~/.dotbots-deployment1 --label 'dotbot1*' --limit 20
 """
 
-import uuid, cbor2, click, os, re, rich, glob
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography import x509
-from cryptography.x509.oid import NameOID
+import uuid, cbor2, click, os, re, rich, json, fnmatch, sys
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 
+# the x509 stack and the rich tables are imported by the commands using them,
+# listing identities does not pay for the key generation imports
+
+
+# private material of the packed identities, in a pack like the credentials
+# one read by the authority with --cred-dir (see credentials.py), each being a
+# CBOR map {"label", "id", "priv", "cert"} with the raw private key and DER cert
+IDENTITIES_PACK_FILE = "identities.pack"
+IDENTITIES_INDEX_FILE = "identities.idx"
+# index of the identities, one JSON object per line appended by new and
+# new-batch: {"label", "uuid", "kid", "files", "created"}, the last line of
+# a label wins
+MANIFEST_FILE = "manifest.jsonl"
+CERT_FILE_SUFFIX = "-cert-p256.pem"
+PRIV_PEM_FILE_SUFFIX = "-priv-p256.pem"
+PRIV_BYTES_FILE_SUFFIX = "-priv-bytes"
+CRED_FILE_SUFFIX = "-cred-rpk.cbor"
+IDENTITY_FILE_SUFFIXES = (
+    CERT_FILE_SUFFIX,
+    PRIV_PEM_FILE_SUFFIX,
+    PRIV_BYTES_FILE_SUFFIX,
+    CRED_FILE_SUFFIX,
+)
+
+
+def _timestamp(seconds=None):
+    if seconds is None:
+        return datetime.utcnow().isoformat(timespec="seconds")
+    return datetime.utcfromtimestamp(seconds).isoformat(timespec="seconds")
+
+
+def kid_to_bytes(kid):
+    """Encodes a kid as the shortest big-endian byte string."""
+    return kid.to_bytes(max(1, (kid.bit_length() + 7) // 8), "big")
+
+
+def _credentials():
+    """Returns the credentials module of the authority, owning the pack format.
+
+    Imported on use, as the authority modules import each other by their flat
+    names and pull in the logging stack, that listing does not need.
+    """
+    authority_dir = os.path.dirname(os.path.abspath(__file__))
+    if authority_dir not in sys.path:
+        sys.path.insert(0, authority_dir)
+    import credentials
+
+    return credentials
+
+
+def add_to_packs(basedir, identities):
+    """Merges identities, as returned by make_identity, into the packs."""
+    packs = _credentials()
+    credentials = packs.read_pack(basedir)
+    if not credentials:
+        # the authority ignores the credential files once there is a pack
+        credentials = dict(packs.read_credential_files(basedir))
+    secrets = packs.read_pack(basedir, IDENTITIES_PACK_FILE, IDENTITIES_INDEX_FILE)
+    for identity in identities:
+        credentials[identity["kid"]] = identity["cred"]
+        secrets[identity["kid"]] = cbor2.dumps(
+            {
+                "label": identity["label"],
+                "id": identity["id"],
+                "priv": identity["priv"],
+                "cert": identity["cert"],
+                "created": identity["created"],
+            }
+        )
+    packs.write_pack(basedir, secrets, IDENTITIES_PACK_FILE, IDENTITIES_INDEX_FILE)
+    # the credentials last, the authority reloads when they change
+    packs.write_pack(basedir, credentials)
+
+
+def used_kids(basedir):
+    """Returns the kids of the identities already in basedir."""
+    return set(
+        entry["kid"] for entry in read_manifest(basedir).values() if entry["kid"] is not None
+    )
+
+
+def manifest_entry(identity, files):
+    return {
+        "label": identity["label"],
+        "uuid": str(uuid.UUID(bytes=identity["id"])),
+        "kid": identity["kid"],
+        "files": files,
+        "created": identity["created"],
+    }
+
+
+def build_manifest(basedir):
+    """Rebuilds the manifest entries from the packs and files of basedir."""
+    entries = {}
+    identities_path = os.path.join(basedir, IDENTITIES_PACK_FILE)
+    if not os.path.exists(os.path.join(basedir, IDENTITIES_INDEX_FILE)):
+        identities = {}
+    else:
+        identities = _credentials().read_pack(
+            basedir, IDENTITIES_PACK_FILE, IDENTITIES_INDEX_FILE
+        )
+    for kid, content in identities.items():
+        secret = cbor2.loads(content)
+        entries[secret["label"]] = manifest_entry(
+            {
+                "label": secret["label"],
+                "id": secret["id"],
+                "kid": kid,
+                "created": secret.get("created")
+                or _timestamp(os.stat(identities_path).st_mtime),
+            },
+            [IDENTITIES_PACK_FILE, _credentials().PACK_FILE],
+        )
+    # a single pass over the directory, the label is the file name minus suffix
+    for filename in sorted(os.listdir(basedir)):
+        suffix = next((s for s in IDENTITY_FILE_SUFFIXES if filename.endswith(s)), None)
+        if suffix is None:
+            continue
+        label = filename[: -len(suffix)]
+        entry = entries.setdefault(
+            label,
+            {"label": label, "uuid": None, "kid": None, "files": [], "created": None},
+        )
+        if filename not in entry["files"]:
+            entry["files"].append(filename)
+        if suffix == CRED_FILE_SUFFIX:
+            path = os.path.join(basedir, filename)
+            with open(path, "rb") as f:
+                ccs = cbor2.load(f)
+            entry["uuid"] = str(uuid.UUID(bytes=ccs[2]))
+            entry["kid"] = int.from_bytes(ccs[8][1][2], "big")
+            entry["created"] = entry["created"] or _timestamp(os.stat(path).st_mtime)
+    return entries
+
+
+def write_manifest(basedir, entries):
+    path = os.path.join(basedir, MANIFEST_FILE)
+    with open(f"{path}.tmp", "w") as f:
+        for entry in entries.values():
+            f.write(json.dumps(entry) + "\n")
+    os.replace(f"{path}.tmp", path)
+
+
+def read_manifest(basedir):
+    """Returns the manifest entries by label, rebuilding a missing manifest."""
+    path = os.path.join(basedir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        entries = build_manifest(basedir)
+        write_manifest(basedir, entries)
+        return entries
+    entries = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # a line cut by an interrupted append
+                continue
+            entries[entry["label"]] = entry
+    return entries
+
+
+def append_to_manifest(basedir, entries):
+    """Records new entries, the identity files must already be written."""
+    path = os.path.join(basedir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        # the rebuilt manifest includes the new identities
+        write_manifest(basedir, build_manifest(basedir))
+        return
+    with open(path, "a") as f:
+        f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+
+def make_identity(label, kid):
+    """Generates the key pair, self-signed certificate and CCS of an identity."""
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
 
-def gen_id(label, basedir):
     id = uuid.uuid4()
     priv = ec.generate_private_key(ec.SECP256R1(), default_backend())
 
@@ -46,7 +223,7 @@ def gen_id(label, basedir):
         8: {
             1: {
                 1: 2,
-                2: int(label[-1]).to_bytes(1, "big"),
+                2: kid_to_bytes(kid),
                 -1: 1,
                 -2: priv.public_key().public_numbers().x.to_bytes(32, "big"),
                 -3: priv.public_key().public_numbers().y.to_bytes(32, "big"),
@@ -54,14 +231,44 @@ def gen_id(label, basedir):
         },
     }
 
+    return {
+        "label": label,
+        "kid": kid,
+        "id": id.bytes,
+        "priv": priv.private_numbers().private_value.to_bytes(32, "big"),
+        "cert": cred_cert_self_signed.public_bytes(serialization.Encoding.DER),
+        "cred": cbor2.dumps(cred_rpk_ccs),
+        "created": _timestamp(),
+    }
+
+
+def _make_identities(labels_and_kids):
+    # runs in the worker processes of new-batch
+    return [make_identity(label, kid) for label, kid in labels_and_kids]
+
+
+def write_identity_files(identity, basedir, verbose=True):
+    """Writes the PEM, raw key and CCS files of an identity, returns their names."""
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import serialization
+    from cryptography import x509
+
+    label = identity["label"]
+    priv = ec.derive_private_key(
+        int.from_bytes(identity["priv"], "big"), ec.SECP256R1(), default_backend()
+    )
+    cert = x509.load_der_x509_certificate(identity["cert"], default_backend())
+
     def write_to_file(filename, content):
-        print(f"Writing {len(content)} bytes to {filename}")
+        if verbose:
+            print(f"Writing {len(content)} bytes to {filename}")
         with open(filename, "wb") as f:
             f.write(content)
 
     write_to_file(
         f"{basedir}/{label}-cert-p256.pem",
-        cred_cert_self_signed.public_bytes(serialization.Encoding.PEM),
+        cert.public_bytes(serialization.Encoding.PEM),
     )
     write_to_file(
         f"{basedir}/{label}-priv-p256.pem",
@@ -72,11 +279,20 @@ def gen_id(label, basedir):
         ),
     )
 
-    write_to_file(
-        f"{basedir}/{label}-priv-bytes",
-        priv.private_numbers().private_value.to_bytes(32, "big"),
-    )
-    write_to_file(f"{basedir}/{label}-cred-rpk.cbor", cbor2.dumps(cred_rpk_ccs))
+    write_to_file(f"{basedir}/{label}-priv-bytes", identity["priv"])
+    write_to_file(f"{basedir}/{label}-cred-rpk.cbor", identity["cred"])
+    return [f"{label}{suffix}" for suffix in IDENTITY_FILE_SUFFIXES]
+
+
+def gen_id(label, basedir, kid):
+    identity = make_identity(label, kid)
+    files = write_identity_files(identity, basedir)
+    if _credentials().is_packed(basedir):
+        # the authority only reads the pack once there is one
+        add_to_packs(basedir, [identity])
+        files += [IDENTITIES_PACK_FILE, _credentials().PACK_FILE]
+    append_to_manifest(basedir, [manifest_entry(identity, files)])
+    return identity
 
 
 @click.group()
@@ -89,29 +305,142 @@ def main():
     "--basedir", required=True, help="Directory where identity info will be saved"
 )
 @click.option("--label", required=True, help="Label for the new dotbot identity")
-def new(basedir, label):
+@click.option(
+    "--kid",
+    type=int,
+    default=None,
+    help="Key identifier [default: number at the end of the label, or next free]",
+)
+def new(basedir, label, kid):
     print(f"Generating new identity.")
     if not os.path.exists(basedir):
         os.mkdir(basedir)
-    gen_id(label, basedir)
+    kids = used_kids(basedir)
+    if kid is None:
+        number = re.search(r"[0-9]+$", label)
+        if number is not None and int(number.group(0)) not in kids:
+            kid = int(number.group(0))
+        else:
+            kid = max(kids, default=0) + 1
+    elif kid in kids:
+        raise click.BadParameter(f"kid {kid} is already used", param_hint="--kid")
+    gen_id(label, basedir, kid)
+    print(f"Identity {label} has kid {kid}.")
+
+
+@main.command("new-batch")
+@click.option(
+    "--basedir", required=True, help="Directory where identity info will be saved"
+)
+@click.option("--count", type=int, required=True, help="Number of identities")
+@click.option(
+    "--label-prefix", default="dotbot", show_default=True, help="Prefix of the labels"
+)
+@click.option(
+    "--workers", type=int, default=None, help="Worker processes [default: CPU count]"
+)
+@click.option(
+    "--pem/--no-pem",
+    default=False,
+    show_default=True,
+    help="Also write the per-identity PEM and CBOR files",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    help="Replace the identities whose labels are already in the manifest",
+)
+def new_batch(basedir, count, label_prefix, workers, pem, force):
+    """Generates many identities in parallel, written to packs."""
+    if not os.path.exists(basedir):
+        os.mkdir(basedir)
+    # kids are allocated after the highest one in use, so they never collide
+    first = max(used_kids(basedir), default=0) + 1
+    jobs = [(f"{label_prefix}{kid}", kid) for kid in range(first, first + count)]
+    # labels can collide though, and the manifest only keeps the last identity of a label
+    labels = read_manifest(basedir)
+    taken = [label for label, _ in jobs if label in labels]
+    if taken and not force:
+        raise click.ClickException(
+            f"{len(taken)} labels are already used, starting with {taken[0]}. "
+            "Use another --label-prefix, or --force to replace them."
+        )
+    workers = workers or os.cpu_count() or 1
+    chunk = max(1, min(256, count // (workers * 4)))
+    chunks = [jobs[i : i + chunk] for i in range(0, len(jobs), chunk)]
+    print(f"Generating {count} identities with {workers} workers.")
+    identities = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in executor.map(_make_identities, chunks):
+            identities.extend(batch)
+    add_to_packs(basedir, identities)
+    credentials_pack_file = _credentials().PACK_FILE
+    entries = []
+    for identity in identities:
+        files = [IDENTITIES_PACK_FILE, credentials_pack_file]
+        if pem:
+            files = write_identity_files(identity, basedir, verbose=False) + files
+        entries.append(manifest_entry(identity, files))
+    append_to_manifest(basedir, entries)
+    print(
+        f"Wrote kids {first} to {first + count - 1} to "
+        f"{basedir}/{credentials_pack_file} and {basedir}/{IDENTITIES_PACK_FILE}."
+    )
 
 
 @main.command("list")
 @click.option(
     "--basedir", required=True, help="Directory where identity info is stored"
 )
-def list(basedir):
-    print(f"Listing identities.")
+@click.option("--label", "pattern", default=None, help="Only labels matching this glob pattern")
+@click.option("--kid", type=int, default=None, help="Only the identity with this kid")
+@click.option("--offset", type=int, default=0, show_default=True, help="Identities to skip")
+@click.option(
+    "--limit", type=int, default=100, show_default=True, help="Identities to show, 0 for all"
+)
+@click.option("--json", "as_json", is_flag=True, help="Print the identities as JSON")
+def list(basedir, pattern, kid, offset, limit, as_json):
+    """Lists the identities, from the manifest only."""
     if not os.path.exists(basedir):
-        raise Exception(f"Directory {basedir} does not exist.")
-    labels = set(
-        [re.match(r"^[a-z0-9]+", filename).group(0) for filename in os.listdir(basedir)]
-    )
-    labels = {
-        label: [os.path.basename(e) for e in glob.glob(f"{basedir}/{label}*")]
-        for label in labels
-    }
-    rich.print(labels)
+        raise click.ClickException(f"Directory {basedir} does not exist.")
+    entries = [
+        entry
+        for entry in read_manifest(basedir).values()
+        if (pattern is None or fnmatch.fnmatchcase(entry["label"], pattern))
+        and (kid is None or entry["kid"] == kid)
+    ]
+    total = len(entries)
+    entries = entries[offset : offset + limit if limit else None]
+    if as_json:
+        print(json.dumps({"total": total, "offset": offset, "identities": entries}))
+        return
+    from rich.table import Table
+
+    table = Table(title=f"Identities {offset + 1 if entries else 0}-{offset + len(entries)} of {total}")
+    for column in ("label", "kid", "uuid", "created", "files"):
+        table.add_column(column)
+    for entry in entries:
+        table.add_row(
+            entry["label"],
+            str(entry["kid"]),
+            str(entry["uuid"]),
+            str(entry["created"]),
+            ", ".join(entry["files"]),
+        )
+    rich.print(table)
+
+
+@main.command("reindex")
+@click.option(
+    "--basedir", required=True, help="Directory where identity info is stored"
+)
+def reindex(basedir):
+    """Rebuilds the manifest from the identity files and packs."""
+    if not os.path.exists(basedir):
+        raise click.ClickException(f"Directory {basedir} does not exist.")
+    entries = build_manifest(basedir)
+    write_manifest(basedir, entries)
+    print(f"Indexed {len(entries)} identities in {basedir}/{MANIFEST_FILE}.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,163 @@
+"""CoAP front-end of the lake-authz and lake-ra resources.
+
+The resources are those of the HTTP API, handled by the same functions of
+the server module, under the same admission control and metrics. aiocoap is
+only needed when the CoAP listener is enabled.
+"""
+
+import time
+
+import aiocoap
+import aiocoap.resource
+import cbor2
+
+from errors import BatchFormatError, BatchTooLargeError, NoMatchError, RateLimitedError
+from logger import LOGGER
+from server import (
+    ADMISSION_PATHS,
+    api,
+    cached_voucher_request,
+    decode_batch,
+    lookup_credential,
+    process_attestation_proposal,
+    process_evidence,
+    process_evidence_batch,
+    process_voucher_request_batch,
+)
+import metrics
+
+COAP_CONTENT_FORMAT_OCTET_STREAM = 42
+
+
+async def _voucher_request(payload):
+    voucher_response = await cached_voucher_request(payload)
+    if voucher_response is None:
+        return aiocoap.FORBIDDEN, b""
+    return aiocoap.CHANGED, voucher_response
+
+
+async def _credential_request(payload):
+    cred_rpk_ccs = lookup_credential(payload)
+    if cred_rpk_ccs is None:
+        return aiocoap.NOT_FOUND, b""
+    return aiocoap.CHANGED, bytes(cred_rpk_ccs)
+
+
+async def _attestation_proposal(payload):
+    try:
+        return aiocoap.CHANGED, await process_attestation_proposal(payload)
+    except NoMatchError:
+        return aiocoap.FORBIDDEN, b""
+
+
+async def _evidence(payload):
+    start = time.perf_counter()
+    payload = cbor2.loads(payload)
+    metrics.CBOR_DECODE.observe(time.perf_counter() - start)
+    return aiocoap.CHANGED, cbor2.dumps(await process_evidence(payload))
+
+
+async def _voucher_request_batch(payload):
+    results = await process_voucher_request_batch(decode_batch(payload))
+    return aiocoap.CHANGED, cbor2.dumps(results)
+
+
+async def _evidence_batch(payload):
+    results = await process_evidence_batch(decode_batch(payload))
+    return aiocoap.CHANGED, cbor2.dumps(results)
+
+
+RESOURCES = {
+    "/.well-known/lake-authz/voucher-request": _voucher_request,
+    "/.well-known/lake-authz/cred-request": _credential_request,
+    "/.well-known/lake-ra/attestation-proposal": _attestation_proposal,
+    "/.well-known/lake-ra/evidence": _evidence,
+    "/.well-known/lake-authz/voucher-request-batch": _voucher_request_batch,
+    "/.well-known/lake-ra/evidence-batch": _evidence_batch,
+}
+
+
+def _response(code, payload=b"", max_age=None):
+    response = aiocoap.Message(code=code, payload=payload)
+    if payload:
+        response.opt.content_format = COAP_CONTENT_FORMAT_OCTET_STREAM
+    if max_age is not None:
+        # Max-Age is the Retry-After of a 4.29 or 5.03 (RFC 8516)
+        response.opt.max_age = max(1, int(max_age + 0.999))
+    return response
+
+
+class LakeResource(aiocoap.resource.Resource):
+    """One of the POST resources, the CoAP counterpart of an HTTP endpoint."""
+
+    def __init__(self, path, handler):
+        super().__init__()
+        self.path = path
+        self.handler = handler
+        self.admitted = path in ADMISSION_PATHS
+        self.endpoint = f"coap:{path}"
+
+    async def render_post(self, request):
+        in_flight = metrics.IN_FLIGHT.labels(self.endpoint)
+        in_flight.inc()
+        start = time.perf_counter()
+        code = aiocoap.INTERNAL_SERVER_ERROR
+        try:
+            response = await self._handle(request)
+            code = response.code
+            return response
+        finally:
+            metrics.REQUEST_LATENCY.labels(self.endpoint).observe(time.perf_counter() - start)
+            metrics.REQUESTS.labels(self.endpoint, code.dotted).inc()
+            in_flight.dec()
+
+    async def _handle(self, request):
+        admission = api.authority.admission
+        if not self.admitted:
+            return await self._call(request.payload)
+        wait = admission.admit_peer(_peer(request))
+        if wait:
+            return _response(aiocoap.TOO_MANY_REQUESTS, max_age=wait)
+        if not admission.enter():
+            return _response(aiocoap.SERVICE_UNAVAILABLE, max_age=admission.retry_after)
+        try:
+            return await self._call(request.payload)
+        finally:
+            admission.leave()
+
+    async def _call(self, payload):
+        try:
+            code, payload = await self.handler(payload)
+        except RateLimitedError as e:
+            return _response(aiocoap.TOO_MANY_REQUESTS, max_age=e.retry_after)
+        except BatchTooLargeError as e:
+            return _response(aiocoap.REQUEST_ENTITY_TOO_LARGE, str(e).encode())
+        except (
+            BatchFormatError,
+            ValueError,
+            TypeError,
+            IndexError,
+            KeyError,
+            cbor2.CBORDecodeError,
+        ) as e:
+            LOGGER.debug(f"Invalid CoAP request", path=self.path, error=str(e))
+            return _response(aiocoap.BAD_REQUEST)
+        return _response(code, payload)
+
+
+def _peer(request):
+    sockaddr = getattr(request.remote, "sockaddr", None)
+    return sockaddr[0] if sockaddr else None
+
+
+def create_site():
+    """Returns the site exposing the lake-authz and lake-ra resources."""
+    site = aiocoap.resource.Site()
+    for path, handler in RESOURCES.items():
+        site.add_resource(path.strip("/").split("/"), LakeResource(path, handler))
+    return site
+
+
+async def create_server(host, port):
+    """Starts listening for CoAP requests on the running event loop."""
+    return await aiocoap.Context.create_server_context(create_site(), bind=(host, port))
@@ -0,0 +1,336 @@
+"""DotBot credentials, as produced by dotbot-authority-cli."""
+
+import asyncio
+import glob
+import mmap
+import os
+
+import cbor2
+
+from errors import EvidenceFormatError
+from logger import LOGGER
+
+CRED_FILE_SUFFIX = "-cred-rpk.cbor"
+PACK_FILE = "credentials.pack"
+PACK_INDEX_FILE = "credentials.idx"
+
+# CWT Claims Set (RFC 8392) and COSE_Key (RFC 9052) labels
+CCS_SUB_KEY = 2
+CCS_CNF_KEY = 8
+CNF_COSE_KEY_KEY = 1
+COSE_KEY_KTY_KEY = 1
+COSE_KEY_KID_KEY = 2
+COSE_KEY_CRV_KEY = -1
+COSE_KEY_X_KEY = -2
+COSE_KTY_OKP = 1
+COSE_CRV_ED25519 = 6
+
+# raised by the parsing of a malformed or wrong-shape credential
+CREDENTIAL_ERRORS = (ValueError, KeyError, TypeError, AttributeError, cbor2.CBORDecodeError)
+
+# COSE header parameter holding the kid in an ID_CRED_x
+COSE_HEADER_KID = 4
+
+# EAT UEID type byte for random (UUID based) identifiers
+EAT_UEID_TYPE_RAND = 0x01
+
+
+def parse_credential(cred_rpk_ccs):
+    """Returns the subject and the COSE_Key of a CCS credential."""
+    ccs = cbor2.loads(cred_rpk_ccs)
+    return ccs.get(CCS_SUB_KEY), ccs[CCS_CNF_KEY][CNF_COSE_KEY_KEY]
+
+
+def credential_kid(cred_rpk_ccs):
+    """Returns the kid of a CCS credential, as an integer."""
+    _, cose_key = parse_credential(cred_rpk_ccs)
+    return int.from_bytes(cose_key[COSE_KEY_KID_KEY], "big")
+
+
+def id_cred_kid(id_cred):
+    """Returns the kid of an ID_CRED_x (or ID_U), as an integer.
+
+    Both the {4: kid} map and the compact encoding of a one byte kid are
+    accepted, so kids can be longer than one byte.
+    """
+    try:
+        value = cbor2.loads(id_cred)
+    except (ValueError, cbor2.CBORDecodeError):
+        return int(id_cred[-1])
+    if isinstance(value, dict):
+        value = value.get(COSE_HEADER_KID)
+    if isinstance(value, bytes):
+        return int.from_bytes(value, "big")
+    return int(id_cred[-1])
+
+
+def read_pack(basedir, pack_file=PACK_FILE, index_file=PACK_INDEX_FILE):
+    """Returns the {kid: bytes} entries of a pack, empty if there is none."""
+    index_path = os.path.join(basedir, index_file)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path, "rb") as f:
+        index = cbor2.load(f)
+    with open(os.path.join(basedir, pack_file), "rb") as f:
+        content = f.read()
+    return {
+        kid: content[offset : offset + length]
+        for kid, (offset, length) in index.items()
+    }
+
+
+def write_pack(basedir, entries, pack_file=PACK_FILE, index_file=PACK_INDEX_FILE):
+    """Writes {kid: bytes} entries as a single pack file plus an offset index.
+
+    The index is a CBOR map {kid: [offset, length]} into the pack file. By
+    default, the credentials pack read by CredentialStore.
+    """
+    index = {}
+    pack_path = os.path.join(basedir, pack_file)
+    with open(f"{pack_path}.tmp", "wb") as f:
+        offset = 0
+        for kid, content in sorted(entries.items()):
+            f.write(content)
+            index[kid] = [offset, len(content)]
+            offset += len(content)
+    index_path = os.path.join(basedir, index_file)
+    with open(f"{index_path}.tmp", "wb") as f:
+        cbor2.dump(index, f)
+    # the index is replaced last, readers only pick up complete packs
+    os.replace(f"{pack_path}.tmp", pack_path)
+    os.replace(f"{index_path}.tmp", index_path)
+
+
+def is_packed(basedir):
+    """Returns True if the credentials of basedir are in a pack."""
+    return os.path.exists(os.path.join(basedir, PACK_INDEX_FILE))
+
+
+def read_credential_files(basedir):
+    """Yields the (kid, cred_rpk_ccs) of the credential files of basedir."""
+    for path in glob.glob(os.path.join(basedir, f"*{CRED_FILE_SUFFIX}")):
+        with open(path, "rb") as f:
+            content = f.read()
+        yield credential_kid(content), content
+
+
+class CredentialStore:
+    """In-memory credentials of the DotBots, indexed by kid.
+
+    The credentials come either from the *-cred-rpk.cbor files of basedir or,
+    when present, from the pack file written by write_pack, which
+    is memory-mapped and served without copying. The directory is polled and
+    the index is rebuilt in the background when it changes; lookups only read
+    the current dict and never touch the disk.
+    """
+
+    def __init__(self, basedir=None):
+        self.basedir = basedir
+        self.logger = LOGGER.bind(context=__name__)
+        self._credentials = {}
+        self._files = {}
+        self._mtime = None
+        if basedir is not None:
+            self.reload()
+
+    def __len__(self):
+        return len(self._credentials)
+
+    def get(self, kid):
+        """Returns the credential bytes of kid, or None."""
+        return self._credentials.get(kid)
+
+    def values(self):
+        return self._credentials.values()
+
+    @property
+    def is_packed(self):
+        return is_packed(self.basedir)
+
+    def reload(self):
+        """Rebuilds the index from basedir and swaps it in atomically.
+
+        The mtimes are only recorded once loaded, a failed reload is retried.
+        """
+        mtime = self._source_mtime()
+        if self.is_packed:
+            credentials = self._load_pack()
+        else:
+            credentials = self._load_files()
+        self._credentials = credentials
+        self._mtime = mtime
+        self.logger.info(
+            "Credentials loaded",
+            basedir=self.basedir,
+            packed=self.is_packed,
+            count=len(credentials),
+        )
+
+    def _load_pack(self):
+        with open(os.path.join(self.basedir, PACK_INDEX_FILE), "rb") as f:
+            index = cbor2.load(f)
+        with open(os.path.join(self.basedir, PACK_FILE), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return {}
+            # the mapping stays alive as long as a view on it is in use
+            view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        self._files = {}
+        return {
+            kid: view[offset : offset + length]
+            for kid, (offset, length) in index.items()
+        }
+
+    def _load_files(self):
+        credentials = {}
+        files = {}
+        for path in glob.glob(os.path.join(self.basedir, f"*{CRED_FILE_SUFFIX}")):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            known = self._files.get(path)
+            if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+                kid, content = known[2], self._credentials[known[2]]
+            else:
+                with open(path, "rb") as f:
+                    content = f.read()
+                try:
+                    kid = credential_kid(content)
+                except CREDENTIAL_ERRORS:
+                    self.logger.warning("Invalid credential file", path=path)
+                    continue
+            files[path] = (stat.st_mtime_ns, stat.st_size, kid)
+            credentials[kid] = content
+        self._files = files
+        return credentials
+
+    def _source_mtime(self):
+        paths = [self.basedir] + [
+            os.path.join(self.basedir, name) for name in (PACK_FILE, PACK_INDEX_FILE)
+        ]
+        mtimes = []
+        for path in paths:
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    async def watch(self, interval=1.0, on_reload=None):
+        """Reloads the credentials whenever basedir changes.
+
+        Credential files must be replaced atomically (written elsewhere and
+        renamed), so that the change is visible on the directory mtime.
+        """
+        if self.basedir is None:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._source_mtime() == self._mtime:
+                    continue
+                await loop.run_in_executor(None, self.reload)
+            except Exception as exc:
+                # a malformed pack or file keeps the previous keys and the watcher
+                self.logger.warning(
+                    "Credentials reload failed", basedir=self.basedir, error=repr(exc)
+                )
+                continue
+            if on_reload is not None:
+                on_reload(self)
+
+
+class KeyRegistry:
+    """Attestation public keys of the DotBots, indexed by kid and UEID.
+
+    Only the raw key bytes of the whole fleet are kept, the Ed25519PublicKey
+    objects are built and cached by the workers of the EvidenceVerifier.
+    """
+
+    def __init__(self, credentials=(), default_key=None):
+        self.default_key = default_key
+        self.logger = LOGGER.bind(context=__name__)
+        self._raw_keys = {}
+        self._ueids = {}
+        self.load(credentials)
+
+    def __len__(self):
+        return len(self._raw_keys)
+
+    def add(self, public_key_bytes, kid=None, ueid=None):
+        """Registers the Ed25519 public key of a device."""
+        public_key_bytes = bytes(public_key_bytes)
+        indexes = self._index_keys(kid, ueid)
+        if kid is not None and ueid is not None:
+            self._ueids[kid] = ueid
+        for index in indexes:
+            self._raw_keys[index] = public_key_bytes
+
+    def load(self, credentials):
+        """Replaces the registered keys by the Ed25519 keys of CCS credentials."""
+        self._raw_keys = {}
+        self._ueids = {}
+        loaded = 0
+        for content in credentials:
+            try:
+                sub, cose_key = parse_credential(content)
+                if (
+                    cose_key.get(COSE_KEY_KTY_KEY) != COSE_KTY_OKP
+                    or cose_key.get(COSE_KEY_CRV_KEY) != COSE_CRV_ED25519
+                ):
+                    continue
+                self.add(cose_key[COSE_KEY_X_KEY], kid=cose_key.get(COSE_KEY_KID_KEY), ueid=sub)
+            except CREDENTIAL_ERRORS + (EvidenceFormatError,):
+                self.logger.warning("Invalid credential")
+                continue
+            loaded += 1
+        if loaded:
+            self.logger.info("Attestation keys loaded", count=loaded)
+
+    def get_bytes(self, kid=None, ueid=None):
+        """Returns the raw Ed25519 public key of a device, or the default key.
+
+        When both are given, the kid and the UEID must resolve to the same
+        key, so that a device cannot sign with its own key while claiming the
+        UEID of another one.
+        """
+        found = [self._raw_keys.get(index) for index in self._index_keys(kid, ueid)]
+        if len(found) == 2 and found[0] != found[1]:
+            raise EvidenceFormatError("kid and UEID are not those of the same device")
+        for public_key_bytes in found:
+            if public_key_bytes is not None:
+                return public_key_bytes
+        return self.default_key
+
+    def ueid(self, kid):
+        """Returns the UEID of the device registered with kid, if any."""
+        ueid = self._ueids.get(kid) if isinstance(kid, bytes) else None
+        # the credential subject of a RAND UEID, without its type byte
+        if ueid is not None and len(ueid) == 16:
+            ueid = bytes([EAT_UEID_TYPE_RAND]) + ueid
+        return ueid
+
+    @staticmethod
+    def _index_keys(kid, ueid):
+        # both may come from unauthenticated evidence, never convert them
+        if not (kid is None or isinstance(kid, bytes)):
+            raise EvidenceFormatError("kid is not a byte string")
+        if not (ueid is None or isinstance(ueid, bytes)):
+            raise EvidenceFormatError("UEID is not a byte string")
+        keys = []
+        if kid is not None:
+            keys.append(("kid", kid))
+        if ueid is not None:
+            # a RAND UEID is the credential subject with a type byte in front
+            if len(ueid) == 17 and ueid[0] == EAT_UEID_TYPE_RAND:
+                ueid = ueid[1:]
+            keys.append(("ueid", ueid))
+        return keys
+
+    @property
+    def metrics(self):
+        """Returns the counters of the registry."""
+        return {
+            "keys": len(self._raw_keys),
+        }
@@ -0,0 +1,90 @@
+"""Executor running the lakers crypto operations off the event loop."""
+
+import asyncio
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import threading
+
+import lakers
+
+from lake_authz import W, CRED_V
+
+EXECUTOR_KINDS = ["inline", "thread", "process"]
+
+# Each worker (thread or process) owns its enrollment server instance, so the
+# lakers objects are never shared between concurrently running calls.
+_worker_state = threading.local()
+
+
+def _init_worker(w, cred_v):
+    _worker_state.enrollment_server = lakers.AuthzServerUserAcl(w, cred_v)
+
+
+def _enrollment_server():
+    return _worker_state.enrollment_server
+
+
+def decode_voucher_request(voucher_request):
+    """Decodes a voucher request and returns the id_u of the device."""
+    return bytes(_enrollment_server().decode_voucher_request(voucher_request))
+
+
+def prepare_voucher(voucher_request):
+    """Prepares the voucher response for a voucher request."""
+    return bytes(_enrollment_server().prepare_voucher(voucher_request))
+
+
+class CryptoExecutor:
+    """Runs the lakers calls of the enrollment server in a worker pool.
+
+    - inline: call lakers directly on the event loop (no pool)
+    - thread: thread pool, one enrollment server per thread
+    - process: process pool, one enrollment server per process, built from W/CRED_V
+    """
+
+    def __init__(self, kind="thread", workers=None, w=W, cred_v=CRED_V):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unsupported executor kind '{kind}'")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        if kind == "inline":
+            _init_worker(w, cred_v)
+        elif kind == "thread":
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="lakers",
+                initializer=_init_worker,
+                initargs=(w, cred_v),
+            )
+        else:
+            # spawned, as the evidence verifier workers: forked ones would
+            # inherit the listening sockets and outlive a stopped authority
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(w, cred_v),
+            )
+
+    async def run(self, func, *args):
+        """Runs func(*args) in the pool and waits for its result."""
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+
+    async def decode_voucher_request(self, voucher_request):
+        return await self.run(decode_voucher_request, bytes(voucher_request))
+
+    async def prepare_voucher(self, voucher_request):
+        return await self.run(prepare_voucher, bytes(voucher_request))
+
+    def shutdown(self):
+        """Stops the worker pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
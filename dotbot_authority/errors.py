@@ -1,2 +1,24 @@
 class NoMatchError(Exception):
     pass
+
+
+class UnknownKeyError(Exception):
+    pass
+
+
+class EvidenceFormatError(Exception):
+    pass
+
+
+class RateLimitedError(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Rate limited, retry after {retry_after:.3f}s")
+        self.retry_after = retry_after
+
+
+class BatchFormatError(Exception):
+    pass
+
+
+class BatchTooLargeError(Exception):
+    pass
@@ -0,0 +1,192 @@
+"""Executor checking the attestation token signatures off the event loop."""
+
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import multiprocessing
+import os
+import threading
+import time
+
+from crypto_executor import EXECUTOR_KINDS
+import metrics
+
+# Each worker (thread or process) keeps its own parsed keys, the raw key
+# bytes are sent along with each signature.
+_worker_state = threading.local()
+
+
+def _init_worker(key_cache_size):
+    _worker_state.keys = collections.OrderedDict()
+    _worker_state.key_cache_size = key_cache_size
+
+
+def _public_key(public_key_bytes):
+    # imported on first use, to keep the startup fast
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+    keys = _worker_state.keys
+    key = keys.get(public_key_bytes)
+    if key is not None:
+        keys.move_to_end(public_key_bytes)
+        return key
+    key = keys[public_key_bytes] = Ed25519PublicKey.from_public_bytes(public_key_bytes)
+    if len(keys) > _worker_state.key_cache_size:
+        keys.popitem(last=False)
+    return key
+
+
+def verify_batch(items):
+    """Checks (public key bytes, signature, signed data) triples.
+
+    Returns one boolean per triple, an invalid key is a failed check.
+    """
+    from cryptography.exceptions import InvalidSignature
+
+    results = []
+    for public_key_bytes, signature, data in items:
+        try:
+            _public_key(public_key_bytes).verify(signature, data)
+        except (InvalidSignature, ValueError):
+            results.append(False)
+        else:
+            results.append(True)
+    return results
+
+
+class EvidenceVerifier:
+    """Checks Ed25519 signatures in micro-batches, in a worker pool.
+
+    The signatures to check are queued, and each call to the pool takes up
+    to batch_size of them, so the cost of reaching a worker (pickling, IPC)
+    is paid once per batch. At most one batch per worker is in flight: when
+    every worker is busy the queue grows, and the next batches are larger,
+    so the batches adapt to the load without delaying a lone request by more
+    than batch_window seconds.
+
+    - inline: check on the event loop, one by one
+    - thread: thread pool, limited by the GIL
+    - process: process pool, scales with the number of cores
+    """
+
+    def __init__(
+        self,
+        kind="process",
+        workers=None,
+        batch_size=64,
+        batch_window=0.0,
+        key_cache_size=1024,
+    ):
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unsupported executor kind '{kind}'")
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._executor = None
+        self._pending = []
+        self._timer = None
+        self._running = 0
+        self.batches = 0
+        self.verified = 0
+        self.failed = 0
+        if kind == "inline":
+            _init_worker(key_cache_size)
+        elif kind == "thread":
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="cose",
+                initializer=_init_worker,
+                initargs=(key_cache_size,),
+            )
+        else:
+            # spawned rather than forked: the workers do not inherit the
+            # listening sockets, and exit with the authority even when it is
+            # stopped by a signal
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(key_cache_size,),
+            )
+
+    async def verify(self, public_key_bytes, signature, data):
+        """Returns True if signature is a valid signature of data."""
+        start = time.perf_counter()
+        try:
+            if self._executor is None:
+                result = verify_batch([(public_key_bytes, signature, data)])[0]
+                self._count([result])
+                return result
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._pending.append(
+                ((bytes(public_key_bytes), bytes(signature), bytes(data)), future)
+            )
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+            elif self._timer is None and self._running < self.workers:
+                self._timer = loop.call_later(self.batch_window, self._flush)
+            return await future
+        finally:
+            # includes the time spent waiting for the batch
+            metrics.COSE_VERIFY.observe(time.perf_counter() - start)
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        loop = asyncio.get_running_loop()
+        while self._pending and self._running < self.workers:
+            batch = self._pending[: self.batch_size]
+            del self._pending[: self.batch_size]
+            self._running += 1
+            self.batches += 1
+            future = loop.run_in_executor(
+                self._executor, verify_batch, [item for item, _ in batch]
+            )
+            future.add_done_callback(functools.partial(self._done, batch))
+
+    def _done(self, batch, future):
+        self._running -= 1
+        if future.cancelled():
+            exception = asyncio.CancelledError()
+        else:
+            exception = future.exception()
+        if exception is not None:
+            for _, waiter in batch:
+                if not waiter.done():
+                    waiter.set_exception(exception)
+        else:
+            results = future.result()
+            self._count(results)
+            for (_, waiter), result in zip(batch, results):
+                # the handler may have gone away in the meantime
+                if not waiter.done():
+                    waiter.set_result(result)
+        if self._pending:
+            self._flush()
+
+    def _count(self, results):
+        self.verified += len(results)
+        self.failed += results.count(False)
+
+    @property
+    def metrics(self):
+        """Returns the counters of the verifier."""
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "verified": self.verified,
+            "failed": self.failed,
+            "mean_batch_size": self.verified / self.batches if self.batches else 0.0,
+        }
+
+    def shutdown(self):
+        """Stops the worker pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
@@ -0,0 +1,174 @@
+"""Digests of the local firmware images, used as reference values."""
+
+import asyncio
+import hashlib
+import mmap
+import os
+from stat import S_ISREG
+
+from logger import LOGGER, lazy_hex
+
+# the flash is erased to 0xFF, the DotBot measures its image up to fs_size
+FIRMWARE_PADDING_BYTE = 0xFF
+CHUNK_SIZE = 1 << 20
+_PADDING = memoryview(bytes([FIRMWARE_PADDING_BYTE]) * CHUNK_SIZE)
+# largest flash of the DotBot boards (nRF52840, nRF5340 application core)
+MAX_FLASH_SIZE = 1 << 20
+# padded lengths memoized and precomputed per image, a fleet reports a few
+MAX_PADDED_LENS = 8
+
+
+def padded_sha256(path, padded_len=None):
+    """Returns the SHA-256 of a file padded with 0xFF up to padded_len.
+
+    The file is memory-mapped and hashed in chunks, and the padding is fed
+    from a constant buffer, so neither the image nor the padding is copied.
+    """
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, CHUNK_SIZE):
+                        sha256.update(view[offset : offset + CHUNK_SIZE])
+    padding = (padded_len or 0) - size
+    while padding > 0:
+        sha256.update(_PADDING[: min(padding, CHUNK_SIZE)])
+        padding -= CHUNK_SIZE
+    return sha256.digest()
+
+
+class FirmwareDigestCache:
+    """Memoized digests of the firmware images of a directory.
+
+    A digest is computed once per (path, size, mtime, padded length) and the
+    images are looked up by the file name reported in the evidence. The
+    directory is polled so that the digests of new builds are computed in
+    the background, before a DotBot running them asks for attestation.
+    generation is bumped whenever the images of the directory change.
+
+    The padded length comes from the evidence: it must lie between the size
+    of the image and max_size, and only the first MAX_PADDED_LENS lengths of
+    an image are memoized, the digests of the others are computed each time.
+    """
+
+    def __init__(self, basedir, max_size=MAX_FLASH_SIZE):
+        self.basedir = basedir
+        self.max_size = max_size
+        self.logger = LOGGER.bind(context=__name__)
+        self._digests = {}
+        # padded lengths seen in evidence, per image, precomputed on change
+        self._padded_lens = {}
+        self._listing = None
+        self.generation = 0
+        self.hits = 0
+        self.computations = 0
+        self.rejections = 0
+
+    def __len__(self):
+        return len(self._digests)
+
+    def _path(self, fs_name):
+        # only the file name is used, the evidence cannot point elsewhere
+        return os.path.join(self.basedir, os.path.basename(str(fs_name)))
+
+    def _compute(self, path, padded_len, memoize=True):
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns, padded_len)
+        digest = self._digests.get(key)
+        if digest is not None:
+            return digest
+        digest = padded_sha256(path, padded_len)
+        self.computations += 1
+        if not memoize:
+            return digest
+        # a new build of the image replaces the digests of the previous one
+        for stale in list(self._digests):
+            if stale[0] == path and stale[1:3] != key[1:3]:
+                del self._digests[stale]
+        self._digests[key] = digest
+        self.logger.debug(
+            "Firmware digest computed",
+            path=path,
+            size=stat.st_size,
+            padded_len=padded_len,
+            digest=lazy_hex(digest),
+        )
+        return digest
+
+    async def digest(self, fs_name, padded_len=None):
+        """Returns the digest of the image named fs_name, None if there is none."""
+        path = self._path(fs_name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        # "", "." or a subdirectory are no more an image than a missing file
+        if not S_ISREG(stat.st_mode):
+            return None
+        if padded_len is not None and not (
+            isinstance(padded_len, int) and stat.st_size <= padded_len <= self.max_size
+        ):
+            self.rejections += 1
+            self.logger.info(
+                "Firmware size out of bounds",
+                path=path,
+                size=stat.st_size,
+                padded_len=padded_len,
+            )
+            return None
+        digest = self._digests.get((path, stat.st_size, stat.st_mtime_ns, padded_len))
+        if digest is not None:
+            self.hits += 1
+            return digest
+        padded_lens = self._padded_lens.setdefault(path, set())
+        if padded_len in padded_lens or len(padded_lens) < MAX_PADDED_LENS:
+            padded_lens.add(padded_len)
+            memoize = True
+        else:
+            memoize = False
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                None, self._compute, path, padded_len, memoize
+            )
+        except OSError:
+            return None
+
+    def scan(self):
+        """Computes the missing digests of the images of the directory."""
+        listing = set()
+        for entry in os.scandir(self.basedir):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            listing.add((entry.path, stat.st_size, stat.st_mtime_ns))
+            for padded_len in tuple(self._padded_lens.get(entry.path, {None})):
+                if padded_len is None or padded_len >= stat.st_size:
+                    self._compute(entry.path, padded_len)
+        if listing != self._listing:
+            self._listing = listing
+            self.generation += 1
+
+    async def watch(self, interval=1.0):
+        """Precomputes the digests of new or rebuilt images."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.scan)
+            except OSError as exc:
+                self.logger.warning(
+                    "Firmware scan failed", basedir=self.basedir, error=str(exc)
+                )
+            await asyncio.sleep(interval)
+
+    @property
+    def metrics(self):
+        """Returns the counters of the cache."""
+        return {
+            "digests": len(self._digests),
+            "hits": self.hits,
+            "computations": self.computations,
+            "rejections": self.rejections,
+        }
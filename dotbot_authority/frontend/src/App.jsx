@@ -5,7 +5,9 @@ import moment from 'moment'
 import './App.css'
 
 import {
-  apiFetchACL
+  apiDecideApprovals,
+  apiFetchACL,
+  apiFetchApprovals,
 } from "./rest";
 
 import { NotificationType } from './constants'
@@ -97,12 +99,48 @@ function DotbotACL({ acl }) {
     </div>
   );
 }
+function PendingApprovals({ approvals, onDecide }) {
+  if (approvals.length === 0) return null;
+  return (
+    <div>
+      <h2>DotBots Waiting for Approval:</h2>
+      <button onClick={() => onDecide(null, true)}>Approve all ({approvals.length})</button>
+      <button onClick={() => onDecide(null, false)}>Deny all</button>
+      <div style={{ display: "inline-block", minWidth: "50%" }}>
+        <table style={{ borderCollapse: "collapse" }}>
+          <thead>
+            <tr>
+              <th>Since</th>
+              <th>ID</th>
+              <th>Expires</th>
+              <th>Decision</th>
+            </tr>
+          </thead>
+          <tbody>
+            {approvals.map((approval) => (
+              <tr key={approval.id}>
+                <td>{moment(approval.timestamp).format('YYYY-MM-DD HH:mm:ss')}</td>
+                <td>{approval.id}</td>
+                <td>{moment(approval.expires).format('HH:mm:ss')}</td>
+                <td>
+                  <button onClick={() => onDecide([approval.id], true)}>Approve</button>
+                  <button onClick={() => onDecide([approval.id], false)}>Deny</button>
+                </td>
+              </tr>
+            ))}
+          </tbody>
+        </table>
+      </div>
+    </div>
+  );
+}
 
 function Dashboard() {
   const [acl, setACL] = useState();
   // set state variables
   const [dotbots_authorization_log, setDotbotsAuthorizationLog] = useState([]);
   const [dotbots_attestation_log, setDotbotsAttestationLog] = useState([]);
+  const [approvals, setApprovals] = useState([]);
 
   const fetchACL = useCallback(async () => {
     const data = await apiFetchACL().catch(error => console.log(error));
@@ -115,13 +153,31 @@ function Dashboard() {
     }
   }, [acl]);
 
+  const fetchApprovals = useCallback(async () => {
+    const data = await apiFetchApprovals().catch(error => console.log(error));
+    setApprovals(data || []);
+  }, [setApprovals]);
+
+  const decideApprovals = async (ids, authorized) => {
+    await apiDecideApprovals(ids, authorized).catch(error => console.log(error));
+    fetchApprovals();
+    fetchACL();
+  };
+
   const onWsOpen = () => {
     console.log('websocket opened');
     fetchACL();
+    fetchApprovals();
   };
 
   const onWsMessage = (event) => {
-    const message = JSON.parse(event.data);
+    const data = JSON.parse(event.data);
+    // notifications sent during a burst are batched in a single frame
+    const messages = Array.isArray(data) ? data : [data];
+    messages.forEach(onNotification);
+  };
+
+  const onNotification = (message) => {
     console.log(`websocket got new message: ${JSON.stringify(message)}`);
     // if (message.cmd === NotificationType.AuthorizationResult) {
     //   setDotbotsAuthorizationLog((prev) => {
@@ -132,12 +188,30 @@ function Dashboard() {
     switch (message.cmd){
       case NotificationType.AuthorizationResult:
         setDotbotsAuthorizationLog((prev) => [message.data, ...prev]);
+        setApprovals((prev) => prev.filter((approval) => approval.id !== message.data.id));
         fetchACL();
         break;
 
+      case NotificationType.ApprovalRequest:
+        setApprovals((prev) => [...prev, message.data]);
+        break;
+
       case NotificationType.AttestationResult:
         setDotbotsAttestationLog((prev) => [message.data, ...prev]);
       break;
+
+      case NotificationType.BatchResult:
+        // results of a gateway batch, the last one is the most recent
+        if (message.data.authorizations.length > 0) {
+          const decided = new Set(message.data.authorizations.map((result) => result.id));
+          setApprovals((prev) => prev.filter((approval) => !decided.has(approval.id)));
+          setDotbotsAuthorizationLog((prev) => [...message.data.authorizations.reverse(), ...prev]);
+          fetchACL();
+        }
+        if (message.data.attestations.length > 0) {
+          setDotbotsAttestationLog((prev) => [...message.data.attestations.reverse(), ...prev]);
+        }
+        break;
     }
   };
 
@@ -152,6 +226,7 @@ function Dashboard() {
     <div>
       <h1>DotBot Authority</h1>
       <DotbotACL acl={acl} />
+      <PendingApprovals approvals={approvals} onDecide={decideApprovals} />
       <AuthorizationLog dotbots={dotbots_authorization_log} />
       <AttestationLog results={dotbots_attestation_log} />
     </div>
@@ -3,6 +3,8 @@ export const NotificationType = {
     None: 0,
     AuthorizationResult: 1,
     AttestationResult: 2,
+    BatchResult: 3,
+    ApprovalRequest: 4,
 };
 
     
\ No newline at end of file
@@ -6,3 +6,17 @@ export const apiFetchACL = async () => {
     `http://localhost:18000/api/v1/acl`,
   ).then(res => res.data);
 }
+
+export const apiFetchApprovals = async () => {
+  return await axios.get(
+    `http://localhost:18000/api/v1/approvals`,
+  ).then(res => res.data.pending);
+}
+
+export const apiDecideApprovals = async (ids, authorized) => {
+  // ids null decides on every pending DotBot
+  return await axios.post(
+    `http://localhost:18000/api/v1/approvals`,
+    { ids, authorized },
+  ).then(res => res.data);
+}
@@ -0,0 +1,166 @@
+"""History of the authorization and attestation results."""
+
+import bisect
+import json
+import os
+import queue
+import threading
+
+from logger import LOGGER
+
+HISTORY_KINDS = ["authorization", "attestation"]
+
+
+def _tail_lines(path, count, block_size=65536):
+    """Returns the last count lines of a file, reading it from the end."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= count:
+            size = min(block_size, position)
+            position -= size
+            f.seek(position)
+            data = f.read(size) + data
+    lines = data.splitlines()
+    if position > 0:
+        # the first line may be cut
+        lines = lines[1:]
+    return lines[-count:] if count else []
+
+
+class History:
+    """Recent results in memory, all of them in an append-only JSON lines file.
+
+    The records are kept sorted by (timestamp, seq) and trimmed to about
+    capacity, with the same keys per device. The results relayed from the
+    other workers arrive late, so a record is inserted in timestamp order
+    rather than appended. A record is {"seq", "kind", "timestamp", "id",
+    "data"}, the sequence number being the cursor of the paginated queries;
+    it is per process, and restarts after the records loaded from the file.
+
+    The lines are appended by a writer thread, off the event loop.
+    """
+
+    def __init__(self, path=None, capacity=10000):
+        self.path = path
+        self.capacity = capacity
+        self.logger = LOGGER.bind(context=__name__)
+        self._keys = []
+        self._entries = {}
+        self._by_id = {}
+        self._next_seq = 1
+        self._queue = None
+        self._writer = None
+        if path is not None:
+            if os.path.exists(path):
+                self._load()
+            self._queue = queue.SimpleQueue()
+            # unbuffered appends: the workers of a --workers server share the
+            # file, and a record written in one call is never split or mixed
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self._writer = threading.Thread(
+                target=self._write, args=(fd,), name="history", daemon=True
+            )
+            self._writer.start()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _load(self):
+        loaded = 0
+        for line in _tail_lines(self.path, self.capacity):
+            try:
+                kind, timestamp, id_, data, message = json.loads(line)
+            except ValueError:
+                continue
+            self._insert(kind, timestamp, id_, data, message)
+            loaded += 1
+        self.logger.info("History loaded", path=self.path, records=loaded)
+
+    def _write(self, fd):
+        """Appends the queued records, each with a single write."""
+        try:
+            while True:
+                line = self._queue.get()
+                if line is None:
+                    return
+                try:
+                    os.write(fd, line)
+                except OSError as exc:
+                    self.logger.warning("History write failed", error=str(exc))
+        finally:
+            os.close(fd)
+
+    def record(self, kind, timestamp, id_, data, message, persist=True):
+        """Records a result, message being its encoded notification."""
+        self._insert(kind, timestamp, id_, data, message)
+        if persist and self._queue is not None:
+            line = json.dumps([kind, timestamp, id_, data, message]) + "\n"
+            self._queue.put(line.encode())
+
+    def _insert(self, kind, timestamp, id_, data, message):
+        record = {
+            "seq": self._next_seq,
+            "kind": kind,
+            "timestamp": timestamp,
+            "id": str(id_),
+            "data": data,
+        }
+        self._next_seq += 1
+        key = (timestamp, record["seq"])
+        self._entries[record["seq"]] = (record, message)
+        # almost always the newest, so this is an append
+        bisect.insort(self._keys, key)
+        bisect.insort(self._by_id.setdefault(record["id"], []), key)
+        # trimmed by chunks, so that recording stays O(1) amortized
+        excess = len(self._keys) - self.capacity
+        if excess > self.capacity // 4:
+            for _, seq in self._keys[:excess]:
+                old, _ = self._entries.pop(seq)
+                keys = self._by_id[old["id"]]
+                del keys[0]
+                if not keys:
+                    del self._by_id[old["id"]]
+            del self._keys[:excess]
+
+    def query(self, cursor=None, limit=100, id_=None, kind=None, since=None, until=None):
+        """Returns the records older than cursor, newest first, and the next cursor.
+
+        since and until bound the timestamps, in ms, both included. A cursor
+        no longer in memory ends the pagination.
+        """
+        keys = self._keys if id_ is None else self._by_id.get(str(id_), [])
+        end = len(keys)
+        if cursor is not None:
+            entry = self._entries.get(cursor)
+            if entry is None:
+                return [], None
+            end = bisect.bisect_left(keys, (entry[0]["timestamp"], cursor))
+        if until is not None:
+            end = min(end, bisect.bisect_right(keys, (until, float("inf"))))
+        items = []
+        for index in range(end - 1, -1, -1):
+            timestamp, seq = keys[index]
+            if since is not None and timestamp < since:
+                break
+            record = self._entries[seq][0]
+            if kind is not None and record["kind"] != kind:
+                continue
+            if len(items) == limit:
+                return items, items[-1]["seq"]
+            items.append(record)
+        return items, None
+
+    def recent_messages(self, count):
+        """Returns the encoded notifications of the last count records, oldest first."""
+        if not count:
+            return []
+        return [self._entries[seq][1] for _, seq in self._keys[-count:]]
+
+    def close(self):
+        """Writes the queued lines and closes the file."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
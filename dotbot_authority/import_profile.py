@@ -0,0 +1,88 @@
+"""Measures the time spent importing each module, to track startup time.
+
+Only the standard library is used, so that the profiler can be installed
+before anything else is imported.
+"""
+
+import sys
+import time
+
+
+class _TimedLoader:
+    """Loader wrapper timing the execution of a module."""
+
+    def __init__(self, loader, profiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        stack = self._profiler._stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            self._profiler.timings[module.__name__] = (elapsed - children, elapsed)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class ImportProfiler:
+    """Meta path finder recording the self and cumulative time of each import.
+
+    The spec is found by the other finders, only its loader is wrapped.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+        self._start = None
+        self.elapsed = 0.0
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def install(self):
+        self._start = time.perf_counter()
+        sys.meta_path.insert(0, self)
+        return self
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+            self.elapsed = time.perf_counter() - self._start
+
+    @property
+    def total(self):
+        """Time spent importing, in seconds."""
+        return sum(own for own, _ in self.timings.values())
+
+    def top(self, limit=25):
+        """Returns (module, self seconds, cumulative seconds), slowest first."""
+        rows = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)
+        return [(name, own, cumulative) for name, (own, cumulative) in rows[:limit]]
+
+    def report(self, limit=25):
+        lines = [f"{'self (ms)':>10} {'cumul (ms)':>11}  module"]
+        for name, own, cumulative in self.top(limit):
+            lines.append(f"{own * 1e3:>10.1f} {cumulative * 1e3:>11.1f}  {name}")
+        lines.append(
+            f"{len(self.timings)} modules imported in {self.total * 1e3:.1f} ms"
+        )
+        return "\n".join(lines)
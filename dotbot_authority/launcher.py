@@ -0,0 +1,36 @@
+"""Launches the authority in uvicorn worker processes.
+
+This module does not import the application, so that the parent process
+of the workers starts fast.
+"""
+
+import json
+import os
+
+import uvicorn
+
+# environment variable passing the configuration to the worker processes
+WORKER_CONFIG_ENV = "DOTBOT_AUTHORITY_CONFIG"
+
+
+def serve(authority_config, logging_config, workers=1, reload=False):
+    """Runs the authority in worker processes sharing the same port.
+
+    Each worker builds its own Authority from authority_config (the keyword
+    arguments of Authority); with several workers it must use a shared state
+    database. With reload, a single worker is restarted when the code changes,
+    which is meant for development only.
+    """
+    os.environ[WORKER_CONFIG_ENV] = json.dumps(
+        {"authority": authority_config, "logging": logging_config}
+    )
+    uvicorn.run(
+        "authority:create_worker_app",
+        factory=True,
+        host=authority_config.get("host", "127.0.0.1"),
+        port=authority_config.get("port", 18000),
+        workers=None if reload else workers,
+        reload=reload,
+        reload_dirs=[os.path.dirname(os.path.abspath(__file__))] if reload else None,
+        log_level="info",
+    )
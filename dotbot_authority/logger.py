@@ -1,7 +1,10 @@
 """Logger module."""
 
+import atexit
 import logging
 import logging.config
+import logging.handlers
+import queue
 
 import structlog
 
@@ -26,9 +29,71 @@ SUPPORTED_HANDLERS_DEFAULT = {
 }
 
 
-def setup_logging(filename, level, handlers):
-    """Setup logging."""
+class Lazy:
+    """Log field computed only when the log event is actually emitted."""
+
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __call__(self):
+        return self.func(*self.args)
+
+
+def _hex(data, sep):
+    return bytes(data).hex(sep) if sep else bytes(data).hex()
+
+
+def lazy_hex(data, sep=""):
+    """Hex representation of data, computed only if the event is emitted."""
+    return Lazy(_hex, data, sep)
+
+
+def resolve_lazy_fields(logger, method_name, event_dict):
+    """Computes the Lazy fields of an event that passed the level filter."""
+    for key, value in event_dict.items():
+        if isinstance(value, Lazy):
+            event_dict[key] = value()
+    return event_dict
+
+
+class _LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler passing the records as is to the listener thread.
+
+    The records never leave the process, and the structlog formatters of the
+    real handlers expect the original event dict, so no preparation is done.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _start_queue_listener(logger):
+    """Moves the handlers of logger to a background thread."""
+    handlers = logger.handlers[:]
+    for handler in handlers:
+        logger.removeHandler(handler)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(_LocalQueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def setup_logging(filename, level, handlers, use_queue=False):
+    """Setup logging.
+
+    With use_queue, records are handed over to a QueueListener thread that
+    does the formatting and the file writes, off the event loop.
+    """
     processors = [
+        structlog.stdlib.filter_by_level,
+        resolve_lazy_fields,
         structlog.contextvars.merge_contextvars,
         structlog.stdlib.add_logger_name,
         structlog.stdlib.add_log_level,
@@ -80,6 +145,8 @@ def setup_logging(filename, level, handlers):
         },
     }
     logging.config.dictConfig(stdlib_config)
+    if use_queue:
+        _start_queue_listener(logging.getLogger("dotbot_authority"))
 
 
 LOGGER = structlog.get_logger("dotbot_authority")
@@ -3,13 +3,21 @@
 """Main module of the DotBot Authority."""
 
 import asyncio
+import importlib.util
 import os
 import sys
+import time
 
 import click
 
-from logger import setup_logging
-from authority import Authority
+from import_profile import ImportProfiler
+
+# the application and its dependencies are imported in main(), once the
+# options are parsed: --help stays fast and the parent of the workers does
+# not import the application at all, so the choices of crypto_executor and
+# nonce_store are repeated here
+EXECUTOR_KINDS = ["inline", "thread", "process"]
+NONCE_MODES = ["store", "hmac"]
 
 @click.command()
 @click.option(
@@ -24,20 +32,351 @@ from authority import Authority
     default=os.path.join(os.getcwd(), "dotbot_authority.log"),
     help="Filename where logs are redirected",
 )
+@click.option(
+    "--crypto-executor",
+    type=click.Choice(EXECUTOR_KINDS),
+    default="thread",
+    help="Where the lakers crypto operations run. Defaults to thread",
+)
+@click.option(
+    "--crypto-workers",
+    type=int,
+    default=None,
+    help="Number of crypto workers. Defaults to the number of CPUs",
+)
+@click.option(
+    "--evidence-executor",
+    type=click.Choice(EXECUTOR_KINDS),
+    default="process",
+    help="Where the evidence signatures are checked. Defaults to process",
+)
+@click.option(
+    "--evidence-workers",
+    type=int,
+    default=None,
+    help="Number of evidence verifier workers. Defaults to the number of CPUs",
+)
+@click.option(
+    "--evidence-batch-size",
+    type=int,
+    default=64,
+    help="Max evidence signatures checked per call to a worker. Defaults to 64",
+)
+@click.option(
+    "--evidence-batch-window",
+    type=float,
+    default=0.0,
+    help="Seconds to gather evidence signatures before checking them. Defaults to 0",
+)
+@click.option(
+    "--acl",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="ACL file (.json, .db/.sqlite or one id per line), reloaded on change",
+)
+@click.option(
+    "--approval-timeout",
+    type=float,
+    default=0.0,
+    help="Seconds a DotBot missing from the ACL waits for the operator to approve it on the UI, 0 to deny it at once. Defaults to 0",
+)
+@click.option(
+    "--max-pending-approvals",
+    type=int,
+    default=128,
+    help="DotBots waiting for the operator at once, the others are denied, kept below --max-concurrency. Defaults to 128",
+)
+@click.option(
+    "--nonce-ttl",
+    type=float,
+    default=30.0,
+    help="Lifetime of attestation nonces, in seconds. Defaults to 30",
+)
+@click.option(
+    "--nonce-capacity",
+    type=int,
+    default=4096,
+    help="Maximum number of pending attestation nonces, of used ones in hmac mode. Defaults to 4096",
+)
+@click.option(
+    "--nonce-mode",
+    type=click.Choice(NONCE_MODES),
+    default="store",
+    help="Store each nonce, or derive it with an HMAC and only store the used ones. Defaults to store",
+)
+@click.option(
+    "--nonce-secret",
+    type=click.Path(dir_okay=False),
+    default=os.path.join(os.getcwd(), "dotbot_authority_nonce.key"),
+    help="File of the HMAC nonce secret, created if missing",
+)
+@click.option(
+    "--reference-values",
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help="JSON file with the approved firmware measurements, reloaded on change",
+)
+@click.option(
+    "--verdict-cache-size",
+    type=int,
+    default=1024,
+    help="Number of appraisal verdicts kept, per set of measured claims (0 to disable). Defaults to 1024",
+)
+@click.option(
+    "--firmware-dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Directory with the firmware images, whose digests are approved",
+)
+@click.option(
+    "--cred-dir",
+    type=click.Path(exists=True, file_okay=False),
+    default=None,
+    help="Directory with the credentials of the DotBots, reloaded on change",
+)
+@click.option(
+    "--key-cache-size",
+    type=int,
+    default=1024,
+    help="Number of parsed attestation keys kept by each evidence worker. Defaults to 1024",
+)
+@click.option(
+    "--ws-queue-size",
+    type=int,
+    default=256,
+    help="Notifications queued per websocket client before it is dropped",
+)
+@click.option(
+    "--ws-batch-window",
+    type=float,
+    default=0.0,
+    help="Seconds during which notifications are batched in one frame. Defaults to 0 (no batching)",
+)
+@click.option(
+    "--voucher-cache-size",
+    type=int,
+    default=1024,
+    help="Voucher responses kept for retransmitted requests. Defaults to 1024",
+)
+@click.option(
+    "--voucher-cache-ttl",
+    type=float,
+    default=10.0,
+    help="Seconds during which a voucher response is reused. Defaults to 10",
+)
+@click.option(
+    "--device-rate",
+    type=float,
+    default=5.0,
+    help="Requests per second allowed per DotBot (id_u, c_r), 0 for no limit. Defaults to 5",
+)
+@click.option(
+    "--device-burst",
+    type=int,
+    default=10,
+    help="Requests a DotBot can send at once. Defaults to 10",
+)
+@click.option(
+    "--peer-rate",
+    type=float,
+    default=0.0,
+    help="Crypto requests per second allowed per peer address, 0 for no limit. Defaults to 0",
+)
+@click.option(
+    "--peer-burst",
+    type=int,
+    default=100,
+    help="Crypto requests a peer can send at once. Defaults to 100",
+)
+@click.option(
+    "--max-concurrency",
+    type=int,
+    default=256,
+    help="Crypto requests handled at once, the others get a 503, 0 for no limit. Defaults to 256",
+)
+@click.option(
+    "--history-file",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="Append-only file where the authorization and attestation results are kept",
+)
+@click.option(
+    "--history-size",
+    type=int,
+    default=10000,
+    help="Results kept in memory for /api/v1/history. Defaults to 10000",
+)
+@click.option(
+    "--history-replay",
+    type=int,
+    default=100,
+    help="Recent results sent to new websocket clients. Defaults to 100",
+)
+@click.option(
+    "--log-queue/--no-log-queue",
+    default=False,
+    help="Write the logs from a background thread instead of the event loop",
+)
+@click.option(
+    "--state",
+    type=click.Path(dir_okay=False),
+    default=None,
+    help="SQLite database holding the state shared by the workers",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of worker processes, more than 1 requires --state. Defaults to 1",
+)
+@click.option(
+    "--reload/--no-reload",
+    default=False,
+    help="Restart when the code changes, for development. Defaults to no reload",
+)
+@click.option(
+    "--import-profile",
+    is_flag=True,
+    default=False,
+    help="Report the time spent importing each module and creating the authority, then exit",
+)
+@click.option("--host", default="127.0.0.1", help="Address to listen on. Defaults to 127.0.0.1")
+@click.option("--port", type=int, default=18000, help="Port to listen on. Defaults to 18000")
+@click.option(
+    "--coap-port",
+    type=int,
+    default=None,
+    help="UDP port of the CoAP listener (needs aiocoap), single worker only. Defaults to none",
+)
 def main(
     log_level,
     log_output,
+    crypto_executor,
+    crypto_workers,
+    evidence_executor,
+    evidence_workers,
+    evidence_batch_size,
+    evidence_batch_window,
+    acl,
+    approval_timeout,
+    max_pending_approvals,
+    nonce_ttl,
+    nonce_capacity,
+    nonce_mode,
+    nonce_secret,
+    reference_values,
+    verdict_cache_size,
+    firmware_dir,
+    cred_dir,
+    key_cache_size,
+    ws_queue_size,
+    ws_batch_window,
+    voucher_cache_size,
+    voucher_cache_ttl,
+    device_rate,
+    device_burst,
+    peer_rate,
+    peer_burst,
+    max_concurrency,
+    history_file,
+    history_size,
+    history_replay,
+    log_queue,
+    state,
+    workers,
+    reload,
+    import_profile,
+    host,
+    port,
+    coap_port,
 ):
     """DotBotAuthority, central server for managing DotBots."""
     print(f"Welcome to the DotBot Authority.")
 
-    setup_logging(log_output, log_level, ["console", "file"])
+    if workers > 1 and state is None:
+        raise click.UsageError("--workers requires a shared --state database")
+    if workers > 1 and reload:
+        raise click.UsageError("--reload runs a single worker")
+    if approval_timeout > 0 and workers > 1:
+        raise click.UsageError(
+            "--approval-timeout runs in a single worker, the decisions are not shared"
+        )
+    if coap_port is not None and (workers > 1 or reload):
+        raise click.UsageError("--coap-port runs in a single worker, without --reload")
+    if coap_port is not None and importlib.util.find_spec("aiocoap") is None:
+        raise click.UsageError("--coap-port requires aiocoap (pip install aiocoap)")
+    logging_config = [log_output, log_level, ["console", "file"], log_queue]
+    authority_config = dict(
+        crypto_executor=crypto_executor,
+        crypto_workers=crypto_workers,
+        evidence_executor=evidence_executor,
+        evidence_workers=evidence_workers,
+        evidence_batch_size=evidence_batch_size,
+        evidence_batch_window=evidence_batch_window,
+        acl=acl,
+        approval_timeout=approval_timeout,
+        max_pending_approvals=max_pending_approvals,
+        nonce_capacity=nonce_capacity,
+        nonce_ttl=nonce_ttl,
+        nonce_mode=nonce_mode,
+        nonce_secret=nonce_secret,
+        reference_values=reference_values,
+        firmware_dir=firmware_dir,
+        verdict_cache_size=verdict_cache_size,
+        cred_dir=cred_dir,
+        key_cache_size=key_cache_size,
+        ws_queue_size=ws_queue_size,
+        ws_batch_window=ws_batch_window,
+        voucher_cache_size=voucher_cache_size,
+        voucher_cache_ttl=voucher_cache_ttl,
+        device_rate=device_rate,
+        device_burst=device_burst,
+        peer_rate=peer_rate,
+        peer_burst=peer_burst,
+        max_concurrency=max_concurrency,
+        history_file=history_file,
+        history_size=history_size,
+        history_replay=history_replay,
+        state=state,
+        host=host,
+        port=port,
+        coap_port=coap_port,
+    )
+    if import_profile:
+        profile_startup(authority_config, logging_config)
+        return
     try:
-        authority = Authority()
+        if workers > 1 or reload:
+            from launcher import serve
+
+            serve(authority_config, logging_config, workers, reload)
+            return
+        from logger import setup_logging
+        from authority import Authority
+
+        setup_logging(*logging_config)
+        authority = Authority(**authority_config)
         asyncio.run(authority.run())
     except (SystemExit, KeyboardInterrupt):
         sys.exit(0)
 
 
+def profile_startup(authority_config, logging_config):
+    """Prints where the startup time goes, without serving."""
+    profiler = ImportProfiler().install()
+    try:
+        from logger import setup_logging
+        from authority import Authority
+    finally:
+        profiler.uninstall()
+    setup_logging(*logging_config)
+    start = time.perf_counter()
+    authority = Authority(**authority_config)
+    created = time.perf_counter() - start
+    authority.stop([])
+    print(profiler.report())
+    print(f"Authority created in {created * 1e3:.1f} ms")
+
+
 if __name__ == "__main__":
     main()
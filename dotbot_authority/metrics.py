@@ -0,0 +1,274 @@
+"""Metrics of the authority, exported in the Prometheus text format.
+
+The instrumentation is meant to stay enabled in production: recording an
+event is a few attribute lookups, a bisect and two additions, with no lock
+(all the recording happens on the event loop thread).
+"""
+
+import bisect
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 50us to 5s, for the stages and the endpoints
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+def _format_labels(labelnames, labelvalues, extra=""):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *labelvalues):
+        """Returns the child of the metric for these label values."""
+        child = self._children.get(labelvalues)
+        if child is None:
+            child = self._children[labelvalues] = self._new_child()
+        return child
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for labelvalues, child in sorted(self._children.items()):
+            lines.extend(self._render_child(labelvalues, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def _render_child(self, labelvalues, child):
+        labels = _format_labels(self.labelnames, labelvalues)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class CallbackMetric(_Metric):
+    """Metric whose value is read from a function when rendered."""
+
+    def __init__(self, name, documentation, func, kind="gauge"):
+        super().__init__(name, documentation)
+        self.kind = kind
+        self.func = func
+
+    def render(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            f"{self.name} {_format_value(self.func())}",
+        ]
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _render_child(self, labelvalues, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            labels = _format_labels(
+                self.labelnames, labelvalues, f'le="{_format_value(bound)}"'
+            )
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """Set of metrics rendered together, indexed by name."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # registering again under the same name replaces the metric, which
+        # happens for the callbacks when a new Authority is created
+        self._metrics[metric.name] = metric
+        return metric
+
+    def callback(self, name, documentation, func, kind="gauge"):
+        return self.register(CallbackMetric(name, documentation, func, kind))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(
+    Counter(
+        "dotbot_authority_requests_total",
+        "Requests handled, by endpoint and status code.",
+        ["endpoint", "status"],
+    )
+)
+REQUEST_LATENCY = REGISTRY.register(
+    Histogram(
+        "dotbot_authority_request_duration_seconds",
+        "Request handling latency, by endpoint.",
+        ["endpoint"],
+    )
+)
+IN_FLIGHT = REGISTRY.register(
+    Gauge(
+        "dotbot_authority_requests_in_flight",
+        "Requests being handled, by endpoint.",
+        ["endpoint"],
+    )
+)
+STAGE_LATENCY = REGISTRY.register(
+    Histogram(
+        "dotbot_authority_stage_duration_seconds",
+        "Latency of the processing stages of the requests.",
+        ["stage"],
+    )
+)
+SHED = REGISTRY.register(
+    Counter(
+        "dotbot_authority_requests_shed_total",
+        "Requests rejected by the admission control, by reason.",
+        ["reason"],
+    )
+)
+
+# pre-bound children of the stage histogram, used on the hot paths
+CBOR_DECODE = STAGE_LATENCY.labels("cbor_decode")
+LAKERS_DECODE = STAGE_LATENCY.labels("lakers_decode")
+LAKERS_PREPARE = STAGE_LATENCY.labels("lakers_prepare")
+ACL_LOOKUP = STAGE_LATENCY.labels("acl_lookup")
+COSE_VERIFY = STAGE_LATENCY.labels("cose_verify")
+NONCE_CHECK = STAGE_LATENCY.labels("nonce_check")
+APPRAISAL = STAGE_LATENCY.labels("appraisal")
+WS_NOTIFY = STAGE_LATENCY.labels("ws_notify")
+CREDENTIAL_LOOKUP = STAGE_LATENCY.labels("credential_lookup")
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting the requests of the given paths and timing them."""
+
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["type"] != "http" or path not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(path)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            REQUEST_LATENCY.labels(path).observe(time.perf_counter() - start)
+            REQUESTS.labels(path, str(status[0])).inc()
+            in_flight.dec()
@@ -12,6 +12,8 @@ class DotBotNotificationCommand(IntEnum):
     NONE: int = 0
     AUTHORIZATION_RESULT: int = 1
     ATTESTATION_RESULT: int = 2
+    BATCH_RESULT: int = 3
+    APPROVAL_REQUEST: int = 4
 
 
 class DotBotAuthorityIdentity(BaseModel):
@@ -27,6 +29,7 @@ class AuthorizationResult(BaseModel):
 
 
 class AttestationResult(BaseModel):
+    timestamp: int = 0
     id: str
     attestation_result: bool
     software_name: str
@@ -34,9 +37,32 @@ class AttestationResult(BaseModel):
     tag_version: int
 
 
+class ApprovalRequest(BaseModel):
+    """DotBot missing from the ACL, waiting for the operator decision."""
+
+    timestamp: int
+    id: int
+    expires: int
+
+
+class ApprovalDecision(BaseModel):
+    """Decision of the operator on pending DotBots, all of them if ids is None."""
+
+    ids: Optional[List[int]] = None
+    authorized: bool = True
+
+
+class BatchResult(BaseModel):
+    """Results of the requests of a batch, notified at once."""
+
+    authorizations: List[AuthorizationResult] = []
+    attestations: List[AttestationResult] = []
+
 
 class DotBotNotificationModel(BaseModel):
     """Model class used to send notifications."""
 
     cmd: DotBotNotificationCommand
-    data: Optional[Union[AuthorizationResult, AttestationResult]] = None
+    data: Optional[
+        Union[AuthorizationResult, AttestationResult, ApprovalRequest, BatchResult]
+    ] = None
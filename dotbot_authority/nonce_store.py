@@ -0,0 +1,248 @@
+"""Store of the nonces issued for the attestation sessions."""
+
+import collections
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+import cbor2
+
+NONCE_SIZE = 8
+NONCE_MODES = ["store", "hmac"]
+
+# an HMAC nonce is a random salt followed by the truncated HMAC
+HMAC_NONCE_SALT_SIZE = 8
+HMAC_NONCE_TAG_SIZE = 8
+HMAC_SECRET_SIZE = 32
+
+
+class NonceStore:
+    """Bounded store of single-use nonces, indexed by connection identifier.
+
+    Every nonce lives for the same ttl, so the insertion order of the ordered
+    dict is also the expiry order: expired entries are always at its head and
+    are dropped in O(1) each. When the store is full, the oldest entry is
+    evicted to make room for the new one.
+    """
+
+    def __init__(self, capacity=4096, ttl=30.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self.issued = 0
+        self.consumed = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, cid):
+        self._expire(self._clock())
+        return cid in self._entries
+
+    def issue(self, cid):
+        """Generates a new nonce for cid, replacing any pending one."""
+        now = self._clock()
+        self._expire(now)
+        if cid in self._entries:
+            del self._entries[cid]
+        elif len(self._entries) >= self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        self._entries[cid] = (nonce, now + self.ttl)
+        self.issued += 1
+        return nonce
+
+    def consume(self, cid):
+        """Removes and returns the nonce of cid, None if unknown or expired."""
+        self._expire(self._clock())
+        entry = self._entries.pop(cid, None)
+        if entry is None:
+            return None
+        self.consumed += 1
+        return entry[0]
+
+    def verify(self, cid, nonce):
+        """Consumes the nonce of cid, returns True if it is nonce."""
+        expected = self.consume(cid)
+        return expected is not None and hmac.compare_digest(expected, bytes(nonce))
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            cid = next(iter(entries))
+            if entries[cid][1] > now:
+                break
+            del entries[cid]
+            self.expirations += 1
+
+    @property
+    def metrics(self):
+        """Returns the counters of the store."""
+        self._expire(self._clock())
+        return {
+            "live": len(self._entries),
+            "capacity": self.capacity,
+            "issued": self.issued,
+            "consumed": self.consumed,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+def load_secret(path):
+    """Returns the secret stored in path, created with random bytes if missing.
+
+    The file is created atomically, so that workers starting at the same
+    time all end up with the same secret.
+    """
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(HMAC_SECRET_SIZE))
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_path)
+    with open(path, "rb") as f:
+        secret = f.read()
+    if len(secret) < HMAC_SECRET_SIZE // 2:
+        raise ValueError(f"Nonce secret {path} is too short")
+    return secret
+
+
+class ReplayFilter:
+    """Nonces already used, remembered until they expire.
+
+    Like NonceStore, the entries all live for the same ttl and are kept in
+    expiry order. An entry is never evicted before it expires, or the nonce
+    could be replayed: when the filter is full, new nonces are rejected.
+    """
+
+    def __init__(self, capacity=4096, clock=time.monotonic):
+        self.capacity = capacity
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self.overflows = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, nonce, ttl):
+        """Records nonce, returns False if it was already used.
+
+        Returns None, without recording it, when the filter is full.
+        """
+        now = self._clock()
+        entries = self._entries
+        while entries:
+            oldest = next(iter(entries))
+            if entries[oldest] > now:
+                break
+            del entries[oldest]
+        if nonce in entries:
+            return False
+        if len(entries) >= self.capacity:
+            self.overflows += 1
+            return None
+        entries[nonce] = now + ttl
+        return True
+
+
+class HmacNonceIssuer:
+    """Stateless nonces, authenticated with an HMAC of a server secret.
+
+    A nonce is a random salt followed by the truncated HMAC-SHA256 of
+    (cid, epoch, salt), the epoch being the issuing time divided by a
+    quarter of ttl. Nothing is stored when a nonce is issued: the nonce of
+    the evidence is checked by recomputing the HMAC for the epochs of the
+    last ttl seconds, so any process holding the secret can check it, also
+    after a restart. It is accepted from its issuance until the end of its
+    epoch plus ttl, so for more than ttl and at most ttl + epoch seconds.
+    The replay filter only keeps the nonces already used, for ttl + epoch;
+    while it is full, the evidence is rejected.
+
+    Same interface and counters as NonceStore, expirations counting the
+    nonces rejected as expired or invalid, overflows those rejected because
+    the replay filter was full. Nothing is ever evicted.
+    """
+
+    def __init__(self, secret, ttl=30.0, replay_filter=None, clock=time.time):
+        self.secret = secret
+        self.ttl = ttl
+        self.epoch = ttl / 4
+        self.replay_filter = replay_filter if replay_filter is not None else ReplayFilter()
+        self._clock = clock
+        self.issued = 0
+        self.consumed = 0
+        self.expirations = 0
+        self.replays = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.replay_filter)
+
+    @property
+    def capacity(self):
+        return self.replay_filter.capacity
+
+    @property
+    def overflows(self):
+        return self.replay_filter.overflows
+
+    def _tag(self, cid, epoch, salt):
+        message = cbor2.dumps([cid, epoch, salt])
+        return hmac.new(self.secret, message, hashlib.sha256).digest()[:HMAC_NONCE_TAG_SIZE]
+
+    def issue(self, cid):
+        """Returns a new nonce for cid."""
+        salt = secrets.token_bytes(HMAC_NONCE_SALT_SIZE)
+        self.issued += 1
+        return salt + self._tag(cid, int(self._clock() // self.epoch), salt)
+
+    def verify(self, cid, nonce):
+        """Returns True if nonce was issued for cid, is fresh, and was not used."""
+        nonce = bytes(nonce)
+        if len(nonce) != HMAC_NONCE_SALT_SIZE + HMAC_NONCE_TAG_SIZE:
+            self.expirations += 1
+            return False
+        salt, tag = nonce[:HMAC_NONCE_SALT_SIZE], nonce[HMAC_NONCE_SALT_SIZE:]
+        now = self._clock()
+        newest = int(now // self.epoch)
+        oldest = int((now - self.ttl) // self.epoch)
+        if not any(
+            hmac.compare_digest(tag, self._tag(cid, epoch, salt))
+            for epoch in range(newest, oldest - 1, -1)
+        ):
+            self.expirations += 1
+            return False
+        added = self.replay_filter.add(nonce, self.ttl + self.epoch)
+        if added is None:
+            return False
+        if not added:
+            self.replays += 1
+            return False
+        self.consumed += 1
+        return True
+
+    @property
+    def metrics(self):
+        """Returns the counters of the issuer."""
+        return {
+            "mode": "hmac",
+            "live": len(self),
+            "capacity": self.capacity,
+            "issued": self.issued,
+            "consumed": self.consumed,
+            "expirations": self.expirations,
+            "replays": self.replays,
+            "overflows": self.overflows,
+        }
@@ -0,0 +1,107 @@
+"""Reference values used to appraise the attestation evidence."""
+
+import asyncio
+import json
+import os
+
+from logger import LOGGER
+
+# Named Information Hash Algorithm Registry
+HASH_ALG_SHA256 = 1
+
+
+class ReferenceValueStore:
+    """Index of the approved firmware measurements.
+
+    Digests are normalized once into a frozenset of
+    (digest bytes, software name, hash alg) keys, so appraising a measurement
+    is a single hash lookup. Reloads build a new index and swap it in, and
+    bump generation.
+
+    The reference values file is a JSON document:
+
+        {
+            "version": 2,
+            "reference_values": [
+                {"software_name": "DotBot", "hash_alg": 1, "digest": "5e0b9c..."}
+            ]
+        }
+    """
+
+    def __init__(self, path=None, default=None):
+        self.path = path
+        self.logger = LOGGER.bind(context=__name__)
+        self.version = 0
+        self.generation = 0
+        self._index = frozenset(
+            (bytes.fromhex(digest), software_name, HASH_ALG_SHA256)
+            for digest, software_name in (default or [])
+        )
+        self._mtime = None
+        if path is not None:
+            self.reload()
+
+    def __len__(self):
+        return len(self._index)
+
+    def match(self, digest, software_name, hash_alg=HASH_ALG_SHA256):
+        """Returns True if the measurement is an approved one."""
+        return (bytes(digest), software_name, hash_alg) in self._index
+
+    def to_list(self):
+        """Returns the reference values, in the file format."""
+        return [
+            {"software_name": software_name, "hash_alg": hash_alg, "digest": digest.hex()}
+            for digest, software_name, hash_alg in sorted(self._index)
+        ]
+
+    def reload(self):
+        """Reloads the reference values file and swaps the index atomically."""
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, "r") as f:
+            content = json.load(f)
+        version = int(content.get("version", 0))
+        if version < self.version:
+            self._mtime = mtime
+            self.logger.warning(
+                "Ignoring older reference values",
+                path=self.path,
+                version=version,
+                current_version=self.version,
+            )
+            return
+        index = frozenset(
+            (
+                bytes.fromhex(value["digest"]),
+                value["software_name"],
+                int(value.get("hash_alg", HASH_ALG_SHA256)),
+            )
+            for value in content["reference_values"]
+        )
+        self._index, self.version, self._mtime = index, version, mtime
+        self.generation += 1
+        self.logger.info(
+            "Reference values loaded",
+            path=self.path,
+            version=version,
+            size=len(index),
+        )
+
+    async def watch(self, interval=1.0):
+        """Reloads the reference values whenever the file is modified."""
+        if self.path is None:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if mtime == self._mtime:
+                    continue
+                # _mtime is only updated by a successful reload, a broken
+                # file is retried and the previous index kept meanwhile
+                await loop.run_in_executor(None, self.reload)
+            except Exception as exc:
+                self.logger.warning(
+                    "Reference values reload failed", path=self.path, error=repr(exc)
+                )
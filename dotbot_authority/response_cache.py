@@ -0,0 +1,76 @@
+"""Short-lived cache of responses, for retransmitted requests."""
+
+import asyncio
+import collections
+import time
+
+
+class ResponseCache:
+    """Responses indexed by a digest of the request, bounded by size and TTL.
+
+    Concurrent requests with the same key share a single computation
+    (single-flight): the first one runs it in its own task, so that a client
+    going away does not cancel it for the others, and the result is cached
+    for ttl seconds. Failed computations are not cached. The cache is per
+    process, with several workers a retransmission may miss it.
+    """
+
+    def __init__(self, capacity=1024, ttl=10.0, clock=time.monotonic):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get_or_compute(self, key, compute):
+        """Returns the cached response of key, or the result of compute()."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > self._clock():
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        task = self._pending.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._pending[key] = asyncio.ensure_future(compute())
+            task.add_done_callback(lambda task: self._done(key, task))
+        return await asyncio.shield(task)
+
+    def _done(self, key, task):
+        del self._pending[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._entries[key] = (self._clock() + self.ttl, task.result())
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    @property
+    def hit_rate(self):
+        """Share of the lookups served without a new computation."""
+        lookups = self.hits + self.coalesced + self.misses
+        return (self.hits + self.coalesced) / lookups if lookups else 0.0
+
+    @property
+    def metrics(self):
+        """Returns the counters of the cache."""
+        return {
+            "entries": len(self._entries),
+            "capacity": self.capacity,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hit_rate,
+        }
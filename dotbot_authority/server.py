@@ -1,7 +1,11 @@
 """Module for the web server application."""
+import asyncio
+import hashlib
 import os
+import time
+from typing import Optional
+
 import cbor2
-from binascii import hexlify
 
 from fastapi import (
     Depends,
@@ -12,17 +16,53 @@ from fastapi import (
     Request,
     Response,
 )
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
-from models import DotBotAuthorityIdentity
-from logger import LOGGER
-from errors import NoMatchError
+from models import ApprovalDecision, DotBotAuthorityIdentity
+from logger import LOGGER, Lazy, lazy_hex
+from errors import (
+    BatchFormatError,
+    BatchTooLargeError,
+    EvidenceFormatError,
+    NoMatchError,
+    RateLimitedError,
+    UnknownKeyError,
+)
+from admission import AdmissionMiddleware, retry_after_header
+from history import HISTORY_KINDS
+from credentials import id_cred_kid
+from cryptography.exceptions import InvalidSignature
+import metrics
 
 
 STATIC_FILES_DIR = os.path.join(os.path.dirname(__file__), "frontend", "dist")
 
+# endpoints whose requests are counted and timed
+INSTRUMENTED_PATHS = [
+    "/.well-known/lake-authz/voucher-request",
+    "/.well-known/lake-authz/cred-request",
+    "/.well-known/lake-ra/attestation-proposal",
+    "/.well-known/lake-ra/evidence",
+    "/.well-known/lake-authz/voucher-request-batch",
+    "/.well-known/lake-ra/evidence-batch",
+]
+
+# endpoints doing public key crypto, under the concurrency cap and peer limits
+ADMISSION_PATHS = [
+    "/.well-known/lake-authz/voucher-request",
+    "/.well-known/lake-ra/evidence",
+    "/.well-known/lake-authz/voucher-request-batch",
+    "/.well-known/lake-ra/evidence-batch",
+]
+
+# maximum number of results in a page of history
+MAX_HISTORY_PAGE = 1000
+
+# maximum number of requests in a batch
+MAX_BATCH_SIZE = 1024
+
 api = FastAPI(
     debug=0,
     title="DotBot Authority API",
@@ -38,6 +78,9 @@ api.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# added first so that it runs inside the metrics one, shed requests are counted
+api.add_middleware(AdmissionMiddleware, paths=ADMISSION_PATHS)
+api.add_middleware(metrics.MetricsMiddleware, paths=INSTRUMENTED_PATHS)
 api.mount(
     "/authority", StaticFiles(directory=STATIC_FILES_DIR, html=True), name="authority"
 )
@@ -57,24 +100,47 @@ async def lake_authz_voucher_request(request: Request):
     """Handles a Voucher Request."""
     voucher_request = await request.body()
     LOGGER.debug(
-        f"Handling voucher request", voucher_request=hexlify(voucher_request).decode()
+        f"Handling voucher request", voucher_request=lazy_hex(voucher_request)
     )
-    id_u = api.authority.enrollment_server.decode_voucher_request(voucher_request)
-    LOGGER.debug(f"Learned dotbot's identity", id_u=id_u[-1], id_u_hex=hex(id_u[-1]))
-    if await api.authority.authorize_dotbot(id_u[-1]):
-        voucher_response = api.authority.enrollment_server.prepare_voucher(
-            voucher_request
-        )
-        LOGGER.debug(
-            f"Dotbot authorized, prepared voucher response",
-            voucher_response=hexlify(voucher_response).decode(),
-        )
-        return Response(
-            content=bytes(voucher_response), media_type="binary/octet-stream"
-        )
-    else:
+    try:
+        voucher_response = await cached_voucher_request(voucher_request)
+    except RateLimitedError as e:
+        raise HTTPException(status_code=429, headers=retry_after_header(e.retry_after))
+    if voucher_response is None:
         LOGGER.debug(f"Dotbot not authorized")
         raise HTTPException(status_code=403)
+    return Response(content=voucher_response, media_type="binary/octet-stream")
+
+
+async def cached_voucher_request(voucher_request, notifications=None):
+    """Returns the voucher response, reusing the one of a retransmission."""
+    # retransmissions of a request share the response of the first one
+    return await api.authority.voucher_cache.get_or_compute(
+        hashlib.sha256(voucher_request).digest(),
+        lambda: process_voucher_request(voucher_request, notifications),
+    )
+
+
+async def process_voucher_request(voucher_request, notifications=None):
+    """Returns the voucher response, or None if the DotBot is not authorized."""
+    start = time.perf_counter()
+    id_u = await api.authority.crypto.decode_voucher_request(voucher_request)
+    metrics.LAKERS_DECODE.observe(time.perf_counter() - start)
+    kid = id_cred_kid(id_u)
+    LOGGER.debug(f"Learned dotbot's identity", id_u=kid, id_u_hex=Lazy(hex, kid))
+    wait = api.authority.admission.admit_device("id_u", kid)
+    if wait:
+        raise RateLimitedError(wait)
+    if not await api.authority.authorize_dotbot(kid, notifications):
+        return None
+    start = time.perf_counter()
+    voucher_response = await api.authority.crypto.prepare_voucher(voucher_request)
+    metrics.LAKERS_PREPARE.observe(time.perf_counter() - start)
+    LOGGER.debug(
+        f"Dotbot authorized, prepared voucher response",
+        voucher_response=lazy_hex(voucher_response),
+    )
+    return bytes(voucher_response)
 
 @api.post(
     path="/.well-known/lake-authz/cred-request",
@@ -82,18 +148,24 @@ async def lake_authz_voucher_request(request: Request):
 )
 async def lake_authz_credential_request(request: Request):
     """Handles a Credential Request."""
-    basedir = "C:\\Users\\yusong\\Downloads\\test-edhoc-handshake\\dotbots-deployment1"
     id_cred_i = await request.body()
-    kid = int(id_cred_i[-1])
-    LOGGER.debug(f"Handling credential request", kid=kid)
-    try:
-        with open(f"{basedir}\\dotbot{kid}-cred-rpk.cbor", "rb") as f:
-            cred_rpk_ccs = f.read()
-    except FileNotFoundError:
+    cred_rpk_ccs = lookup_credential(id_cred_i)
+    if cred_rpk_ccs is None:
         raise HTTPException(status_code=404, detail="Credential not found")
-    LOGGER.debug(f"Returning credential", kid=kid, cred_rpk_ccs=cred_rpk_ccs.hex(' ').upper())
     return Response(content=cred_rpk_ccs, media_type="binary/octet-stream")
 
+
+def lookup_credential(id_cred_i):
+    """Returns the credential of an ID_CRED_I, or None."""
+    kid = id_cred_kid(id_cred_i)
+    LOGGER.debug(f"Handling credential request", kid=kid)
+    start = time.perf_counter()
+    cred_rpk_ccs = api.authority.credentials.get(kid)
+    metrics.CREDENTIAL_LOOKUP.observe(time.perf_counter() - start)
+    if cred_rpk_ccs is not None:
+        LOGGER.debug(f"Returning credential", kid=kid, cred_rpk_ccs=lazy_hex(cred_rpk_ccs, ' '))
+    return cred_rpk_ccs
+
 #endpoints for lake-ra
 
 
@@ -105,25 +177,38 @@ async def lake_authz_credential_request(request: Request):
 async def lake_ra_attestation_proposal(request: Request):
     """Handles an attestation proposal."""
     payload = await request.body()
+    try:
+        attestation_request = await process_attestation_proposal(payload)
+    except RateLimitedError as e:
+        raise HTTPException(status_code=429, headers=retry_after_header(e.retry_after))
+    except NoMatchError as e:
+        LOGGER.debug(f"cannot generate attestation request")
+        raise HTTPException(status_code=403, detail = str(e))
+    return Response(
+        content=attestation_request, media_type="binary/octet-stream"
+    )
+
+
+async def process_attestation_proposal(payload):
+    """Returns the attestation request answering a [c_r, proposal] message."""
+    start = time.perf_counter()
     payload = cbor2.loads(payload)
+    metrics.CBOR_DECODE.observe(time.perf_counter() - start)
     c_r = payload[0]
     attestation_proposal = payload[1]
+    wait = api.authority.admission.admit_device("c_r", c_r)
+    if wait:
+        raise RateLimitedError(wait)
 
     LOGGER.debug(
-        f"Handling attestation proposal", attestation_proposal=hexlify(attestation_proposal).decode()
+        f"Handling attestation proposal", attestation_proposal=lazy_hex(attestation_proposal)
     )
-    try:
-        attestation_request = await api.authority.handle_attestation_proposal(c_r, attestation_proposal) 
-        LOGGER.debug(
-            f"prepared attestation request",
-            attestation_request=hexlify(attestation_request).decode(),
-        )
-        return Response(
-            content=attestation_request, media_type="binary/octet-stream"
-        )
-    except NoMatchError as e:
-        LOGGER.debug(f"cannot generate attestation request")
-        raise HTTPException(status_code=403, detail = str(e))
+    attestation_request = await api.authority.handle_attestation_proposal(c_r, attestation_proposal)
+    LOGGER.debug(
+        f"prepared attestation request",
+        attestation_request=lazy_hex(attestation_request),
+    )
+    return attestation_request
 
 @api.post(
     path="/.well-known/lake-ra/evidence",
@@ -132,19 +217,143 @@ async def lake_ra_attestation_proposal(request: Request):
 async def lake_ra_evidence(request: Request):
     """Handles an evidence attestation token."""
     payload = await request.body()
+    start = time.perf_counter()
     payload = cbor2.loads(payload)
+    metrics.CBOR_DECODE.observe(time.perf_counter() - start)
+    try:
+        attestation_result = await process_evidence(payload)
+    except RateLimitedError as e:
+        raise HTTPException(status_code=429, headers=retry_after_header(e.retry_after))
+    return Response(content=cbor2.dumps(attestation_result), media_type="binary/octet-stream")
+    #raise HTTPException(status_code=400, detail="Verification failed")
+
+
+async def process_evidence(payload, notifications=None):
+    """Appraises a [c_r, evidence] message, returns 0 if good and -1 if bad."""
     c_r = payload[0]
     evidence = payload[1]
-    
-    public_key_bytes = api.authority.public_key_bytes
-    if await api.authority.evaluate_evidence(c_r, evidence, public_key_bytes):
+    # checked before the signature, a DotBot in a reboot loop cannot hog the loop
+    wait = api.authority.admission.admit_device("c_r", c_r)
+    if wait:
+        raise RateLimitedError(wait)
+
+    try:
+        attestation_ok = await api.authority.evaluate_evidence(c_r, evidence, notifications)
+    except (InvalidSignature, UnknownKeyError) as e:
+        LOGGER.debug(f"Evidence signature rejected", error=type(e).__name__)
+        attestation_ok = False
+    except EvidenceFormatError as e:
+        LOGGER.debug(f"Malformed evidence", error=str(e))
+        attestation_ok = False
+    if attestation_ok:
         LOGGER.debug(f"Attestation result is good")
-        attestation_result = 0
-        return Response(content= cbor2.dumps(attestation_result), media_type="binary/octet-stream")
-    else:
-        LOGGER.debug(f"Attestation result is bad")
-        return Response(content= cbor2.dumps(-1), media_type="binary/octet-stream")
-        #raise HTTPException(status_code=400, detail="Verification failed")
+        return 0
+    LOGGER.debug(f"Attestation result is bad")
+    return -1
+
+
+# batch endpoints, for gateways aggregating the requests of many DotBots
+
+
+def decode_batch(payload):
+    """Returns the items of a CBOR array of requests."""
+    start = time.perf_counter()
+    try:
+        batch = cbor2.loads(payload)
+    except (ValueError, cbor2.CBORDecodeError):
+        raise BatchFormatError("Invalid CBOR")
+    metrics.CBOR_DECODE.observe(time.perf_counter() - start)
+    if not isinstance(batch, list):
+        raise BatchFormatError("Expected a CBOR array")
+    if len(batch) > MAX_BATCH_SIZE:
+        raise BatchTooLargeError(f"More than {MAX_BATCH_SIZE} items")
+    return batch
+
+
+async def _read_batch(request):
+    payload = await request.body()
+    try:
+        return decode_batch(payload)
+    except BatchFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except BatchTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+@api.post(
+    path="/.well-known/lake-authz/voucher-request-batch",
+    summary="Handles a batch of voucher requests",
+)
+async def lake_authz_voucher_request_batch(request: Request):
+    """Handles a CBOR array of Voucher Requests.
+
+    Returns a CBOR array with, for each request, the voucher response, or
+    the status the single request would have got (403 not authorized, 429
+    rate limited, 400 invalid). The results are notified in a single message.
+    """
+    batch = await _read_batch(request)
+    results = await process_voucher_request_batch(batch)
+    return Response(content=cbor2.dumps(results), media_type="binary/octet-stream")
+
+
+async def process_voucher_request_batch(batch):
+    """Returns the result of each voucher request, and notifies them at once."""
+    LOGGER.debug(f"Handling voucher request batch", size=len(batch))
+    notifications = []
+
+    async def one(voucher_request):
+        if not isinstance(voucher_request, bytes):
+            return 400
+        try:
+            voucher_response = await cached_voucher_request(voucher_request, notifications)
+        except RateLimitedError:
+            return 429
+        except Exception as e:
+            LOGGER.debug(f"Invalid voucher request in batch", error=str(e))
+            return 400
+        return 403 if voucher_response is None else voucher_response
+
+    results = await asyncio.gather(*[one(voucher_request) for voucher_request in batch])
+    await api.authority.notify_batch(notifications)
+    return results
+
+
+@api.post(
+    path="/.well-known/lake-ra/evidence-batch",
+    summary="Handles a batch of evidence attestation tokens",
+)
+async def lake_ra_evidence_batch(request: Request):
+    """Handles a CBOR array of [c_r, evidence] messages.
+
+    Returns a CBOR array with the attestation result of each message (0 good,
+    -1 bad, 429 rate limited). The results are notified in a single message.
+    """
+    batch = await _read_batch(request)
+    results = await process_evidence_batch(batch)
+    return Response(content=cbor2.dumps(results), media_type="binary/octet-stream")
+
+
+async def process_evidence_batch(batch):
+    """Returns the attestation result of each message, and notifies them at once."""
+    LOGGER.debug(f"Handling evidence batch", size=len(batch))
+    notifications = []
+
+    async def one(payload):
+        if not isinstance(payload, list) or len(payload) != 2:
+            return -1
+        try:
+            return await process_evidence(payload, notifications)
+        except RateLimitedError:
+            return 429
+        except Exception as e:
+            # a malformed item fails on its own, not the whole batch
+            LOGGER.debug(f"Invalid evidence in batch", error=repr(e))
+            return -1
+
+    results = await asyncio.gather(*[one(payload) for payload in batch])
+    await api.authority.notify_batch(notifications)
+    return results
+
 
 # endpoints for the frontend
 
@@ -167,17 +376,210 @@ async def controller_id():
 )
 async def get_acl():
     """Returns the id. (this is just to test the API)"""
-    return JSONResponse(content=api.authority.acl)
+    return JSONResponse(content=api.authority.acl.to_list())
+
+
+@api.post(
+    path="/api/v1/acl/reload",
+    summary="Reload the ACL from its source",
+)
+def reload_acl():
+    """Reloads the ACL and returns it."""
+    api.authority.acl.reload()
+    return JSONResponse(content=api.authority.acl.to_list())
+
+
+@api.post(
+    path="/api/v1/acl/{id_u}",
+    summary="Add a DotBot to the ACL",
+)
+def add_to_acl(id_u: int):
+    """Authorizes a DotBot."""
+    api.authority.acl.add(id_u)
+    return JSONResponse(content={"id": id_u, "authorized": True})
+
+
+@api.delete(
+    path="/api/v1/acl/{id_u}",
+    summary="Remove a DotBot from the ACL",
+)
+def remove_from_acl(id_u: int):
+    """Revokes a DotBot."""
+    if id_u not in api.authority.acl:
+        raise HTTPException(status_code=404, detail="DotBot not in the ACL")
+    api.authority.acl.remove(id_u)
+    return JSONResponse(content={"id": id_u, "authorized": False})
+
+
+@api.get(
+    path="/api/v1/approvals",
+    summary="Return the DotBots waiting for the operator decision",
+)
+async def get_approvals():
+    """Returns the pending decisions, oldest first, with the queue counters."""
+    return JSONResponse(
+        content={
+            "pending": api.authority.approvals.to_list(),
+            "metrics": api.authority.approvals.metrics,
+        }
+    )
+
+
+@api.post(
+    path="/api/v1/approvals",
+    summary="Approve or deny pending DotBots at once",
+)
+async def decide_approvals(decision: ApprovalDecision):
+    """Decides on the listed DotBots, or on all the pending ones without ids.
+
+    The waiting requests resume once the approved DotBots are in the ACL.
+    """
+    ids = await api.authority.decide(decision.ids, decision.authorized)
+    return JSONResponse(content={"ids": ids, "authorized": decision.authorized})
+
+
+@api.post(
+    path="/api/v1/approvals/{id_u}",
+    summary="Approve or deny a pending DotBot",
+)
+async def decide_approval(id_u: int, authorized: bool = True):
+    """Decides on a DotBot waiting for the operator."""
+    if not await api.authority.decide([id_u], authorized):
+        raise HTTPException(status_code=404, detail="No pending decision for the DotBot")
+    return JSONResponse(content={"id": id_u, "authorized": authorized})
+
+
+@api.get(
+    path="/api/v1/reference-values",
+    summary="Return the reference values used to appraise evidence",
+)
+async def get_reference_values():
+    """Returns the version and the content of the reference values."""
+    return JSONResponse(
+        content={
+            "version": api.authority.reference_values.version,
+            "reference_values": api.authority.reference_values.to_list(),
+        }
+    )
+
+
+@api.post(
+    path="/api/v1/reference-values/reload",
+    summary="Reload the reference values file",
+)
+def reload_reference_values():
+    """Reloads the reference values and returns their version."""
+    if api.authority.reference_values.path is None:
+        raise HTTPException(status_code=404, detail="No reference values file")
+    api.authority.reference_values.reload()
+    return JSONResponse(content={"version": api.authority.reference_values.version})
+
+
+@api.get(
+    path="/api/v1/verdict-cache",
+    summary="Return the metrics of the appraisal verdict cache",
+)
+async def get_verdict_cache_metrics():
+    """Returns the size and hit rate of the appraisal verdict cache."""
+    return JSONResponse(content=api.authority.appraiser.metrics)
+
+
+@api.get(
+    path="/api/v1/evidence-verifier",
+    summary="Return the metrics of the evidence signature verifier",
+)
+async def get_evidence_verifier_metrics():
+    """Returns the batches and signatures checked by the verifier workers."""
+    return JSONResponse(content=api.authority.verifier.metrics)
+
+
+@api.get(
+    path="/api/v1/keys",
+    summary="Return the metrics of the attestation key registry",
+)
+async def get_keys_metrics():
+    """Returns the number of registered attestation keys."""
+    return JSONResponse(content=api.authority.keys.metrics)
+
+
+@api.get(
+    path="/api/v1/nonces",
+    summary="Return the metrics of the attestation nonce store",
+)
+async def get_nonces_metrics():
+    """Returns the live, expired and evicted nonce counters."""
+    return JSONResponse(content=api.authority.nonces.metrics)
+
+
+@api.get(
+    path="/api/v1/history",
+    summary="Return the authorization and attestation results, newest first",
+)
+async def get_history(
+    cursor: Optional[int] = None,
+    limit: int = 100,
+    id: Optional[str] = None,
+    kind: Optional[str] = None,
+    since: Optional[int] = None,
+    until: Optional[int] = None,
+):
+    """Returns a page of results, filtered by device id, kind and timestamp (ms).
+
+    The next page is requested with the returned next_cursor, null on the
+    last page.
+    """
+    if kind is not None and kind not in HISTORY_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {HISTORY_KINDS}")
+    items, next_cursor = api.authority.history.query(
+        cursor=cursor,
+        limit=max(1, min(limit, MAX_HISTORY_PAGE)),
+        id_=id,
+        kind=kind,
+        since=since,
+        until=until,
+    )
+    return JSONResponse(content={"items": items, "next_cursor": next_cursor})
+
+
+@api.get(
+    path="/api/v1/admission",
+    summary="Return the limits and shed counters of the admission control",
+)
+async def get_admission_metrics():
+    """Returns the requests in flight and the requests shed, by reason."""
+    return JSONResponse(content=api.authority.admission.metrics)
+
+
+@api.get(
+    path="/api/v1/voucher-cache",
+    summary="Return the metrics of the voucher response cache",
+)
+async def get_voucher_cache_metrics():
+    """Returns the hit, coalesced and miss counters of the voucher cache."""
+    return JSONResponse(content=api.authority.voucher_cache.metrics)
+
+
+@api.get(
+    path="/metrics",
+    summary="Return the metrics in the Prometheus text format",
+)
+async def get_metrics():
+    """Returns the request, stage and state metrics of the authority."""
+    return PlainTextResponse(
+        content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE
+    )
 
 
 @api.websocket("/ws/joined-dotbots-log")
 async def websocket_endpoint(websocket: WebSocket):
     """Websocket server endpoint."""
     await websocket.accept()
-    api.authority.websockets.append(websocket)
+    api.authority.websockets.add(
+        websocket,
+        replay=api.authority.history.recent_messages(api.authority.history_replay),
+    )
     try:
         while True:
             _ = await websocket.receive_text()
     except WebSocketDisconnect:
-        if websocket in api.authority.websockets:
-            api.authority.websockets.remove(websocket)
+        api.authority.websockets.remove(websocket)
@@ -0,0 +1,278 @@
+"""State shared by the worker processes of the authority.
+
+The state lives in a SQLite database in WAL mode, so that readers never
+block the writer and every worker sees the commits of the others. It holds
+the attestation nonces (or, with HMAC nonces, the used ones), the
+notifications to relay to the websocket clients of every worker, and
+(through AclStore) the ACL.
+
+The authority runs the statements of these classes off the event loop, in
+a single state thread, and polls the database from the default executor.
+"""
+
+import asyncio
+import contextlib
+import hmac
+import secrets
+import sqlite3
+import threading
+import time
+import uuid
+
+import cbor2
+
+from logger import LOGGER
+from nonce_store import NONCE_SIZE
+
+# seconds a statement waits for the write lock of another worker, short so
+# that a stuck writer fails the requests instead of stalling the state thread
+BUSY_TIMEOUT = 1.0
+
+
+def connect(path):
+    """Opens a connection to the state database, in WAL mode."""
+    connection = sqlite3.connect(
+        path, isolation_level=None, check_same_thread=False, timeout=BUSY_TIMEOUT
+    )
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class _Database:
+    """Connection to the state database, with explicit write transactions."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = connect(path)
+        self._lock = threading.Lock()
+        # reads (counts, polls) never wait for a write transaction in progress
+        self._reader = connect(path)
+        self._read_lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def execute(self, *args):
+        """Runs a read-only statement, returns its rows."""
+        with self._read_lock:
+            return self._reader.execute(*args).fetchall()
+
+
+class SqliteNonceStore:
+    """NonceStore keeping the nonces in the shared state database.
+
+    A nonce issued by one worker can be consumed by any other one, and only
+    once: the consuming delete is done in a write transaction. The counters
+    are those of the current process.
+    """
+
+    def __init__(self, path, capacity=4096, ttl=30.0, clock=time.time):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._clock = clock
+        self._db = _Database(path)
+        with self._db.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS nonces "
+                "(cid BLOB PRIMARY KEY, nonce BLOB NOT NULL, expires REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS nonces_expires ON nonces (expires)"
+            )
+        self.issued = 0
+        self.consumed = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM nonces")[0][0]
+
+    def __contains__(self, cid):
+        rows = self._db.execute(
+            "SELECT 1 FROM nonces WHERE cid = ? AND expires > ?",
+            (cbor2.dumps(cid), self._clock()),
+        )
+        return bool(rows)
+
+    def issue(self, cid):
+        """Generates a new nonce for cid, replacing any pending one."""
+        now = self._clock()
+        key = cbor2.dumps(cid)
+        nonce = secrets.token_bytes(NONCE_SIZE)
+        with self._db.transaction() as db:
+            self._expire(db, now)
+            pending = db.execute("SELECT 1 FROM nonces WHERE cid = ?", (key,))
+            if pending.fetchone() is None:
+                count = db.execute("SELECT COUNT(*) FROM nonces").fetchone()[0]
+                if count >= self.capacity:
+                    evicted = db.execute(
+                        "DELETE FROM nonces WHERE cid IN "
+                        "(SELECT cid FROM nonces ORDER BY expires LIMIT ?)",
+                        (count - self.capacity + 1,),
+                    )
+                    self.evictions += evicted.rowcount
+            db.execute(
+                "INSERT OR REPLACE INTO nonces VALUES (?, ?, ?)",
+                (key, nonce, now + self.ttl),
+            )
+        self.issued += 1
+        return nonce
+
+    def consume(self, cid):
+        """Removes and returns the nonce of cid, None if unknown or expired."""
+        key = cbor2.dumps(cid)
+        with self._db.transaction() as db:
+            row = db.execute(
+                "SELECT nonce, expires FROM nonces WHERE cid = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute("DELETE FROM nonces WHERE cid = ?", (key,))
+        nonce, expires = row
+        if expires <= self._clock():
+            self.expirations += 1
+            return None
+        self.consumed += 1
+        return bytes(nonce)
+
+    def verify(self, cid, nonce):
+        """Consumes the nonce of cid, returns True if it is nonce."""
+        expected = self.consume(cid)
+        return expected is not None and hmac.compare_digest(expected, bytes(nonce))
+
+    def _expire(self, db, now):
+        expired = db.execute("DELETE FROM nonces WHERE expires <= ?", (now,))
+        self.expirations += expired.rowcount
+
+    @property
+    def metrics(self):
+        """Returns the counters of the store."""
+        return {
+            "live": len(self),
+            "capacity": self.capacity,
+            "issued": self.issued,
+            "consumed": self.consumed,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+
+class SqliteReplayFilter:
+    """ReplayFilter keeping the used nonces in the shared state database.
+
+    A nonce used in one worker is rejected by every other one. As with
+    ReplayFilter, new nonces are rejected while the filter is full.
+    """
+
+    def __init__(self, path, capacity=4096, clock=time.time):
+        self.capacity = capacity
+        self._clock = clock
+        self._db = _Database(path)
+        with self._db.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS used_nonces "
+                "(nonce BLOB PRIMARY KEY, expires REAL NOT NULL)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS used_nonces_expires ON used_nonces (expires)"
+            )
+        self.overflows = 0
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM used_nonces")[0][0]
+
+    def add(self, nonce, ttl):
+        """Records nonce, returns False if it was already used.
+
+        Returns None, without recording it, when the filter is full.
+        """
+        now = self._clock()
+        with self._db.transaction() as db:
+            db.execute("DELETE FROM used_nonces WHERE expires <= ?", (now,))
+            used = db.execute("SELECT 1 FROM used_nonces WHERE nonce = ?", (nonce,))
+            if used.fetchone() is not None:
+                return False
+            count = db.execute("SELECT COUNT(*) FROM used_nonces").fetchone()[0]
+            if count >= self.capacity:
+                self.overflows += 1
+                return None
+            db.execute("INSERT INTO used_nonces VALUES (?, ?)", (nonce, now + ttl))
+        return True
+
+
+class SqliteEventBus:
+    """Relays the notifications between the workers.
+
+    Each worker appends the notifications it produces to the events table
+    and polls it for the ones produced by the other workers, which are then
+    published to its own websocket clients. Old events are pruned.
+    """
+
+    def __init__(self, path, interval=0.05, retention=60.0):
+        self.origin = uuid.uuid4().hex
+        self.interval = interval
+        self.retention = retention
+        self.logger = LOGGER.bind(context=__name__)
+        self._db = _Database(path)
+        with self._db.transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT NOT NULL, "
+                "timestamp REAL NOT NULL, message TEXT NOT NULL)"
+            )
+        self._last_id = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM events")[0][0]
+
+    def publish(self, message):
+        """Makes an encoded notification visible to the other workers.
+
+        A notification that cannot be written is only missed by the clients
+        of the other workers, the error is logged.
+        """
+        try:
+            with self._db.transaction() as db:
+                db.execute(
+                    "INSERT INTO events (origin, timestamp, message) VALUES (?, ?, ?)",
+                    (self.origin, time.time(), message),
+                )
+        except sqlite3.Error as exc:
+            self.logger.warning("Event bus publish failed", error=str(exc))
+
+    def poll(self):
+        """Returns the messages published by the other workers since last poll."""
+        rows = self._db.execute(
+            "SELECT id, origin, message FROM events WHERE id > ? ORDER BY id",
+            (self._last_id,),
+        )
+        if rows:
+            self._last_id = rows[-1][0]
+        return [message for _, origin, message in rows if origin != self.origin]
+
+    def prune(self):
+        with self._db.transaction() as db:
+            db.execute(
+                "DELETE FROM events WHERE timestamp < ?", (time.time() - self.retention,)
+            )
+
+    async def watch(self, deliver):
+        """Calls deliver(message) for every message of the other workers."""
+        loop = asyncio.get_running_loop()
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                for message in await loop.run_in_executor(None, self.poll):
+                    deliver(message)
+                if time.monotonic() - last_prune > self.retention:
+                    last_prune = time.monotonic()
+                    await loop.run_in_executor(None, self.prune)
+            except sqlite3.Error as exc:
+                self.logger.warning("Event bus poll failed", error=str(exc))
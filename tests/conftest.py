@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the modules of the authority import each other by their flat names, as
+# when main.py is run from dotbot_authority/
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dotbot_authority")
+)
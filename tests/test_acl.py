@@ -0,0 +1,51 @@
+import asyncio
+import json
+import os
+
+from acl import AclStore
+
+
+def test_text_file(tmp_path):
+    path = tmp_path / "acl.txt"
+    path.write_text("1\n0x2b # comment\n\n")
+    acl = AclStore(str(path))
+    assert acl.to_list() == [1, 43]
+    assert 43 in acl
+    assert 2 not in acl
+
+
+def test_add_remove_persist(tmp_path):
+    path = str(tmp_path / "acl.json")
+    acl = AclStore(path, default=[1])
+    acl.add(2, 3)
+    acl.remove(1)
+    assert AclStore(path).to_list() == [2, 3]
+
+
+def test_sqlite(tmp_path):
+    path = str(tmp_path / "acl.db")
+    acl = AclStore(path, default=[1])
+    acl.add(5)
+    assert AclStore(path).to_list() == [1, 5]
+
+
+def test_watch_survives_malformed_source(tmp_path):
+    path = tmp_path / "acl.json"
+    path.write_text("[1]")
+    acl = AclStore(str(path))
+
+    async def run():
+        task = asyncio.ensure_future(acl.watch(interval=0.01))
+        path.write_text('[{"id": 1}]')
+        os.utime(path, ns=(1, 1))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        assert acl.to_list() == [1]
+        # the broken source is retried, the next valid one is loaded
+        path.write_text(json.dumps([1, 2]))
+        os.utime(path, ns=(2, 2))
+        await asyncio.sleep(0.1)
+        assert acl.to_list() == [1, 2]
+        task.cancel()
+
+    asyncio.run(run())
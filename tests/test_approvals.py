@@ -0,0 +1,136 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+
+from devices import SimulatedDevice, provision  # noqa: E402
+
+from approvals import ApprovalQueue  # noqa: E402
+from authority import Authority  # noqa: E402
+
+VOUCHER_REQUEST = "/.well-known/lake-authz/voucher-request"
+
+
+def test_requests_of_a_dotbot_share_its_decision():
+    async def scenario():
+        queue = ApprovalQueue(timeout=5.0)
+        first, created = queue.request(1)
+        assert created
+        second, created = queue.request(1)
+        assert second is first and not created
+        waiters = [asyncio.create_task(queue.wait(first)) for _ in range(2)]
+        assert queue.decide([1, 2], True) == [1]
+        return await asyncio.gather(*waiters), queue
+
+    results, queue = asyncio.run(scenario())
+    assert results == [True, True]
+    assert len(queue) == 0
+    assert queue.metrics["coalesced"] == 1 and queue.metrics["approved"] == 1
+
+
+def test_denied_dotbot():
+    async def scenario():
+        queue = ApprovalQueue(timeout=5.0)
+        decision, _ = queue.request(1)
+        waiter = asyncio.create_task(queue.wait(decision))
+        await asyncio.sleep(0)
+        queue.decide(None, False)
+        return await waiter, queue
+
+    result, queue = asyncio.run(scenario())
+    assert result is False
+    assert queue.denied == 1
+
+
+def test_dotbot_denied_without_decision_in_time():
+    async def scenario():
+        queue = ApprovalQueue(timeout=0.05)
+        decision, _ = queue.request(1)
+        result = await queue.wait(decision)
+        assert queue.decide([1], True) == []
+        return result, queue
+
+    result, queue = asyncio.run(scenario())
+    assert result is False
+    assert 1 not in queue
+    assert queue.expirations == 1
+
+
+def test_full_queue_denies_at_once():
+    async def scenario():
+        queue = ApprovalQueue(timeout=5.0, capacity=1)
+        queue.request(1)
+        decision, created = queue.request(2)
+        queue.shutdown()
+        return decision, created, queue
+
+    decision, created, queue = asyncio.run(scenario())
+    assert decision is None and not created
+    assert queue.overflows == 1
+
+
+def test_pending_approvals_stay_below_the_concurrency_cap(tmp_path):
+    authority = Authority(
+        crypto_executor="inline",
+        evidence_executor="inline",
+        approval_timeout=5.0,
+        max_concurrency=4,
+        acl=str(tmp_path / "acl.json"),
+    )
+    assert authority.approvals.capacity == 3
+    authority.stop([])
+
+
+@pytest.fixture
+def authority(tmp_path):
+    known = SimulatedDevice(0)
+    unknown = [SimulatedDevice(index) for index in (1, 2)]
+    authority = Authority(
+        crypto_executor="inline",
+        evidence_executor="inline",
+        approval_timeout=5.0,
+        max_concurrency=2,
+        **provision([known], str(tmp_path)),
+    )
+    # as many DotBots waiting as the cap, which the clamp alone would prevent
+    authority.approvals.capacity = 2
+    yield authority, known, unknown
+    authority.stop([])
+
+
+def test_waiting_dotbots_do_not_hold_admission_slots(authority):
+    authority, known, unknown = authority
+    requests = [device.voucher_request() for device in unknown + [known]]
+    codes, known_code = asyncio.run(onboard(authority, unknown, requests))
+    assert known_code == 200
+    assert codes == [200, 403]
+    assert unknown[0].kid in authority.acl
+    assert unknown[1].kid not in authority.acl
+    assert authority.admission.in_flight == 0
+    assert authority.admission.shed["overload"] == 0
+
+
+async def onboard(authority, unknown, requests):
+    transport = httpx.ASGITransport(app=authority.api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        waiting = [
+            asyncio.create_task(client.post(VOUCHER_REQUEST, content=request))
+            for request in requests[:2]
+        ]
+        while len(authority.approvals) < 2:
+            await asyncio.sleep(0.01)
+        response = await client.post(VOUCHER_REQUEST, content=requests[2])
+        known_code = response.status_code
+        for device, authorized in zip(unknown, ("true", "false")):
+            response = await client.post(
+                f"/api/v1/approvals/{device.kid}", params={"authorized": authorized}
+            )
+            assert response.status_code == 200
+        responses = await asyncio.gather(*waiting)
+    return [response.status_code for response in responses], known_code
@@ -0,0 +1,49 @@
+import asyncio
+import os
+import sys
+
+import cbor2
+import httpx
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+
+from devices import SimulatedDevice, provision  # noqa: E402
+
+from authority import Authority  # noqa: E402
+
+
+@pytest.fixture
+def authority(tmp_path):
+    devices = [SimulatedDevice(index) for index in range(2)]
+    authority = Authority(evidence_executor="inline", **provision(devices, str(tmp_path)))
+    yield authority, devices
+    authority.stop([])
+
+
+def test_malformed_evidence_items_fail_alone(authority):
+    authority, devices = authority
+    assert asyncio.run(post_evidence_batch(authority, devices)) == [0, -1, -1, -1]
+
+
+async def post_evidence_batch(authority, devices):
+    transport = httpx.ASGITransport(app=authority.api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post(
+            "/.well-known/lake-ra/attestation-proposal",
+            content=devices[0].attestation_proposal(),
+        )
+        nonce = cbor2.loads(response.content)[1]
+        batch = [
+            cbor2.loads(devices[0].evidence(nonce)),
+            [1, 5],
+            [2, b"\x00"],
+            "garbage",
+        ]
+        response = await client.post(
+            "/.well-known/lake-ra/evidence-batch", content=cbor2.dumps(batch)
+        )
+    assert response.status_code == 200
+    return cbor2.loads(response.content)
@@ -0,0 +1,37 @@
+import asyncio
+
+from broadcaster import Broadcaster
+
+
+class Client:
+    def __init__(self, blocked=False):
+        self.frames = []
+        self.blocked = asyncio.Event() if blocked else None
+        self.closed = False
+
+    async def send_text(self, message):
+        if self.blocked is not None:
+            await self.blocked.wait()
+        self.frames.append(message)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_slow_clients_are_dropped_and_counted():
+    async def scenario():
+        broadcaster = Broadcaster(queue_size=2)
+        fast, slow = Client(), Client(blocked=True)
+        broadcaster.add(fast, replay=['"old"'])
+        broadcaster.add(slow)
+        for index in range(4):
+            broadcaster.publish_text(f'"{index}"')
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        return broadcaster, fast, slow
+
+    broadcaster, fast, slow = asyncio.run(scenario())
+    assert fast.frames == ['["old"]', '"0"', '"1"', '"2"', '"3"']
+    assert broadcaster.sent == 5
+    assert slow not in broadcaster and slow.closed
+    assert broadcaster.dropped_clients == 1
@@ -0,0 +1,57 @@
+import json
+import os
+
+from click.testing import CliRunner
+
+from dotbot_authority import cli
+
+
+def run(*args):
+    result = CliRunner().invoke(cli.main, [str(arg) for arg in args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def listed(basedir, *args):
+    output = run("list", "--basedir", basedir, "--json", *args)
+    return json.loads(output.splitlines()[-1])
+
+
+def test_list_empty_manifest(tmp_path):
+    assert listed(tmp_path) == {"total": 0, "offset": 0, "identities": []}
+    assert "Identities 0-0 of 0" in run("list", "--basedir", tmp_path)
+
+
+def test_list_populated_manifest(tmp_path):
+    run("new", "--basedir", tmp_path, "--label", "robot7")
+    run("new-batch", "--basedir", tmp_path, "--count", 3, "--workers", 1)
+    page = listed(tmp_path, "--label", "dotbot*", "--offset", 1, "--limit", 1)
+    assert page["total"] == 3
+    assert [entry["label"] for entry in page["identities"]] == ["dotbot9"]
+    assert listed(tmp_path, "--kid", 7)["identities"][0]["label"] == "robot7"
+    assert listed(tmp_path, "--limit", 0)["total"] == 4
+
+
+def test_reindex_after_a_credential_file_is_removed(tmp_path):
+    run("new", "--basedir", tmp_path, "--label", "dotbot1")
+    run("new", "--basedir", tmp_path, "--label", "dotbot2")
+    os.remove(tmp_path / f"dotbot2{cli.CRED_FILE_SUFFIX}")
+    # the manifest is only what list reads, until it is rebuilt
+    assert listed(tmp_path)["total"] == 2
+    assert "Indexed 2 identities" in run("reindex", "--basedir", tmp_path)
+    entries = {entry["label"]: entry for entry in listed(tmp_path)["identities"]}
+    assert entries["dotbot1"]["kid"] == 1
+    assert entries["dotbot2"]["kid"] is None
+    assert f"dotbot2{cli.CRED_FILE_SUFFIX}" not in entries["dotbot2"]["files"]
+
+
+def test_new_batch_does_not_reuse_labels(tmp_path):
+    run("new", "--basedir", tmp_path, "--label", "dotbot3", "--kid", 1)
+    result = CliRunner().invoke(
+        cli.main, ["new-batch", "--basedir", str(tmp_path), "--count", "3", "--workers", "1"]
+    )
+    assert result.exit_code == 1
+    assert "1 labels are already used, starting with dotbot3" in result.output
+    assert listed(tmp_path)["total"] == 1
+    run("new-batch", "--basedir", tmp_path, "--count", 3, "--workers", 1, "--force")
+    assert listed(tmp_path, "--label", "dotbot3")["identities"][0]["kid"] == 3
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import socket
+import sys
+
+import cbor2
+import pytest
+
+aiocoap = pytest.importorskip("aiocoap")
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+
+from devices import SimulatedDevice, provision  # noqa: E402
+
+from authority import Authority  # noqa: E402
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def authority(tmp_path):
+    device = SimulatedDevice(0)
+    authority = Authority(
+        crypto_executor="inline",
+        evidence_executor="inline",
+        host="127.0.0.1",
+        coap_port=free_udp_port(),
+        **provision([device], str(tmp_path)),
+    )
+    yield authority, device
+    authority.stop([])
+
+
+def test_enrollment_and_attestation_over_coap(authority):
+    authority, device = authority
+    assert asyncio.run(onboard(authority, device)) == [
+        aiocoap.CHANGED,
+        aiocoap.CHANGED,
+        (aiocoap.CHANGED, 0),
+    ]
+
+
+async def onboard(authority, device):
+    from coap import create_server
+
+    voucher_request = device.voucher_request()
+    server = await create_server(authority.host, authority.coap_port)
+    client = await aiocoap.Context.create_client_context()
+    base_uri = f"coap://{authority.host}:{authority.coap_port}"
+
+    async def post(path, payload):
+        request = aiocoap.Message(code=aiocoap.POST, uri=f"{base_uri}{path}", payload=payload)
+        return await asyncio.wait_for(client.request(request).response, 10)
+
+    try:
+        codes = []
+        response = await post("/.well-known/lake-authz/voucher-request", voucher_request)
+        codes.append(response.code)
+        response = await post(
+            "/.well-known/lake-ra/attestation-proposal", device.attestation_proposal()
+        )
+        codes.append(response.code)
+        nonce = cbor2.loads(response.payload)[1]
+        response = await post("/.well-known/lake-ra/evidence", device.evidence(nonce))
+        codes.append((response.code, cbor2.loads(response.payload)))
+        return codes
+    finally:
+        await client.shutdown()
+        await server.shutdown()
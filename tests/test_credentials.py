@@ -0,0 +1,60 @@
+import asyncio
+
+import cbor2
+from click.testing import CliRunner
+
+from credentials import PACK_INDEX_FILE, CredentialStore, KeyRegistry, read_pack, write_pack
+from dotbot_authority import cli
+
+
+def test_pack_roundtrip(tmp_path):
+    write_pack(str(tmp_path), {2: b"two", 1: b"one"})
+    assert read_pack(str(tmp_path)) == {1: b"one", 2: b"two"}
+    assert read_pack(str(tmp_path / "missing")) == {}
+
+
+def test_cli_packs_are_read_by_the_authority(tmp_path):
+    basedir = str(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(cli.main, ["new", "--basedir", basedir, "--label", "dotbot1"])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(
+        cli.main, ["new-batch", "--basedir", basedir, "--count", "3", "--workers", "1"]
+    )
+    assert result.exit_code == 0, result.output
+    store = CredentialStore(basedir)
+    assert store.is_packed
+    # the identity created before the pack is merged into it
+    assert len(store) == 4
+    for kid, credential in read_pack(basedir).items():
+        assert bytes(store.get(kid)) == credential
+        assert int.from_bytes(cbor2.loads(credential)[8][1][2], "big") == kid
+
+
+def test_watcher_survives_a_wrong_shape_index(tmp_path):
+    basedir = str(tmp_path)
+    write_pack(basedir, {1: b"one"})
+    store = CredentialStore(basedir)
+    reloads = []
+
+    async def run():
+        watcher = asyncio.create_task(store.watch(interval=0.01, on_reload=reloads.append))
+        # a well-formed CBOR list instead of the {kid: [offset, length]} map
+        (tmp_path / PACK_INDEX_FILE).write_bytes(cbor2.dumps([[0, 3]]))
+        await asyncio.sleep(0.1)
+        assert not watcher.done()
+        assert not reloads and bytes(store.get(1)) == b"one"
+        # retried until the pack is fixed, not only when touched again
+        write_pack(basedir, {1: b"one", 2: b"two"})
+        while not reloads:
+            await asyncio.sleep(0.01)
+        watcher.cancel()
+
+    asyncio.run(run())
+    assert len(store) == 2
+
+
+def test_wrong_shape_credentials_are_skipped():
+    good = cbor2.dumps({2: b"\x00" * 16, 8: {1: {1: 1, 2: b"\x01", -1: 6, -2: b"\x02" * 32}}})
+    registry = KeyRegistry([cbor2.dumps([1, 2]), cbor2.dumps({8: {1: [1]}}), good])
+    assert registry.get_bytes(kid=b"\x01") == b"\x02" * 32
@@ -0,0 +1,22 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+
+from devices import SimulatedDevice  # noqa: E402
+
+from crypto_executor import CryptoExecutor  # noqa: E402
+
+
+def test_process_workers_are_spawned():
+    device = SimulatedDevice(0)
+    executor = CryptoExecutor("process", workers=1)
+    try:
+        assert executor._executor._mp_context.get_start_method() == "spawn"
+        id_u = asyncio.run(executor.decode_voucher_request(device.voucher_request()))
+    finally:
+        executor.shutdown()
+    assert id_u == device.id_u
@@ -0,0 +1,199 @@
+import asyncio
+import json
+import time
+import uuid
+
+import cbor2
+import pytest
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+from authority import Authority
+import metrics
+from errors import EvidenceFormatError
+
+DIGEST = bytes.fromhex("5e0b9ca06bd0fe8af89142525d50d6b197393d3102d7a4b08c52e8f786fc67e4")
+
+
+class Device:
+    def __init__(self, index):
+        self.kid = bytes([index])
+        self.subject = uuid.UUID(int=index).bytes
+        self.ueid = b"\x01" + self.subject
+        self.key = Ed25519PrivateKey.generate()
+
+    def credential(self):
+        x = self.key.public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+        return cbor2.dumps({2: self.subject, 8: {1: {1: 1, 2: self.kid, -1: 6, -2: x}}})
+
+    def token(
+        self, nonce, ueid=None, software_name="DotBot", tag_version=1, kid=True, unprotected=None
+    ):
+        claims = {
+            10: nonce,
+            273: [
+                [
+                    258,
+                    {
+                        0: "dotbot",
+                        12: tag_version,
+                        1: software_name,
+                        3: {17: [{24: "03app_dotbot.bin", 20: 1024, 7: [1, DIGEST]}]},
+                    },
+                ]
+            ],
+        }
+        if ueid is not False:
+            claims[256] = ueid or self.ueid
+        protected = cbor2.dumps({1: -8, 4: self.kid} if kid else {1: -8})
+        payload = cbor2.dumps(claims)
+        signature = self.key.sign(cbor2.dumps(["Signature1", protected, b"", payload]))
+        return cbor2.dumps(
+            cbor2.CBORTag(18, [protected, unprotected or {}, payload, signature])
+        )
+
+
+@pytest.fixture
+def fleet(tmp_path):
+    devices = [Device(1), Device(2)]
+    cred_dir = tmp_path / "credentials"
+    cred_dir.mkdir()
+    for device in devices:
+        (cred_dir / f"dotbot{device.kid[0]}-cred-rpk.cbor").write_bytes(device.credential())
+    reference_values = tmp_path / "reference-values.json"
+    reference_values.write_text(
+        json.dumps(
+            {
+                "version": 1,
+                "reference_values": [
+                    {"software_name": "DotBot", "hash_alg": 1, "digest": DIGEST.hex()}
+                ],
+            }
+        )
+    )
+    authority = Authority(
+        evidence_executor="inline",
+        crypto_executor="inline",
+        cred_dir=str(cred_dir),
+        reference_values=str(reference_values),
+    )
+    yield authority, devices
+    authority.stop([])
+
+
+def evaluate(authority, cid, token):
+    async def run():
+        results = []
+        ok = await authority.evaluate_evidence(cid, token, results)
+        return ok, results[0]
+
+    return asyncio.run(run())
+
+
+def test_good_evidence(fleet):
+    authority, (a, _) = fleet
+    ok, result = evaluate(authority, 7, a.token(authority.nonces.issue(7)))
+    assert ok and result.id == a.ueid.hex()
+
+
+def test_kid_and_ueid_of_different_devices(fleet):
+    authority, (a, b) = fleet
+    with pytest.raises(EvidenceFormatError):
+        evaluate(authority, 7, a.token(authority.nonces.issue(7), ueid=b.ueid))
+
+
+def test_kid_only_is_reported_as_its_ueid(fleet):
+    authority, (a, _) = fleet
+    ok, result = evaluate(authority, 7, a.token(authority.nonces.issue(7), ueid=False))
+    assert ok and result.id == a.ueid.hex()
+
+
+def test_replayed_nonce(fleet):
+    authority, (a, _) = fleet
+    nonce = authority.nonces.issue(7)
+    assert evaluate(authority, 7, a.token(nonce))[0]
+    assert not evaluate(authority, 7, a.token(nonce))[0]
+
+
+@pytest.mark.parametrize("claims", [{"tag_version": "abc"}, {"software_name": 5}])
+def test_mistyped_measurement_is_malformed(fleet, claims):
+    authority, (a, _) = fleet
+    nonce = authority.nonces.issue(7)
+    with pytest.raises(EvidenceFormatError):
+        evaluate(authority, 7, a.token(nonce, **claims))
+    # rejected before the nonce check, the nonce is still usable
+    assert evaluate(authority, 7, a.token(nonce))[0]
+
+
+@pytest.mark.parametrize(
+    "header, ueid",
+    [({4: 2**31}, False), ({4: "kid"}, False), ({}, 2**31), ({}, "ueid")],
+)
+def test_mistyped_kid_or_ueid_is_malformed(fleet, header, ueid):
+    authority, (a, _) = fleet
+    nonce = authority.nonces.issue(7)
+    token = a.token(nonce, ueid=ueid, kid=False, unprotected=header)
+    with pytest.raises(EvidenceFormatError):
+        evaluate(authority, 7, token)
+    with pytest.raises(EvidenceFormatError):
+        authority.keys.get_bytes(kid=2**31)
+
+
+def test_nonce_check_is_not_timed_as_appraisal(fleet):
+    authority, (a, _) = fleet
+    verify = authority.nonces.verify
+
+    def slow_verify(cid, nonce):
+        # a state database waiting for another worker
+        time.sleep(0.05)
+        return verify(cid, nonce)
+
+    authority.nonces.verify = slow_verify
+    appraisal, nonce_check = metrics.APPRAISAL.sum, metrics.NONCE_CHECK.sum
+    assert evaluate(authority, 7, a.token(authority.nonces.issue(7)))[0]
+    assert metrics.NONCE_CHECK.sum - nonce_check >= 0.05
+    assert metrics.APPRAISAL.sum - appraisal < 0.05
+
+
+def test_repeated_measurements_reuse_the_verdict(fleet):
+    authority, (a, b) = fleet
+    assert evaluate(authority, 7, a.token(authority.nonces.issue(7)))[0]
+    assert evaluate(authority, 8, b.token(authority.nonces.issue(8)))[0]
+    assert (authority.appraiser.misses, authority.appraiser.hits) == (1, 1)
+
+
+def test_new_reference_values_invalidate_the_verdicts(fleet):
+    authority, (a, _) = fleet
+    assert evaluate(authority, 7, a.token(authority.nonces.issue(7)))[0]
+    with open(authority.reference_values.path, "w") as f:
+        json.dump(
+            {
+                "version": 2,
+                "reference_values": [
+                    {"software_name": "DotBot", "hash_alg": 1, "digest": "00" * 32}
+                ],
+            },
+            f,
+        )
+    authority.reference_values.reload()
+    ok, result = evaluate(authority, 7, a.token(authority.nonces.issue(7)))
+    assert not ok and not result.attestation_result
+    assert authority.appraiser.misses == 2 and authority.appraiser.invalidations == 1
+
+
+def test_new_key_is_not_bypassed_by_a_cached_verdict(fleet):
+    authority, (a, _) = fleet
+    assert evaluate(authority, 7, a.token(authority.nonces.issue(7)))[0]
+    # the DotBot is provisioned again, with a new attestation key
+    renewed = Device(1)
+    path = f"{authority.credentials.basedir}/dotbot1-cred-rpk.cbor"
+    with open(path, "wb") as f:
+        f.write(renewed.credential())
+    authority.credentials.reload()
+    authority.keys.load(authority.credentials.values())
+    with pytest.raises(InvalidSignature):
+        evaluate(authority, 7, a.token(authority.nonces.issue(7)))
+    assert evaluate(authority, 7, renewed.token(authority.nonces.issue(7)))[0]
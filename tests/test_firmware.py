@@ -0,0 +1,56 @@
+import asyncio
+import hashlib
+
+import firmware
+from firmware import FirmwareDigestCache, padded_sha256
+
+
+def test_padded_sha256(tmp_path):
+    path = tmp_path / "03app_dotbot.bin"
+    path.write_bytes(b"image")
+    assert padded_sha256(str(path)) == hashlib.sha256(b"image").digest()
+    assert padded_sha256(str(path), 8) == hashlib.sha256(b"image\xff\xff\xff").digest()
+
+
+def test_padded_len_is_bounded(tmp_path):
+    (tmp_path / "03app_dotbot.bin").write_bytes(b"image")
+    cache = FirmwareDigestCache(str(tmp_path), max_size=1024)
+
+    async def run():
+        assert await cache.digest("03app_dotbot.bin", 1024) is not None
+        assert await cache.digest("03app_dotbot.bin", 1025) is None
+        assert await cache.digest("03app_dotbot.bin", 4) is None
+        assert await cache.digest("03app_dotbot.bin", "8") is None
+        assert await cache.digest("../03app_dotbot.bin", 8) is not None
+
+    asyncio.run(run())
+    assert cache.rejections == 3
+
+
+def test_tracked_padded_lens_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(firmware, "MAX_PADDED_LENS", 2)
+    (tmp_path / "03app_dotbot.bin").write_bytes(b"image")
+    cache = FirmwareDigestCache(str(tmp_path), max_size=1024)
+
+    async def run():
+        for padded_len in range(8, 16):
+            await cache.digest("03app_dotbot.bin", padded_len)
+        await cache.digest("03app_dotbot.bin", 8)
+
+    asyncio.run(run())
+    assert len(cache) == 2
+    assert cache.hits == 1
+    cache.scan()
+    assert len(cache) == 2
+
+
+def test_directories_are_not_images(tmp_path):
+    (tmp_path / "build").mkdir()
+    cache = FirmwareDigestCache(str(tmp_path))
+
+    async def run():
+        # larger than the size of a directory
+        return [await cache.digest(name, 65536) for name in ("", ".", "build", "missing")]
+
+    assert asyncio.run(run()) == [None, None, None, None]
+    assert cache.computations == 0 and cache.rejections == 0
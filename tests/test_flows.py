@@ -0,0 +1,46 @@
+"""Checks the load-test harness of benchmarks/bench_flows.py end to end."""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+
+from bench_flows import _run_asgi, check_thresholds  # noqa: E402
+from devices import SimulatedDevice, provision  # noqa: E402
+
+
+@pytest.mark.parametrize("batch_size", [0, 2])
+def test_fleet_onboards(tmp_path, batch_size):
+    devices = [SimulatedDevice(index) for index in range(5)]
+    authority_kwargs = dict(
+        provision(devices, str(tmp_path)),
+        crypto_executor="inline",
+        evidence_executor="inline",
+    )
+    voucher_requests = [device.voucher_request() for device in devices]
+    elapsed, timings, _ = asyncio.run(
+        _run_asgi(devices, voucher_requests, 4, batch_size, authority_kwargs)
+    )
+    stages = timings.summary()
+    assert not timings.errors
+    flow = "flow: onboard batch" if batch_size else "flow: onboard device"
+    assert stages[flow]["count"] == (3 if batch_size else 5)
+    results = {"devices_per_s": len(devices) / elapsed, "stages": stages}
+    assert check_thresholds(results, max_p99=None, min_throughput=None) == []
+    assert check_thresholds(results, max_p99=0.0, min_throughput=None)
+
+
+def test_unknown_devices_are_errors(tmp_path):
+    devices = [SimulatedDevice(index) for index in range(2)]
+    authority_kwargs = dict(provision(devices[:1], str(tmp_path)), evidence_executor="inline")
+    voucher_requests = [device.voucher_request() for device in devices]
+    _, timings, _ = asyncio.run(_run_asgi(devices, voucher_requests, 2, 0, authority_kwargs))
+    assert timings.errors == {
+        "/.well-known/lake-authz/voucher-request": 1,
+        "flow: onboard device": 1,
+    }
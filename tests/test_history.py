@@ -0,0 +1,91 @@
+import json
+import multiprocessing
+
+from history import History
+
+
+def record(history, timestamp, id_="1", kind="attestation"):
+    history.record(kind, timestamp, id_, {"timestamp": timestamp}, f"message {timestamp}")
+
+
+def timestamps(items):
+    return [item["timestamp"] for item in items]
+
+
+def test_late_records_are_ordered_by_timestamp():
+    history = History()
+    # the results relayed from another worker arrive after newer local ones
+    for timestamp in (10, 40, 20, 50, 30):
+        record(history, timestamp)
+    items, cursor = history.query()
+    assert timestamps(items) == [50, 40, 30, 20, 10]
+    assert cursor is None
+    items, _ = history.query(since=20, until=40)
+    assert timestamps(items) == [40, 30, 20]
+    assert history.recent_messages(2) == ["message 40", "message 50"]
+
+
+def test_pages_follow_the_cursor():
+    history = History()
+    for timestamp in (10, 40, 20, 50, 30):
+        record(history, timestamp, id_=str(timestamp % 20))
+    items, cursor = history.query(limit=2)
+    assert timestamps(items) == [50, 40]
+    items, cursor = history.query(cursor=cursor, limit=2)
+    assert timestamps(items) == [30, 20]
+    items, cursor = history.query(cursor=cursor, limit=2)
+    assert timestamps(items) == [10]
+    assert cursor is None
+    items, _ = history.query(id_="10")
+    assert timestamps(items) == [50, 30, 10]
+    items, cursor = history.query(id_="10", limit=1)
+    items, _ = history.query(id_="10", cursor=cursor)
+    assert timestamps(items) == [30, 10]
+
+
+def test_trimming_keeps_the_newest_records():
+    history = History(capacity=8)
+    for timestamp in range(100):
+        record(history, timestamp, id_=str(timestamp % 3))
+    assert 8 <= len(history) <= 10
+    items, _ = history.query()
+    assert timestamps(items) == list(range(99, 99 - len(history), -1))
+    items, _ = history.query(id_="0")
+    assert all(item["timestamp"] % 3 == 0 for item in items)
+    assert history.query(cursor=1) == ([], None)
+
+
+def test_records_are_written_and_reloaded(tmp_path):
+    path = tmp_path / "history.jsonl"
+    history = History(path)
+    for timestamp in (10, 30, 20):
+        record(history, timestamp)
+    history.record("authorization", 40, "2", {"timestamp": 40}, "relayed", persist=False)
+    history.close()
+    assert len(path.read_text().splitlines()) == 3
+    reloaded = History(path)
+    items, _ = reloaded.query()
+    assert timestamps(items) == [30, 20, 10]
+    reloaded.close()
+
+
+def append_records(path, first):
+    history = History(path)
+    data = {"padding": "x" * 3000}
+    for timestamp in range(first, first + 1000):
+        history.record("attestation", timestamp, "1", data, "message")
+    history.close()
+
+
+def test_workers_sharing_the_file_write_whole_lines(tmp_path):
+    path = tmp_path / "history.jsonl"
+    workers = [
+        multiprocessing.get_context("fork").Process(target=append_records, args=(path, first))
+        for first in (0, 1000, 2000)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    lines = path.read_bytes().splitlines()
+    assert sorted(json.loads(line)[1] for line in lines) == list(range(3000))
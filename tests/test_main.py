@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+import crypto_executor
+import main
+import nonce_store
+
+
+def test_choices_match_the_application():
+    assert main.EXECUTOR_KINDS == crypto_executor.EXECUTOR_KINDS
+    assert main.NONCE_MODES == nonce_store.NONCE_MODES
+
+
+def test_help_does_not_import_the_application():
+    code = (
+        "import sys; sys.argv = ['main.py', '--help']\n"
+        "import main\n"
+        "try:\n"
+        "    main.main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print(sorted({'lakers', 'cbor2', 'authority'} & set(sys.modules)))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(main.__file__),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.splitlines()[-1] == "[]"
+
+
+def test_approvals_need_a_single_worker(tmp_path):
+    from click.testing import CliRunner
+
+    result = CliRunner().invoke(
+        main.main,
+        ["--workers", "2", "--state", str(tmp_path / "state.db"), "--approval-timeout", "5"],
+    )
+    assert result.exit_code == 2
+    assert "--approval-timeout runs in a single worker" in result.output
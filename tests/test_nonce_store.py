@@ -0,0 +1,111 @@
+from nonce_store import NONCE_SIZE, HmacNonceIssuer, NonceStore, ReplayFilter
+from state import SqliteReplayFilter
+
+SECRET = b"\x01" * 32
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_nonce_is_single_use():
+    store = NonceStore(ttl=30.0)
+    nonce = store.issue(1)
+    assert len(nonce) == NONCE_SIZE
+    assert not store.verify(1, b"\x00" * NONCE_SIZE)
+    # the failed check consumed it too
+    assert not store.verify(1, nonce)
+    nonce = store.issue(1)
+    assert store.verify(1, nonce)
+    assert not store.verify(1, nonce)
+    assert store.consumed == 2
+
+
+def test_nonce_expires_after_ttl():
+    clock = Clock()
+    store = NonceStore(ttl=30.0, clock=clock)
+    nonce = store.issue(1)
+    clock.now = 29.9
+    assert 1 in store
+    clock.now = 30.0
+    assert 1 not in store
+    assert store.consume(1) is None
+    assert store.expirations == 1
+    assert len(store) == 0
+    nonce = store.issue(1)
+    clock.now = 59.9
+    assert store.verify(1, nonce)
+
+
+def test_new_nonce_replaces_pending_one():
+    store = NonceStore()
+    first = store.issue(1)
+    second = store.issue(1)
+    assert len(store) == 1
+    assert not store.verify(1, first)
+    store.issue(1)
+    assert not store.verify(1, second)
+
+
+def test_full_store_evicts_oldest():
+    store = NonceStore(capacity=2)
+    store.issue(1)
+    store.issue(2)
+    store.issue(3)
+    assert 1 not in store and 2 in store and 3 in store
+    assert store.evictions == 1
+
+
+def test_hmac_nonce_window():
+    clock = Clock()
+    issuer = HmacNonceIssuer(SECRET, ttl=40.0, clock=clock)
+    # issued 5 s into its 10 s epoch, accepted until the end of it plus ttl
+    clock.now = 15.0
+    nonces = [issuer.issue(1) for _ in range(3)]
+    assert issuer.verify(1, nonces[0])
+    clock.now = 59.9
+    assert issuer.verify(1, nonces[1])
+    clock.now = 60.0
+    assert not issuer.verify(1, nonces[2])
+    assert issuer.expirations == 1
+
+
+def test_hmac_nonce_is_bound_to_cid():
+    issuer = HmacNonceIssuer(SECRET)
+    nonce = issuer.issue(1)
+    assert not issuer.verify(2, nonce)
+    assert not HmacNonceIssuer(b"\x02" * 32).verify(1, nonce)
+    assert issuer.verify(1, nonce)
+
+
+def test_hmac_nonce_is_single_use():
+    issuer = HmacNonceIssuer(SECRET)
+    nonce = issuer.issue(1)
+    assert issuer.verify(1, nonce)
+    assert not issuer.verify(1, nonce)
+    assert issuer.replays == 1
+
+
+def test_full_replay_filter_rejects_instead_of_evicting(tmp_path):
+    clock = Clock()
+    for replay_filter in (
+        ReplayFilter(capacity=2, clock=clock),
+        SqliteReplayFilter(str(tmp_path / "state.db"), capacity=2, clock=clock),
+    ):
+        issuer = HmacNonceIssuer(SECRET, ttl=40.0, replay_filter=replay_filter, clock=clock)
+        clock.now = 0.0
+        first, second, third = (issuer.issue(1) for _ in range(3))
+        assert issuer.verify(1, first)
+        assert issuer.verify(1, second)
+        assert not issuer.verify(1, third)
+        assert issuer.overflows == 1
+        # no used nonce was forgotten to make room
+        assert not issuer.verify(1, first)
+        assert issuer.replays == 1
+        # room is made as the used nonces expire
+        clock.now = 50.0
+        assert issuer.verify(1, issuer.issue(1))
@@ -0,0 +1,43 @@
+import asyncio
+import json
+import os
+
+from reference_values import HASH_ALG_SHA256, ReferenceValueStore
+
+DIGEST = "5e0b9ca06bd0fe8af89142525d50d6b197393d3102d7a4b08c52e8f786fc67e4"
+
+
+def write(path, version, values, mtime_ns):
+    path.write_text(json.dumps({"version": version, "reference_values": values}))
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_match_and_older_version(tmp_path):
+    path = tmp_path / "reference-values.json"
+    write(path, 2, [{"software_name": "DotBot", "hash_alg": 1, "digest": DIGEST}], 1)
+    store = ReferenceValueStore(str(path))
+    assert store.match(bytes.fromhex(DIGEST), "DotBot", HASH_ALG_SHA256)
+    assert not store.match(bytes.fromhex(DIGEST), "Other")
+    write(path, 1, [], 2)
+    store.reload()
+    assert store.version == 2 and len(store) == 1
+
+
+def test_watch_survives_malformed_file(tmp_path):
+    path = tmp_path / "reference-values.json"
+    write(path, 1, [{"software_name": "DotBot", "digest": DIGEST}], 1)
+    store = ReferenceValueStore(str(path))
+
+    async def run():
+        task = asyncio.ensure_future(store.watch(interval=0.01))
+        write(path, 2, ["abc"], 2)
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        assert store.version == 1 and len(store) == 1
+        # fixed without changing the mtime: the broken file was retried
+        write(path, 2, [], 2)
+        await asyncio.sleep(0.1)
+        assert store.version == 2 and len(store) == 0
+        task.cancel()
+
+    asyncio.run(run())
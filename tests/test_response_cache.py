@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks")
+)
+
+from devices import SimulatedDevice, provision  # noqa: E402
+
+from authority import Authority  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Computation:
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        return f"response {self.calls}"
+
+
+def test_cached_response_until_ttl():
+    clock = Clock()
+    cache = ResponseCache(ttl=10.0, clock=clock)
+    compute = Computation()
+
+    async def scenario():
+        first = await cache.get_or_compute(b"key", compute)
+        clock.now = 9.9
+        second = await cache.get_or_compute(b"key", compute)
+        clock.now = 10.0
+        third = await cache.get_or_compute(b"key", compute)
+        return first, second, third
+
+    assert asyncio.run(scenario()) == ("response 1", "response 1", "response 2")
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_concurrent_requests_share_one_computation():
+    cache = ResponseCache()
+    compute = Computation()
+
+    async def scenario():
+        compute.release = asyncio.Event()
+        waiters = [
+            asyncio.create_task(cache.get_or_compute(b"key", compute)) for _ in range(5)
+        ]
+        await asyncio.sleep(0)
+        # a client going away does not cancel the computation of the others
+        waiters[0].cancel()
+        compute.release.set()
+        return await asyncio.gather(*waiters[1:])
+
+    assert asyncio.run(scenario()) == ["response 1"] * 4
+    assert compute.calls == 1
+    assert (cache.misses, cache.coalesced) == (1, 4)
+    assert len(cache) == 1
+
+
+def test_failures_are_not_cached():
+    cache = ResponseCache()
+
+    async def fail():
+        raise ValueError("malformed")
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await cache.get_or_compute(b"key", fail)
+
+    asyncio.run(scenario())
+    assert cache.misses == 2 and len(cache) == 0
+
+
+def test_retransmitted_voucher_request_is_answered_from_the_cache(tmp_path):
+    device = SimulatedDevice(0)
+    authority = Authority(
+        crypto_executor="inline",
+        evidence_executor="inline",
+        **provision([device], str(tmp_path)),
+    )
+    voucher_request = device.voucher_request()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=authority.api)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return [
+                await client.post(
+                    "/.well-known/lake-authz/voucher-request", content=voucher_request
+                )
+                for _ in range(2)
+            ]
+
+    try:
+        first, second = asyncio.run(scenario())
+    finally:
+        authority.stop([])
+    assert first.status_code == second.status_code == 200
+    assert first.content == second.content
+    assert authority.voucher_cache.metrics["hits"] == 1
+    assert authority.voucher_cache.metrics["misses"] == 1
@@ -0,0 +1,48 @@
+import asyncio
+import sqlite3
+import time
+
+from acl import AclStore
+from state import SqliteEventBus, SqliteNonceStore
+
+
+def test_nonce_shared_between_workers(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SqliteNonceStore(path), SqliteNonceStore(path)
+    nonce = first.issue(b"\x01")
+    assert len(second) == 1
+    assert second.verify(b"\x01", nonce)
+    assert not first.verify(b"\x01", nonce)
+
+
+def test_event_bus_relays_other_workers(tmp_path):
+    path = str(tmp_path / "state.db")
+    first, second = SqliteEventBus(path), SqliteEventBus(path)
+    first.publish("one")
+    second.publish("two")
+    assert second.poll() == ["one"]
+    assert first.poll() == ["two"]
+
+
+def test_acl_poll_does_not_block_on_a_writer(tmp_path):
+    path = str(tmp_path / "state.db")
+    acl = AclStore(path, default=[1])
+    writer = sqlite3.connect(path, isolation_level=None)
+
+    async def run():
+        stall = 0.0
+        task = asyncio.ensure_future(acl.watch(interval=0.01))
+        writer.execute("BEGIN IMMEDIATE")
+        writer.execute("INSERT INTO acl VALUES (2)")
+        for _ in range(20):
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stall = max(stall, time.perf_counter() - start - 0.01)
+        assert not task.done()
+        writer.execute("COMMIT")
+        await asyncio.sleep(0.2)
+        task.cancel()
+        return stall
+
+    assert asyncio.run(run()) < 0.1
+    assert acl.to_list() == [1, 2]